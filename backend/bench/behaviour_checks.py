@@ -0,0 +1,597 @@
+'''
+Поведенческие проверки функций на пересоздаваемой схеме bench: сценарии,
+которые не выразить в tests.json (токены и id из предыдущих ответов,
+заголовки ответа, состояние БД после запроса). Соединения открываются
+в часовом поясе PGTZ (по умолчанию Europe/Berlin), чтобы ловить сдвиги
+при переходе на летнее время. Печатает результат каждой проверки
+и завершается с кодом 1, если хотя бы одна не прошла.
+
+    BENCH_DATABASE_URL=postgresql://localhost/boxing_bench \
+        python backend/bench/behaviour_checks.py [-k подстрока имени]
+'''
+import argparse
+import importlib.util
+import os
+import sys
+import traceback
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+os.environ.setdefault('REVOCATION_REFRESH_SECONDS', '0')
+os.environ.setdefault('PGTZ', 'Europe/Berlin')
+
+from handlers import BACKEND_DIR, FUNCTIONS, load_handler_module
+from localdb import prepare_database, scratch_dsn
+from scenario import body_of, call, plain_connection, seed
+
+CHECKS: List[Tuple[str, Callable[['Context'], None]]] = []
+PASSWORD = 'secret1'
+
+def check(name: str) -> Callable[[Callable[['Context'], None]], Callable[['Context'], None]]:
+    def register(function: Callable[['Context'], None]) -> Callable[['Context'], None]:
+        CHECKS.append((name, function))
+        return function
+    return register
+
+class CheckFailed(AssertionError):
+    pass
+
+def expect(condition: Any, message: str) -> None:
+    if not condition:
+        raise CheckFailed(message)
+
+def expect_status(response: Dict[str, Any], status: int, step: str) -> Any:
+    expect(response['statusCode'] == status, f"{step}: ожидался {status}, получен {response['statusCode']}: {response['body']}")
+    return body_of(response)
+
+class Context:
+    '''
+    Общая схема для всех проверок: каждая заводит своих пользователей
+    и клиентов, поэтому порядок проверок не важен
+    '''
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.fn = {name: load_handler_module(name) for name in FUNCTIONS}
+        self.users = 0
+        self.fresh_modules = 0
+
+    def register(self, role: str = 'client') -> Tuple[str, int]:
+        self.users += 1
+        email = f'behaviour{self.users}@example.com'
+        body = expect_status(call(self.fn['auth'], 'POST', {
+            'action': 'register', 'email': email, 'password': PASSWORD, 'full_name': f'Проверка {self.users}'
+        }), 201, 'register')
+        if role != 'client':
+            self.execute("UPDATE users SET role = %s WHERE id = %s", (role, body['user']['id']))
+        return body['token'], body['user']['id']
+
+    def login(self, user_id: int) -> str:
+        email = self.query("SELECT email FROM users WHERE id = %s", (user_id,))[0][0]
+        return expect_status(call(self.fn['auth'], 'POST', {'action': 'login', 'email': email, 'password': PASSWORD}), 200, 'login')['token']
+
+    def query(self, sql: str, params: Any = None) -> List[Tuple[Any, ...]]:
+        conn = plain_connection(self.dsn)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                rows = cur.fetchall() if cur.description else []
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+
+    def execute(self, sql: str, params: Any = None) -> None:
+        self.query(sql, params)
+
+    def subscribe(self, user_id: int, sessions: int = 8) -> int:
+        return self.query("""
+            INSERT INTO subscriptions (user_id, subscription_type, total_sessions, used_sessions, start_date, end_date, status)
+            VALUES (%s, 'Проверка', %s, 0, CURRENT_DATE, CURRENT_DATE + 3650, 'active') RETURNING id
+        """, (user_id, sessions))[0][0]
+
+    def slots(self, day: str, hours: List[int], status: str = 'available') -> List[int]:
+        return [row[0] for row in self.query("""
+            INSERT INTO training_slots (slot_date, slot_time, status)
+            SELECT %s, make_time(h, 0, 0), %s FROM unnest(%s::integer[]) AS h
+            ORDER BY h RETURNING id
+        """, (day, status, hours))]
+
+    def client(self, phone: str, sessions: int = 10) -> int:
+        client_id = self.query("INSERT INTO clients (full_name, phone) VALUES ('Проверка', %s) RETURNING id", (phone,))[0][0]
+        self.execute("""
+            INSERT INTO subscriptions (client_id, type, total_sessions, remaining_sessions, valid_until)
+            VALUES (%s, 'Проверка', %s, %s, CURRENT_DATE + 3650)
+        """, (client_id, sessions, sessions))
+        return client_id
+
+    def revoke_out_of_id_order(self, late: str, early: str, between: Callable[[], None] = lambda: None) -> None:
+        '''
+        Отзывает токены как выход: late получает меньший id в revoked_tokens,
+        но коммитится после early и после вызова between
+        '''
+        profile = self.fn['profile']
+        connections = [plain_connection(self.dsn), plain_connection(self.dsn)]
+        try:
+            for conn, token in zip(connections, (late, early)):
+                claims = profile.read_signed_token(token)
+                expires_epoch = claims['exp'] if claims else int(datetime.now().timestamp()) + 3600
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE sessions SET expires_at = NOW() WHERE token_hash = %s", (profile.hash_token(token),))
+                    cur.execute("""
+                        INSERT INTO revoked_tokens (token_hash, expires_epoch) VALUES (%s, %s)
+                        ON CONFLICT (token_hash) DO NOTHING
+                    """, (profile.hash_token(token), expires_epoch))
+            connections[1].commit()
+            between()
+            connections[0].commit()
+        finally:
+            for conn in connections:
+                conn.close()
+
+    @contextmanager
+    def fresh_module(self, name: str, **env: str) -> Iterator[Any]:
+        '''
+        Отдельная копия функции, импортированная с переменными окружения env
+        (флаги читаются при импорте), со своим пустым пулом соединений
+        '''
+        previous = {key: os.environ.get(key) for key in env}
+        os.environ.update(env)
+        self.fresh_modules += 1
+        module_name = f'behaviour_{name}_{self.fresh_modules}'
+        try:
+            spec = importlib.util.spec_from_file_location(module_name, os.path.join(BACKEND_DIR, name, 'index.py'))
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            spec.loader.exec_module(module)
+            yield module
+        finally:
+            sys.modules.pop(module_name, None)
+            for key, value in previous.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+    @contextmanager
+    def signing_key(self, key: str) -> Iterator[None]:
+        '''
+        Включает подписанные токены во всех функциях, читающих ключ
+        '''
+        modules = [module for module in self.fn.values() if hasattr(module, 'SESSION_SIGNING_KEY')]
+        previous = [module.SESSION_SIGNING_KEY for module in modules]
+        for module in modules:
+            module.SESSION_SIGNING_KEY = key
+        try:
+            yield
+        finally:
+            for module, value in zip(modules, previous):
+                module.SESSION_SIGNING_KEY = value
+
+@check('подписанные токены двух входов подряд различаются')
+def signed_logins_in_a_row(ctx: Context) -> None:
+    with ctx.signing_key('behaviour-signing-key'):
+        _, user_id = ctx.register()
+        first = ctx.login(user_id)
+        second = ctx.login(user_id)
+        expect(first != second, 'два входа в одну секунду выдали одинаковый токен')
+
+        expect_status(call(ctx.fn['auth'], 'POST', {'action': 'logout'}, first), 200, 'logout')
+        expect_status(call(ctx.fn['profile'], 'GET', token=first), 401, 'профиль по отозванному токену')
+        expect_status(call(ctx.fn['profile'], 'GET', token=second), 200, 'профиль по второму токену')
+
+@check('отзыв подписанного токена, закоммиченный после отзыва с большим id, не теряется')
+def signed_revocations_out_of_id_order(ctx: Context) -> None:
+    with ctx.signing_key('behaviour-signing-key'):
+        _, user_id = ctx.register()
+        first, second = ctx.login(user_id), ctx.login(user_id)
+        for token in (first, second):
+            expect_status(call(ctx.fn['profile'], 'GET', token=token), 200, 'профиль до отзыва')
+        ctx.revoke_out_of_id_order(first, second, lambda: expect_status(
+            call(ctx.fn['profile'], 'GET', token=second), 401, 'профиль по токену с большим id'
+        ))
+        expect_status(call(ctx.fn['profile'], 'GET', token=first), 401, 'профиль по токену, отозванному позже')
+
+@check('выход отзывает непрозрачный токен в кэше сессий других функций')
+def logout_revokes_cached_sessions(ctx: Context) -> None:
+    token, _ = ctx.register()
+    expect_status(call(ctx.fn['profile'], 'GET', token=token), 200, 'профиль')
+    expect_status(call(ctx.fn['slots'], 'PUT', {'action': 'cancel', 'booking_id': 0}, token), 404, 'отмена чужой записи')
+    expect(ctx.fn['profile'].session_cache.get(ctx.fn['profile'].hash_token(token)), 'сессия не попала в кэш profile')
+
+    expect_status(call(ctx.fn['auth'], 'POST', {'action': 'logout'}, token), 200, 'logout')
+    expect_status(call(ctx.fn['profile'], 'GET', token=token), 401, 'профиль после выхода')
+    expect_status(call(ctx.fn['slots'], 'PUT', {'action': 'cancel', 'booking_id': 0}, token), 401, 'отмена после выхода')
+    expect_status(call(ctx.fn['auth'], 'POST', {'action': 'verify'}, token), 401, 'verify после выхода')
+
+@check('выход, закоммиченный после выхода с большим id, сбрасывает кэш сессий других функций')
+def opaque_revocations_out_of_id_order(ctx: Context) -> None:
+    first, _ = ctx.register()
+    second, _ = ctx.register()
+    for token in (first, second):
+        expect_status(call(ctx.fn['profile'], 'GET', token=token), 200, 'профиль до выхода')
+        expect_status(call(ctx.fn['slots'], 'PUT', {'action': 'cancel', 'booking_id': 0}, token), 404, 'отмена до выхода')
+    ctx.revoke_out_of_id_order(first, second, lambda: expect_status(
+        call(ctx.fn['profile'], 'GET', token=second), 401, 'профиль после выхода с большим id'
+    ))
+    expect_status(call(ctx.fn['profile'], 'GET', token=first), 401, 'профиль после выхода, закоммиченного позже')
+    expect_status(call(ctx.fn['slots'], 'PUT', {'action': 'cancel', 'booking_id': 0}, first), 401, 'отмена после выхода, закоммиченного позже')
+
+@check('generate_slots не сдвигает слоты при переходе на летнее и зимнее время')
+def generate_slots_across_dst(ctx: Context) -> None:
+    token, _ = ctx.register('admin')
+    template = ctx.query("""
+        INSERT INTO schedule_templates (day_of_week, start_time, end_time, slot_duration_minutes)
+        VALUES (0, '10:00', '13:00', 60) RETURNING id
+    """)[0][0]
+    try:
+        for sunday in ('2030-03-31', '2030-10-27'):
+            saturday = (date.fromisoformat(sunday) - timedelta(days=1)).isoformat()
+            expect_status(call(ctx.fn['slots'], 'POST', {'action': 'generate_slots', 'start_date': saturday, 'days': 3}, token), 200, 'generate_slots')
+            times = [str(row[0]) for row in ctx.query(
+                "SELECT slot_time FROM training_slots WHERE slot_date = %s ORDER BY slot_time", (sunday,)
+            )]
+            expect(times == ['10:00:00', '11:00:00', '12:00:00'], f'{sunday} ({os.environ["PGTZ"]}): слоты {times}')
+    finally:
+        ctx.execute("DELETE FROM schedule_templates WHERE id = %s", (template,))
+
+@check('generate_slots пропускает шаблоны с неположительной длительностью слота')
+def generate_slots_skips_broken_templates(ctx: Context) -> None:
+    token, _ = ctx.register('admin')
+    templates = [row[0] for row in ctx.query("""
+        INSERT INTO schedule_templates (day_of_week, start_time, end_time, slot_duration_minutes)
+        VALUES (3, '08:00', '10:00', 0), (3, '18:00', '20:00', -60), (3, '10:00', '12:00', 60)
+        RETURNING id
+    """)]
+    try:
+        expect_status(call(ctx.fn['slots'], 'POST', {'action': 'generate_slots', 'start_date': '2032-06-02', 'days': 1}, token), 200, 'generate_slots')
+        times = [str(row[0]) for row in ctx.query("SELECT slot_time FROM training_slots WHERE slot_date = '2032-06-02' ORDER BY slot_time")]
+        expect(times == ['10:00:00', '11:00:00'], f'слоты {times}')
+    finally:
+        ctx.execute("DELETE FROM schedule_templates WHERE id = ANY(%s)", (templates,))
+
+@check('постраничный список клиентов отдаёт каждого клиента ровно один раз')
+def clients_keyset_covers_all_rows(ctx: Context) -> None:
+    nullable = ctx.query("""
+        SELECT is_nullable FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'clients' AND column_name = 'created_at'
+    """)[0][0]
+    expect(nullable == 'NO', 'clients.created_at допускает NULL, курсор (created_at, id) потеряет такие строки')
+
+    token, _ = ctx.register('admin')
+    seen: List[int] = []
+    query = {'limit': '37'}
+    while True:
+        body = expect_status(call(ctx.fn['clients'], 'GET', token=token, query=query), 200, f'страница {len(seen) // 37 + 1}')
+        seen += [client['id'] for client in body['clients']]
+        if not body['next_cursor']:
+            break
+        query = {'limit': '37', 'cursor': body['next_cursor']}
+    expected = [row[0] for row in ctx.query("SELECT id FROM clients ORDER BY created_at DESC, id DESC")]
+    expect(seen == expected, f'страницы вернули {len(seen)} клиентов ({len(set(seen))} различных) из {len(expected)}')
+
+@check('повтор с тем же Idempotency-Key отдаёт сохранённый ответ, с другим телом 422')
+def idempotency_key_replay(ctx: Context) -> None:
+    key = {'Idempotency-Key': 'behaviour-client-create'}
+    client = {'full_name': 'Идемпотентная Проверка', 'phone': '+79990019001', 'email': 'idempotent@example.com'}
+    first = call(ctx.fn['clients'], 'POST', client, headers=key)
+    created = expect_status(first, 201, 'создание клиента')
+    replay = call(ctx.fn['clients'], 'POST', client, headers=key)
+    expect_status(replay, 201, 'повтор создания')
+    expect(replay['body'] == first['body'], f"повтор вернул {replay['body']} вместо {first['body']}")
+    expect(replay['headers'].get('Idempotent-Replayed') == 'true', f"нет заголовка Idempotent-Replayed: {replay['headers']}")
+    expect('Idempotent-Replayed' not in first['headers'], 'первый ответ помечен как повтор')
+    rows = ctx.query("SELECT id FROM clients WHERE phone = %s", (client['phone'],))
+    expect(rows == [(created['id'],)], f'повтор создал лишних клиентов: {rows}')
+
+    changed = dict(client, phone='+79990019002')
+    expect_status(call(ctx.fn['clients'], 'POST', changed, headers=key), 422, 'тот же ключ с другим телом')
+    expect(not ctx.query("SELECT 1 FROM clients WHERE phone = %s", (changed['phone'],)), 'запрос с чужим ключом выполнился')
+
+    ctx.execute("""
+        INSERT INTO subscriptions (client_id, type, total_sessions, remaining_sessions, valid_until)
+        VALUES (%s, 'Проверка', 10, 10, CURRENT_DATE + 30)
+    """, (created['id'],))
+    key = {'Idempotency-Key': 'behaviour-booking-create'}
+    booking = {'client_id': created['id'], 'booking_date': '2031-01-15', 'booking_time': '10:00'}
+    first = call(ctx.fn['bookings'], 'POST', booking, headers=key)
+    expect_status(first, 201, 'запись')
+    replay = call(ctx.fn['bookings'], 'POST', booking, headers=key)
+    expect(replay['statusCode'] == 201 and replay['body'] == first['body'], f"повтор записи: {replay['statusCode']} {replay['body']}")
+    expect(replay['headers'].get('Idempotent-Replayed') == 'true', 'повтор записи без Idempotent-Replayed')
+    remaining = ctx.query("SELECT remaining_sessions FROM subscriptions WHERE client_id = %s", (created['id'],))[0][0]
+    expect(remaining == 9, f'повтор списал занятие повторно: осталось {remaining}')
+    expect_status(call(ctx.fn['bookings'], 'POST', dict(booking, booking_time='12:00'), headers=key), 422, 'запись с чужим ключом')
+
+@check('календарь отвечает 304 на свой ETag и меняет ETag после записи и удаления записи')
+def calendar_etag(ctx: Context) -> None:
+    token, user_id = ctx.register()
+    ctx.subscribe(user_id)
+    slot_id = ctx.slots('2032-02-02', [10, 11])[0]
+    window = {'start_date': '2032-02-02', 'end_date': '2032-02-02'}
+
+    first = call(ctx.fn['slots'], 'GET', query=window)
+    expect_status(first, 200, 'календарь')
+    etag = first['headers']['ETag']
+    cached = call(ctx.fn['slots'], 'GET', query=window, headers={'If-None-Match': etag})
+    expect(cached['statusCode'] == 304 and cached['body'] == '', f"If-None-Match: {cached['statusCode']} {cached['body'][:80]}")
+    expect(cached['headers'].get('ETag') == etag, 'ответ 304 без того же ETag')
+    other = call(ctx.fn['slots'], 'GET', query={'start_date': '2032-02-02', 'end_date': '2032-02-03'}, headers={'If-None-Match': etag})
+    expect_status(other, 200, 'ETag другого диапазона')
+
+    expect_status(call(ctx.fn['slots'], 'POST', {'action': 'book', 'slot_id': slot_id}, token), 201, 'запись на слот')
+    after = call(ctx.fn['slots'], 'GET', query=window, headers={'If-None-Match': etag})
+    body = expect_status(after, 200, 'календарь после записи')
+    expect(after['headers']['ETag'] != etag, 'ETag не изменился после записи')
+    booked = [slot for slot in body['slots'] if slot['id'] == slot_id]
+    expect(booked and booked[0]['booking_id'], f'запись не видна в календаре: {booked}')
+
+    etag = after['headers']['ETag']
+    ctx.execute("DELETE FROM bookings WHERE slot_id = %s", (slot_id,))
+    removed = call(ctx.fn['slots'], 'GET', query=window, headers={'If-None-Match': etag})
+    body = expect_status(removed, 200, 'календарь после удаления записи')
+    expect(removed['headers']['ETag'] != etag, 'ETag не изменился после удаления записи')
+    freed = [slot for slot in body['slots'] if slot['id'] == slot_id]
+    expect(freed and freed[0]['booking_id'] is None, f'удалённая запись осталась в календаре: {freed}')
+
+@check('since отдаёт только изменённые и удалённые слоты после версии')
+def calendar_delta_since(ctx: Context) -> None:
+    token, user_id = ctx.register()
+    ctx.subscribe(user_id)
+    version = expect_status(call(ctx.fn['slots'], 'GET', query={'start_date': '2032-03-03', 'end_date': '2032-03-03'}), 200, 'календарь')['version']
+    booked, untouched, removed = ctx.slots('2032-03-03', [10, 11, 12])
+    expect_status(call(ctx.fn['slots'], 'POST', {'action': 'book', 'slot_id': booked}, token), 201, 'запись на слот')
+
+    delta = expect_status(call(ctx.fn['slots'], 'GET', query={'since': str(version)}), 200, 'since после добавления')
+    expect(delta['version'] > version and delta['deleted'] == [], f'delta: {delta}')
+    changed = {slot['id']: slot for slot in delta['slots']}
+    expect(set(changed) == {booked, untouched, removed}, f'изменённые слоты {sorted(changed)}')
+    expect(changed[booked]['booking_id'] and changed[untouched]['booking_id'] is None, f'занятость в delta: {changed}')
+
+    version = delta['version']
+    ctx.execute("DELETE FROM training_slots WHERE id = %s", (removed,))
+    booking_id = ctx.query("SELECT id FROM bookings WHERE slot_id = %s AND status = 'active'", (booked,))[0][0]
+    expect_status(call(ctx.fn['slots'], 'PUT', {'action': 'cancel', 'booking_id': booking_id}, token), 200, 'отмена записи')
+    delta = expect_status(call(ctx.fn['slots'], 'GET', query={'since': str(version)}), 200, 'since после удаления и отмены')
+    expect(delta['deleted'] == [removed], f"удалённые слоты {delta['deleted']}")
+    expect([(slot['id'], slot['booking_id']) for slot in delta['slots']] == [(booked, None)], f"изменённые слоты {delta['slots']}")
+
+    current = expect_status(call(ctx.fn['slots'], 'GET', query={'since': str(delta['version'])}), 200, 'since текущей версии')
+    expect(current == {'version': delta['version'], 'slots': [], 'deleted': []}, f'без изменений: {current}')
+    ahead = expect_status(call(ctx.fn['slots'], 'GET', query={'since': str(delta['version'] + 100)}), 200, 'since из будущего')
+    expect(ahead.get('resync') is True, f'since из будущего без resync: {ahead}')
+
+@check('book_batch all_or_nothing откатывает всё с 409, best_effort записывает часть с 201')
+def batch_booking_modes(ctx: Context) -> None:
+    token, user_id = ctx.register()
+    subscription = ctx.subscribe(user_id)
+    free = ctx.slots('2032-04-04', [10, 11])
+    taken = ctx.slots('2032-04-04', [12], status='booked')
+    request = {'action': 'book_batch', 'slot_ids': free + taken}
+
+    body = expect_status(call(ctx.fn['slots'], 'POST', dict(request, mode='all_or_nothing'), token), 409, 'all_or_nothing')
+    statuses = {result['slot_id']: result['status'] for result in body['results']}
+    expect(body['booked'] == 0 and statuses == {free[0]: 'rolled_back', free[1]: 'rolled_back', taken[0]: 'unavailable'}, f'all_or_nothing: {body}')
+    expect(not ctx.query("SELECT 1 FROM bookings WHERE user_id = %s", (user_id,)), 'all_or_nothing оставил записи')
+    state = ctx.query("SELECT status FROM training_slots WHERE id = ANY(%s) ORDER BY id", (free,))
+    expect(state == [('available',), ('available',)], f'all_or_nothing оставил слоты занятыми: {state}')
+    used = ctx.query("SELECT used_sessions FROM subscriptions WHERE id = %s", (subscription,))[0][0]
+    expect(used == 0, f'all_or_nothing списал {used} занятий')
+
+    body = expect_status(call(ctx.fn['slots'], 'POST', dict(request, mode='best_effort'), token), 201, 'best_effort')
+    statuses = {result['slot_id']: result['status'] for result in body['results']}
+    expect(body['booked'] == 2 and statuses == {free[0]: 'booked', free[1]: 'booked', taken[0]: 'unavailable'}, f'best_effort: {body}')
+    rows = ctx.query("SELECT slot_id FROM bookings WHERE user_id = %s AND status = 'active' ORDER BY slot_id", (user_id,))
+    expect(rows == [(slot_id,) for slot_id in free], f'best_effort записал {rows}')
+    used = ctx.query("SELECT used_sessions FROM subscriptions WHERE id = %s", (subscription,))[0][0]
+    expect(used == 2, f'best_effort списал {used} занятий вместо 2')
+
+@check('импорт отклоняет дубли в файле и существующие телефоны с отчётом по строкам')
+def client_import_dedupe(ctx: Context) -> None:
+    existing = ctx.query("SELECT phone FROM clients ORDER BY id LIMIT 1")[0][0]
+    data = '\n'.join([
+        'full_name,phone,email,subscription_type,total_sessions,valid_until',
+        'Импорт Первый,+79990016001,import1@example.com,Месяц,8,2040-01-31',
+        'Импорт Дубль,+79990016001,import-dup@example.com,,,',
+        f'Импорт Существующий,{existing},,,,',
+        'Импорт Почта,+79990016002,import1@example.com,,,',
+        'Импорт Без Телефона,,,,,',
+        'Импорт Второй,+79990016003,,,,',
+    ])
+    body = expect_status(call(ctx.fn['clients'], 'POST', {'action': 'import', 'format': 'csv', 'data': data}), 200, 'импорт csv')
+    expect((body['accepted'], body['rejected']) == (2, 4), f"принято {body['accepted']}, отклонено {body['rejected']}")
+    report = {row['line']: row for row in body['rows']}
+    expect(sorted(report) == [2, 3, 4, 5, 6, 7], f'строки отчёта {sorted(report)}')
+    expected = {
+        3: 'Телефон повторяется в файле',
+        4: 'Клиент с таким телефоном уже есть',
+        5: 'Email повторяется в файле',
+        6: 'Нужны full_name и phone'
+    }
+    for line, error in expected.items():
+        expect(report[line] == {'line': line, 'status': 'rejected', 'error': error}, f'строка {line}: {report[line]}')
+    expect(report[2]['status'] == 'accepted' and report[2]['subscription_id'], f'строка 2: {report[2]}')
+    expect(report[7]['status'] == 'accepted' and report[7]['subscription_id'] is None, f'строка 7: {report[7]}')
+
+    rows = ctx.query("""
+        SELECT c.id, c.phone, s.id FROM clients c LEFT JOIN subscriptions s ON s.client_id = c.id
+        WHERE c.phone IN ('+79990016001', '+79990016002', '+79990016003', %s) ORDER BY c.phone
+    """, (existing,))
+    expect([(phone, sub) for _, phone, sub in rows if phone != existing] == [
+        ('+79990016001', report[2]['subscription_id']), ('+79990016003', None)
+    ], f'клиенты после импорта: {rows}')
+    expect(sum(1 for _, phone, _ in rows if phone == existing) == 1, 'импорт продублировал существующего клиента')
+
+    lines = '{"full_name": "Импорт Jsonl", "phone": "+79990016004"}\nне json\n{"full_name": "Импорт Jsonl", "phone": "+79990016001"}'
+    body = expect_status(call(ctx.fn['clients'], 'POST', {'action': 'import', 'format': 'jsonl', 'data': lines}), 200, 'импорт jsonl')
+    expect([(row['line'], row['status']) for row in body['rows']] == [(1, 'accepted'), (2, 'rejected'), (3, 'rejected')], f"jsonl: {body['rows']}")
+
+@check('маски day_availability следуют за записью, переносом и отменой')
+def day_availability_masks(ctx: Context) -> None:
+    client_id = ctx.client('+79990017001')
+    bookings = ctx.fn['bookings']
+
+    def free_mask(day: str) -> int:
+        body = expect_status(call(bookings, 'GET', query={'month': '2033-05'}), 200, 'календарь месяца')
+        return next(item['mask'] for item in body['days'] if item['date'] == day)
+
+    def expect_masks(step: str, masks: Dict[str, int]) -> None:
+        for day, booked in masks.items():
+            mask = free_mask(day)
+            expect(mask == bookings.AVAILABILITY_FULL_MASK & ~booked, f'{step}: {day} свободно {mask:013b}, ожидалось занято {booked:013b}')
+        stale = ctx.query("""
+            SELECT d.day, d.booked_mask, COALESCE(bit_or(booking_hours_mask(b.booking_time, b.duration_minutes)), 0)
+            FROM day_availability d
+            LEFT JOIN bookings b ON b.booking_date = d.day AND b.status NOT IN ('cancelled', 'canceled')
+            WHERE d.day BETWEEN '2033-05-01' AND '2033-05-31'
+            GROUP BY d.day, d.booked_mask
+            HAVING d.booked_mask <> COALESCE(bit_or(booking_hours_mask(b.booking_time, b.duration_minutes)), 0)
+        """)
+        expect(not stale, f'{step}: маски расходятся с bookings: {stale}')
+
+    created = []
+    for booking_time, duration in (('10:00', 60), ('14:00', 90)):
+        body = expect_status(call(bookings, 'POST', {
+            'client_id': client_id, 'booking_date': '2033-05-10', 'booking_time': booking_time, 'duration_minutes': duration
+        }), 201, f'запись на {booking_time}')
+        created.append(body['id'])
+    expect_masks('после записи', {'2033-05-10': 1 << 1 | 1 << 5 | 1 << 6, '2033-05-11': 0})
+    day = expect_status(call(bookings, 'GET', query={'date': '2033-05-10'}), 200, 'слоты дня')
+    busy = [slot['booking_time'] for slot in day['bookings'] if not slot['available']]
+    expect(busy == ['10:00:00', '14:00:00', '15:00:00'], f'занятые часы дня: {busy}')
+
+    expect_status(call(bookings, 'PUT', {'action': 'reschedule', 'id': created[1], 'new_date': '2033-05-11', 'new_time': '09:00'}), 200, 'перенос')
+    expect_masks('после переноса', {'2033-05-10': 1 << 1, '2033-05-11': 1 << 0 | 1 << 1})
+
+    expect_status(call(bookings, 'PUT', {'action': 'cancel', 'id': created[0]}), 200, 'отмена')
+    expect_masks('после отмены', {'2033-05-10': 0, '2033-05-11': 1 << 0 | 1 << 1})
+
+@check('кэш профиля сбрасывается при записи и отмене через profile_version')
+def profile_cache_follows_version(ctx: Context) -> None:
+    token, user_id = ctx.register()
+    ctx.subscribe(user_id)
+    slot_id = ctx.slots('2032-05-05', [10])[0]
+    profile, cache = ctx.fn['profile'], ctx.fn['profile'].profile_cache
+
+    def fetch(step: str, hit: bool) -> Dict[str, Any]:
+        before = dict(cache.counters)
+        body = expect_status(call(profile, 'GET', token=token), 200, step)
+        counter = 'hits' if hit else 'misses'
+        expect(cache.counters[counter] == before[counter] + 1, f"{step}: ожидался {counter}, счётчики {before} -> {cache.counters}")
+        return body
+
+    fetch('первый профиль', hit=False)
+    empty = fetch('повтор профиля', hit=True)
+    expect(empty['bookings'] == [], f"записи до записи: {empty['bookings']}")
+
+    expect_status(call(ctx.fn['slots'], 'POST', {'action': 'book', 'slot_id': slot_id}, token), 201, 'запись на слот')
+    booked = fetch('профиль после записи', hit=False)
+    expect([booking['status'] for booking in booked['bookings']] == ['active'], f"записи после записи: {booked['bookings']}")
+    expect(fetch('повтор после записи', hit=True) == booked, 'повтор из кэша отличается от ответа БД')
+
+    booking_id = booked['bookings'][0]['id']
+    expect_status(call(ctx.fn['slots'], 'PUT', {'action': 'cancel', 'booking_id': booking_id}, token), 200, 'отмена')
+    cancelled = fetch('профиль после отмены', hit=False)
+    expect(cancelled['bookings'] == [], f"отменённая запись осталась в профиле: {cancelled['bookings']}")
+    expect(cancelled['subscriptions'] == empty['subscriptions'], f"абонемент после отмены: {cancelled['subscriptions']}")
+
+@check('короткий номер не включает поиск по префиксу телефона')
+def client_search_short_phone(ctx: Context) -> None:
+    build = ctx.fn['clients'].client_search_query
+    for query in ('+7 9', '79', '8-91'):
+        condition, prefix_match, _ = build(query)
+        expect('phone' not in condition and 'phone' not in prefix_match, f'{query!r}: {condition}')
+    condition, prefix_match, params = build('+7 900 1')
+    expect('phone' in condition and 'phone' in prefix_match, f"'+7 900 1' без поиска по телефону: {condition}")
+    expect((params['phone_prefix'], params['phone_pattern']) == ('79001%', '%79001%'), f'шаблоны телефона: {params}')
+
+@check('короткий кусок имени ищется только по префиксу, без pg_trgm')
+def client_search_short_fragment(ctx: Context) -> None:
+    build = ctx.fn['clients'].client_search_query
+    for query in ('ова', 'ева', 'иван'):
+        condition, _, params = build(query)
+        expect('<%' not in condition and params['pattern'] == query + '%', f'{query!r}: {condition} {params}')
+    condition, _, params = build('иванов')
+    expect('<%' in condition and params['pattern'] == '%иванов%', f"'иванов' без поиска по подстроке: {condition}")
+
+@check('длинный опрос since не спит, если NOTIFY пришёл вместе с ответом на запрос')
+def long_poll_sees_parsed_notify(ctx: Context) -> None:
+    slots = ctx.fn['slots']
+    listener, sender = plain_connection(ctx.dsn), plain_connection(ctx.dsn)
+    try:
+        listener.autocommit = sender.autocommit = True
+        with listener.cursor() as cur:
+            cur.execute("LISTEN slot_changes")
+        with sender.cursor() as cur:
+            cur.execute("NOTIFY slot_changes")
+        with listener.cursor() as cur:
+            cur.execute("SELECT version FROM slot_calendar_version")
+            version = cur.fetchone()[0]
+        expect(listener.notifies, 'NOTIFY не разобран вместе с ответом на SELECT')
+
+        started = datetime.now()
+        changed = slots.wait_for_slot_changes(listener, version, 3)
+        waited = (datetime.now() - started).total_seconds()
+        expect(changed and waited < 1, f'ожидание вернуло {changed} через {waited:.1f} с')
+        expect(not listener.notifies, f'после ожидания остались уведомления: {listener.notifies}')
+    finally:
+        listener.close()
+        sender.close()
+
+@check('action=metrics и гистограммы задержек работают с замерами SQL и без них')
+def metrics_with_and_without_request_timing(ctx: Context) -> None:
+    admin, _ = ctx.register('admin')
+    client, _ = ctx.register()
+    for enabled in ('0', '1'):
+        with ctx.fresh_module('slots', REQUEST_TIMING_ENABLED=enabled) as slots:
+            step = f'REQUEST_TIMING_ENABLED={enabled}'
+            expect_status(call(slots, 'GET', query={'action': 'metrics'}), 401, f'{step}: метрики без токена')
+            expect_status(call(slots, 'GET', token=client, query={'action': 'metrics'}), 403, f'{step}: метрики клиента')
+            calendar = call(slots, 'GET', token=client, query={'action': 'calendar'})
+            expect_status(calendar, 200, f'{step}: календарь')
+            expect(('Server-Timing' in calendar['headers']) == (enabled == '1'), f"{step}: заголовки календаря {sorted(calendar['headers'])}")
+
+            response = call(slots, 'GET', token=admin, query={'action': 'metrics'})
+            expect(response['statusCode'] == 200, f"{step}: метрики администратора: {response['statusCode']}")
+            expect('http_request_duration_seconds_count{function="slots",endpoint="GET action"} 1' in response['body'],
+                   f'{step}: вызовы не попали в гистограмму задержек')
+            expect(('db_round_trips_per_request_count{function="slots",endpoint="GET action"}' in response['body']) == (enabled == '1'),
+                   f'{step}: гистограмма обращений к БД пишется только при замерах SQL')
+
+@check('action=metrics отвечает JSON-ошибкой на неверное тело и недоступную БД')
+def metrics_errors_are_json(ctx: Context) -> None:
+    admin, _ = ctx.register('admin')
+    slots = ctx.fn['slots']
+    for body in ('{"action": "metrics", "reset": ', '[{"action": "metrics"}]'):
+        response = slots.handler({'httpMethod': 'POST', 'headers': {'X-Auth-Token': admin}, 'queryStringParameters': None, 'body': body}, None)
+        expect_status(response, 400, f'тело {body!r}')
+    with ctx.fresh_module('slots', DATABASE_URL='postgresql://127.0.0.1:1/unreachable?connect_timeout=2') as offline:
+        body = expect_status(call(offline, 'GET', token=admin, query={'action': 'metrics'}), 500, 'метрики без БД')
+        expect(body.get('error'), f'ответ без error: {body}')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', dest='pattern', help='запустить только проверки, в имени которых есть подстрока')
+    args = parser.parse_args()
+
+    dsn = prepare_database(scratch_dsn())
+    os.environ['DATABASE_URL'] = dsn
+    seed(dsn, users=200, clients=200, days=30)
+    ctx = Context(dsn)
+
+    failed = 0
+    for name, function in CHECKS:
+        if args.pattern and args.pattern not in name:
+            continue
+        try:
+            function(ctx)
+            print(f'  ok    {name}')
+        except Exception as e:
+            failed += 1
+            print(f'  FAIL  {name}: {e}')
+            if not isinstance(e, CheckFailed):
+                traceback.print_exc()
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+'''
+Микробенчмарк обработчиков без БД: psycopg2.connect подменяется фейковым
+соединением, курсоры которого отвечают заготовленными строками и считают
+открытые соединения, выполненные запросы, обращения к серверу (запросы,
+FETCH/CLOSE серверных курсоров, COMMIT/ROLLBACK) и прочитанные строки.
+Время на запрос при этом - чистые накладные расходы Python (разбор события,
+сборка dict, json), доля json оценивается через cProfile.
+
+Первый вызов каждого действия идёт на новом пуле: cold_connections - сколько
+соединений открывает холодный контейнер, connections - сколько их нужно
+тёплому на следующий вызов (ожидается 0).
+
+Падает (код 1), если для какого-либо действия число соединений, запросов
+или обращений к серверу выросло относительно roundtrips_baseline.json.
+
+    python backend/bench/bench_handler_roundtrips.py --iterations 2000
+    python backend/bench/bench_handler_roundtrips.py --update-baseline
+'''
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import sys
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+os.environ.setdefault('REQUEST_TIMING_ENABLED', '0')
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from psycopg2.extras import RealDictCursor
+
+from handlers import load_handler_module
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'roundtrips_baseline.json')
+GUARDED = ('connections', 'statements', 'round_trips')
+BASELINE_KEYS = GUARDED + ('cold_connections',)
+Column = namedtuple('Column', ['name', 'type_code'])
+TYPE_OIDS = [(bool, 16), (int, 23), (float, 701), (Decimal, 1700), (datetime, 1114), (date, 1082), (time, 1083), (str, 25)]
+
+counters: Dict[str, int] = dict.fromkeys(GUARDED + ('rows',), 0)
+
+def type_oid(value: Any) -> int:
+    for kind, oid in TYPE_OIDS:
+        if isinstance(value, kind):
+            return oid
+    return 25
+
+class FakeCursor:
+    def __init__(self, conn: 'FakeConnection', name: Optional[str], as_dicts: bool):
+        self.conn = conn
+        self.name = name
+        self.as_dicts = as_dicts
+        self.itersize = 2000
+        self.description = None
+        self.rowcount = -1
+        self._rows: List[Any] = []
+        self._declared = False
+
+    def execute(self, query: Any, vars: Any = None) -> None:
+        counters['statements'] += 1
+        counters['round_trips'] += 1
+        self.conn.begin()
+        rows = self.conn.respond(str(query), vars)
+        self.rowcount = len(rows)
+        self.description = [Column(name, type_oid(value)) for name, value in rows[0].items()] if rows else None
+        self._rows = [row if self.as_dicts else tuple(row.values()) for row in rows]
+        self._declared = self.name is not None
+
+    def copy_expert(self, sql: str, file: Any, size: int = 8192) -> None:
+        counters['statements'] += 1
+        counters['round_trips'] += 1
+        self.conn.begin()
+
+    def _take(self, count: int) -> List[Any]:
+        if self.name is not None:
+            counters['round_trips'] += 1
+        taken, self._rows = self._rows[:count], self._rows[count:]
+        counters['rows'] += len(taken)
+        return taken
+
+    def fetchone(self) -> Any:
+        taken = self._take(1)
+        return taken[0] if taken else None
+
+    def fetchmany(self, size: Optional[int] = None) -> List[Any]:
+        return self._take(size or 1)
+
+    def fetchall(self) -> List[Any]:
+        return self._take(len(self._rows))
+
+    def __iter__(self) -> Any:
+        return iter(self.fetchall())
+
+    def close(self) -> None:
+        if self._declared:
+            counters['round_trips'] += 1
+            self._declared = False
+
+    def __enter__(self) -> 'FakeCursor':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+class FakeConnection:
+    '''
+    Соединение без сервера: ответ на запрос - строки первого правила,
+    подстрока которого встречается в SQL (dict для RealDictCursor, иначе кортежи)
+    '''
+    cursor_factory = None
+    notifies: List[Any] = []
+
+    def __init__(self, rules: List[Tuple[str, Any]]):
+        self.rules = rules
+        self.closed = 0
+        self.autocommit = False
+        self._status = TRANSACTION_STATUS_IDLE
+
+    def respond(self, sql: str, vars: Any) -> List[Dict[str, Any]]:
+        for fragment, rows in self.rules:
+            if fragment in sql:
+                return rows(vars) if callable(rows) else rows
+        return []
+
+    def begin(self) -> None:
+        if not self.autocommit:
+            self._status = TRANSACTION_STATUS_INTRANS
+
+    def cursor(self, name: Optional[str] = None, cursor_factory: Any = None, **kwargs: Any) -> FakeCursor:
+        factory = cursor_factory or self.cursor_factory
+        return FakeCursor(self, name, factory is not None and issubclass(factory, RealDictCursor))
+
+    def get_transaction_status(self) -> int:
+        return self._status
+
+    def commit(self) -> None:
+        self._finish()
+
+    def rollback(self) -> None:
+        self._finish()
+
+    def _finish(self) -> None:
+        if self._status != TRANSACTION_STATUS_IDLE:
+            counters['round_trips'] += 1
+            self._status = TRANSACTION_STATUS_IDLE
+
+    def close(self) -> None:
+        self.closed = 1
+
+current_rules: List[Tuple[str, Any]] = []
+
+def fake_connect(*args: Any, **kwargs: Any) -> FakeConnection:
+    counters['connections'] += 1
+    return FakeConnection(current_rules)
+
+def slot_rows(count: int) -> List[Dict[str, Any]]:
+    start = date(2030, 1, 7)
+    return [{
+        'id': n + 1,
+        'slot_date': start + timedelta(days=n // 13),
+        'slot_time': time(9 + n % 13),
+        'duration_minutes': 60,
+        'status': 'booked' if n % 3 == 0 else 'available',
+        'block_reason': None,
+        'booking_id': n + 1 if n % 3 == 0 else None,
+        'booked_by': 'Анна Смирнова' if n % 3 == 0 else None
+    } for n in range(count)]
+
+def booking_rows(count: int) -> List[Dict[str, Any]]:
+    return [{
+        'id': n + 1,
+        'client_id': n % 17 + 1,
+        'user_id': None,
+        'slot_id': None,
+        'subscription_id': n % 17 + 1,
+        'booking_date': date(2030, 1, 7) + timedelta(days=n // 6),
+        'booking_time': time(9 + n % 6),
+        'duration_minutes': 60,
+        'status': 'upcoming',
+        'notes': None,
+        'created_at': datetime(2029, 12, 1, 12, 0),
+        'full_name': 'Клиент %d' % (n % 17 + 1)
+    } for n in range(count)]
+
+def client_rows(count: int) -> List[Dict[str, Any]]:
+    return [{
+        'id': count - n,
+        'full_name': 'Клиент %d' % (count - n),
+        'phone': '+7900%07d' % (count - n),
+        'email': 'client%d@example.com' % (count - n),
+        'created_at': datetime(2029, 12, 1, 12, 0) - timedelta(minutes=n),
+        'subscriptions_count': n % 3
+    } for n in range(count)]
+
+PROFILE_JSON = json.dumps({
+    'user': {'id': 1, 'email': 'anna@example.com', 'full_name': 'Анна Смирнова', 'phone': None, 'role': 'client', 'created_at': '2029-12-01T12:00:00'},
+    'subscriptions': [{'id': 5, 'subscription_type': 'Месяц', 'total_sessions': 8, 'used_sessions': 3, 'remaining_sessions': 5,
+                       'start_date': '2029-12-01', 'end_date': '2030-01-01', 'status': 'active'}],
+    'bookings': [{'id': n, 'status': 'active', 'booking_date': None, 'slot_date': '2030-01-07', 'slot_time': '10:00:00', 'duration_minutes': 60}
+                 for n in range(20)]
+}, ensure_ascii=False)
+
+def token_event(method: str, body: Optional[Dict[str, Any]] = None, query: Optional[Dict[str, str]] = None) -> Callable[[int], Dict[str, Any]]:
+    '''
+    Каждый вызов получает свежий токен, чтобы кэш сессий не скрывал запросы
+    '''
+    def build(n: int) -> Dict[str, Any]:
+        return {
+            'httpMethod': method,
+            'headers': {'X-Auth-Token': 'bench-token-%d' % n},
+            'queryStringParameters': query,
+            'body': json.dumps(body) if body is not None else None
+        }
+    return build
+
+SESSION = {'user_id': 1, 'expires_in': 3600.0}
+CASES: Dict[str, Tuple[str, Callable[[int], Dict[str, Any]], List[Tuple[str, Any]]]] = {
+    'auth login': ('auth', token_event('POST', {'action': 'login', 'email': 'anna@example.com', 'password': 'secret1'}), [
+        ('FROM users', [{'id': 1, 'email': 'anna@example.com', 'full_name': 'Анна Смирнова', 'role': 'client'}])
+    ]),
+    'auth verify': ('auth', token_event('POST', {'action': 'verify'}), [
+        ('FROM sessions s', [{'id': 9, 'user_id': 1, 'expires_at': datetime(2030, 1, 1), 'email': 'anna@example.com',
+                              'full_name': 'Анна Смирнова', 'role': 'client', 'expires_in': 3600.0}])
+    ]),
+    'slots calendar': ('slots', token_event('GET', query={'start_date': '2030-01-07', 'end_date': '2030-01-13'}), [
+        ('slot_calendar_version', [{'version': 42}]),
+        ('FROM training_slots ts', slot_rows(7 * 13))
+    ]),
+    'slots book': ('slots', token_event('POST', {'action': 'book', 'slot_id': 3}), [
+        ('claimed AS', [dict(SESSION, slot_status='booked', subscription_id=5, booking_id=77)])
+    ]),
+    'slots cancel': ('slots', token_event('PUT', {'action': 'cancel', 'booking_id': 77}), [
+        ('canceled AS', [dict(SESSION, id=77)])
+    ]),
+    'profile': ('profile', token_event('GET'), [
+        ('json_build_object', [dict(SESSION, profile_version=3, profile=PROFILE_JSON)])
+    ]),
+    'bookings upcoming': ('bookings', token_event('GET'), [
+        ('FROM bookings b', booking_rows(60))
+    ]),
+    'bookings month': ('bookings', token_event('GET', query={'month': '2030-01', 'months': '1'}), [
+        ('FROM day_availability', [{'day': date(2030, 1, d), 'booked_mask': d * 37 % 8192} for d in range(1, 32)])
+    ]),
+    'clients list': ('clients', token_event('GET'), [
+        ('FROM clients c', client_rows(40))
+    ])
+}
+
+def run_case(module: Any, build: Callable[[int], Dict[str, Any]], rules: List[Tuple[str, Any]], n: int) -> Dict[str, Any]:
+    current_rules[:] = rules
+    return module.handler(build(n), None)
+
+def reset_counters() -> None:
+    for key in counters:
+        counters[key] = 0
+
+def measure_counts(module: Any, build: Any, rules: Any) -> Tuple[int, Dict[str, int]]:
+    pool = module.db_pool
+    module.db_pool = module.ConnectionPool(pool.max_size, pool.max_lifetime, pool.check_after_idle)
+    reset_counters()
+    run_case(module, build, rules, 0)
+    cold_connections = counters['connections']
+    reset_counters()
+    response = run_case(module, build, rules, 1)
+    return response['statusCode'], dict(counters, cold_connections=cold_connections)
+
+def measure_overhead(module: Any, build: Any, rules: Any, iterations: int) -> Tuple[float, float]:
+    started = perf_counter()
+    for n in range(iterations):
+        run_case(module, build, rules, n)
+    per_request = (perf_counter() - started) / iterations
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for n in range(min(iterations, 300)):
+        run_case(module, build, rules, n)
+    profiler.disable()
+    stats = pstats.Stats(profiler).stats
+    total = sum(entry[2] for entry in stats.values()) or 1.0
+    in_json = sum(entry[2] for (filename, _, function), entry in stats.items() if 'json' in filename or 'json' in function)
+    return per_request, in_json / total
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    psycopg2.connect = fake_connect
+    modules = {}
+    results = {}
+    print(f"{'action':<18}{'status':>7}{'cold':>7}{'conns':>7}{'stmts':>7}{'trips':>7}{'rows':>7}{'us/req':>9}{'json':>7}")
+    for name, (function, build, rules) in CASES.items():
+        module = modules.setdefault(function, load_handler_module(function))
+        status, counts = measure_counts(module, build, rules)
+        per_request, json_share = measure_overhead(module, build, rules, args.iterations)
+        results[name] = counts
+        print(f"{name:<18}{status:>7}{counts['cold_connections']:>7}{counts['connections']:>7}{counts['statements']:>7}{counts['round_trips']:>7}"
+              f"{counts['rows']:>7}{per_request * 1e6:>9.1f}{json_share:>7.0%}")
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({name: {key: counts[key] for key in BASELINE_KEYS} for name, counts in results.items()}, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f'baseline written to {BASELINE_PATH}')
+        return
+
+    with open(BASELINE_PATH, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = [
+        f'{name}: {key} {baseline[name][key]} -> {counts[key]}'
+        for name, counts in results.items() if name in baseline
+        for key in BASELINE_KEYS if counts[key] > baseline[name][key]
+    ]
+    for line in regressions:
+        print('REGRESSION ' + line)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
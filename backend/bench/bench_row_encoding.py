@@ -0,0 +1,115 @@
+'''
+Сравнение сериализации календаря слотов: RealDictCursor + dict + isoformat
++ json.dumps (прежний путь) против кортежного курсора + RowEncoder.
+Замеряет время и пиковые аллокации (tracemalloc) на N строках.
+
+    BENCH_DATABASE_URL=postgresql://localhost/boxing_bench \
+        python backend/bench/bench_row_encoding.py --rows 10000
+'''
+import argparse
+import json
+import statistics
+import tracemalloc
+from datetime import date, time, datetime
+from time import perf_counter
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from handlers import load_handler_module
+from localdb import prepare_database, scratch_dsn
+
+CALENDAR_SQL = """
+    SELECT
+        ts.id,
+        ts.slot_date,
+        ts.slot_time,
+        ts.duration_minutes,
+        ts.status,
+        ts.block_reason,
+        b.id as booking_id,
+        u.full_name as booked_by
+    FROM training_slots ts
+    LEFT JOIN bookings b ON ts.id = b.slot_id AND b.status = 'active'
+    LEFT JOIN users u ON b.user_id = u.id
+    ORDER BY ts.slot_date, ts.slot_time
+"""
+
+def seed(dsn: str, rows: int) -> None:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO users (email, password_hash, full_name)
+                VALUES ('encoding@example.com', 'x', 'Анна Кодировщица') RETURNING id
+            """)
+            user_id = cur.fetchone()[0]
+            cur.execute("""
+                INSERT INTO training_slots (slot_date, slot_time, status)
+                SELECT CURRENT_DATE + (n / 12), TIME '09:00' + (n %% 12) * INTERVAL '1 hour',
+                       CASE WHEN n %% 3 = 0 THEN 'booked' ELSE 'available' END
+                FROM generate_series(0, %s - 1) AS n
+            """, (rows,))
+            cur.execute("""
+                INSERT INTO bookings (user_id, slot_id, status)
+                SELECT %s, id, 'active' FROM training_slots WHERE status = 'booked'
+            """, (user_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def encode_dicts(conn) -> str:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(CALENDAR_SQL)
+        slots = []
+        for row in cur.fetchall():
+            slot = dict(row)
+            for key, value in slot.items():
+                if isinstance(value, (date, time, datetime)):
+                    slot[key] = value.isoformat()
+            slots.append(slot)
+    return json.dumps({'slots': slots})
+
+def encode_tuples(conn, row_encoder_class) -> str:
+    with conn.cursor() as cur:
+        cur.execute(CALENDAR_SQL)
+        return '{"slots":%s}' % row_encoder_class(cur.description).encode_rows(cur)
+
+def measure(label, conn, encode, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = perf_counter()
+        encode(conn)
+        samples.append(perf_counter() - started)
+
+    tracemalloc.start()
+    body = encode(conn)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<8} median_ms={statistics.median(samples) * 1e3:8.1f}  "
+          f"min_ms={min(samples) * 1e3:8.1f}  peak_kib={peak / 1024:9.1f}")
+    return body
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeats', type=int, default=15)
+    args = parser.parse_args()
+
+    dsn = prepare_database(scratch_dsn())
+    seed(dsn, args.rows)
+    slots = load_handler_module('slots')
+
+    conn = psycopg2.connect(dsn)
+    try:
+        legacy = measure('dicts', conn, encode_dicts, args.repeats)
+        encoded = measure('tuples', conn, lambda c: encode_tuples(c, slots.RowEncoder), args.repeats)
+    finally:
+        conn.close()
+
+    assert json.loads(legacy) == json.loads(encoded), 'encoders disagree'
+    print(f"rows={args.rows}  body_bytes={len(encoded)}  identical_payload=yes")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+'''
+Сравнение задержки проверки токена: подписанный токен (HMAC, без БД)
+против непрозрачного токена (поиск в sessions).
+
+    python backend/bench/bench_token_verify.py [iterations]
+
+Для непрозрачного режима нужен DATABASE_URL с применёнными миграциями,
+иначе замеряется только подписанный режим.
+'''
+import os
+import secrets
+import statistics
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import psycopg2
+
+from handlers import load_handler_module
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6
+    return {'p50_us': pick(0.50), 'p95_us': pick(0.95), 'p99_us': pick(0.99), 'mean_us': statistics.mean(samples) * 1e6}
+
+def report(label, samples):
+    stats = percentiles(samples)
+    print(f"{label:<10} n={len(samples):<6} " + '  '.join(f'{k}={v:9.1f}' for k, v in stats.items()))
+
+def bench_signed(iterations):
+    key = secrets.token_urlsafe(32)
+    auth = load_handler_module('auth')
+    slots = load_handler_module('slots')
+    auth.SESSION_SIGNING_KEY = key
+    slots.SESSION_SIGNING_KEY = key
+    slots.revoked_tokens.refresh_interval = float('inf')
+    slots.revoked_tokens.refresh(_NoRevocationsConnection())
+    
+    token = auth.generate_token(42, 'client', datetime.now() + timedelta(days=30))
+    samples = []
+    for _ in range(iterations):
+        started = perf_counter()
+        token_hash = slots.hash_token(token)
+        session = slots.verify_signed_token(None, token, token_hash)
+        samples.append(perf_counter() - started)
+        assert session and session['user_id'] == 42
+    report('signed', samples)
+
+def bench_opaque(iterations):
+    slots = load_handler_module('slots')
+    slots.session_cache.max_size = 0
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        token = secrets.token_urlsafe(32)
+        samples = []
+        for _ in range(iterations):
+            started = perf_counter()
+            token_hash = slots.hash_token(token)
+            session_sql, params = slots.session_source(conn, token, token_hash)
+            with conn.cursor() as cur:
+                cur.execute(session_sql, params)
+                cur.fetchone()
+            samples.append(perf_counter() - started)
+        conn.rollback()
+    finally:
+        conn.close()
+    report('opaque', samples)
+
+class _NoRevocationsConnection:
+    def cursor(self):
+        return self
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def execute(self, *args):
+        pass
+    def fetchall(self):
+        return []
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    bench_signed(iterations)
+    if os.environ.get('DATABASE_URL'):
+        bench_opaque(min(iterations, 2000))
+    else:
+        print('opaque     skipped: DATABASE_URL is not set')
@@ -0,0 +1,369 @@
+'''
+Детерминированный синтетический набор данных в масштабе продакшена: текущая
+схема (users, sessions, training_slots, subscriptions и bookings по слотам)
+и исходная (clients, subscriptions и bookings по дате и времени). Одинаковые
+--seed и --today дают одинаковые строки и одинаковые id.
+
+Строки грузятся через COPY FREEZE одной транзакцией: индексы, ограничения
+и внешние ключи снимаются на время загрузки и строятся заново, пользовательские
+триггеры отключены, а производные данные (day_availability, версия календаря,
+последовательности) пересчитываются запросами после загрузки. В конце
+VACUUM ANALYZE, чтобы планы строились по настоящей статистике.
+
+Журнал записей один на оба календаря, а живые записи не пересекаются
+(bookings_no_overlap), поэтому объём сверх занятых слотов и часов - история
+отменённых записей.
+
+Вход под любым пользователем: пароль PASSWORD, токен - user_token(n, seed)
+(сессия действует 30 дней от --today). Пользователь 1 - администратор.
+
+    BENCH_DATABASE_URL=postgresql://localhost/boxing_bench \
+        python backend/bench/dataset.py --years 5 --users 50000 --sessions-per-user 40
+'''
+import argparse
+import hashlib
+import io
+import random
+from datetime import date, timedelta
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from localdb import prepare_database, scratch_dsn
+from scenario import plain_connection
+
+PASSWORD = 'dataset1'
+TRAINERS = 3
+FIRST_HOUR = 9
+HOURS_PER_DAY = 13
+COPY_BATCH_ROWS = 100000
+SESSION_DAYS = 30
+SUBSCRIPTION_DAYS = 90
+TABLES = ('users', 'sessions', 'clients', 'training_slots', 'subscriptions', 'bookings')
+
+FIRST_NAMES = ('Анна', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Ирина', 'Светлана', 'Татьяна',
+               'Юлия', 'Екатерина', 'Дарья', 'Алина', 'Полина', 'Ксения', 'Виктория', 'София')
+LAST_NAMES = ('Иванова', 'Смирнова', 'Кузнецова', 'Попова', 'Васильева', 'Петрова', 'Соколова',
+              'Михайлова', 'Новикова', 'Федорова', 'Морозова', 'Волкова', 'Алексеева', 'Лебедева')
+SUBSCRIPTION_TYPES = (('Пробное', 1), ('Месяц', 8), ('Месяц', 12), ('Квартал', 24))
+CANCEL_REASONS = ('Заболела', 'Перенос', 'Не успеваю', None)
+
+def user_token(n: int, seed: int = 1) -> str:
+    return f'dataset-{seed}-user-{n}'
+
+def session_token(session_id: int, seed: int = 1) -> str:
+    return f'dataset-{seed}-session-{session_id}'
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+NULL = '\\N'
+
+def copy_rows(cur: Any, table: str, columns: Sequence[str], lines: Iterable[str]) -> int:
+    '''
+    COPY ... FREEZE пачками по COPY_BATCH_ROWS строк текстового формата.
+    Значения генератора не содержат табуляций, переводов строк и обратных
+    слэшей, поэтому не экранируются
+    '''
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FREEZE)"
+    count = 0
+    batch: List[str] = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= COPY_BATCH_ROWS:
+            cur.copy_expert(sql, io.StringIO('\n'.join(batch) + '\n'))
+            count += len(batch)
+            batch = []
+    if batch:
+        cur.copy_expert(sql, io.StringIO('\n'.join(batch) + '\n'))
+        count += len(batch)
+    return count
+
+class Dataset:
+    '''
+    Генератор строк COPY. Таблицы генерируются в порядке внешних ключей, id
+    назначаются явно: users и clients - 1..N, остальные по порядку генерации.
+    Даты и время берутся из заранее отформатированных таблиц: на миллионах
+    строк datetime и str() занимают большую часть времени
+    '''
+    def __init__(self, today: date, years: int, horizon_days: int, users: int, sessions_per_user: int,
+                 bookings_per_user: int, clients: int, bookings_per_client: int, seed: int):
+        self.first_day = today - timedelta(days=365 * years)
+        self.past_days = (today - self.first_day).days
+        self.days = self.past_days + horizon_days + 1
+        self.day_text = [(self.first_day + timedelta(days=offset)).isoformat()
+                         for offset in range(self.days + SESSION_DAYS + SUBSCRIPTION_DAYS)]
+        self.clock = ['%02d:%02d:00' % divmod(minute, 60) for minute in range(24 * 60)]
+        self.now = self.day_text[self.past_days] + ' 12:00:00'
+        self.users = users
+        self.sessions_per_user = sessions_per_user
+        self.bookings_per_user = bookings_per_user
+        self.clients = clients
+        self.bookings_per_client = bookings_per_client
+        self.seed = seed
+        self.random = random.Random(seed).random
+        self.user_subscription: List[int] = [0] * (users + 1)
+        self.client_subscription: List[int] = [0] * (clients + 1)
+        self.booked_slots: List[int] = []
+        self.next_booking_id = 1
+
+    def pick(self, low: int, high: int) -> int:
+        return low + int(self.random() * (high - low + 1))
+
+    def stamp(self) -> str:
+        return self.day_text[int(self.random() * self.past_days)] + ' ' + self.clock[int(self.random() * len(self.clock))]
+
+    def full_name(self) -> str:
+        return FIRST_NAMES[int(self.random() * len(FIRST_NAMES))] + ' ' + LAST_NAMES[int(self.random() * len(LAST_NAMES))]
+
+    def user_rows(self):
+        password_hash = token_hash(PASSWORD)
+        for n in range(1, self.users + 1):
+            role = 'admin' if n == 1 else 'trainer' if n <= 1 + TRAINERS else 'client'
+            created_at = self.stamp()
+            yield f'{n}\tuser{n}@example.com\t+7901{n:07d}\t{password_hash}\t{self.full_name()}\t{role}\t{created_at}\t{created_at}'
+
+    def session_rows(self):
+        '''
+        Первая сессия пользователя действует (токен user_token), остальные -
+        история входов, в основном истёкшая
+        '''
+        expires_now = self.day_text[self.past_days + SESSION_DAYS] + ' 12:00:00'
+        history = 2 * max(self.sessions_per_user - 1, 0)
+        session_id = 0
+        for n in range(1, self.users + 1):
+            session_id += 1
+            yield f'{session_id}\t{n}\t{token_hash(user_token(n, self.seed))}\t{expires_now}\t{self.now}'
+            for _ in range(self.pick(0, history)):
+                session_id += 1
+                offset = int(self.random() * self.past_days)
+                minute = self.clock[int(self.random() * len(self.clock))]
+                yield (f'{session_id}\t{n}\t{token_hash(session_token(session_id, self.seed))}\t'
+                       f'{self.day_text[offset + SESSION_DAYS]} {minute}\t{self.day_text[offset]} {minute}')
+
+    def client_rows(self):
+        for n in range(1, self.clients + 1):
+            email = f'client{n}@example.com' if self.random() < 0.9 else NULL
+            yield f'{n}\t{self.full_name()}\t+7900{n:07d}\t{email}\t{self.stamp()}'
+
+    def slot_rows(self):
+        slot_id = 0
+        for offset in range(self.days):
+            day = self.day_text[offset]
+            booked_share = 0.7 if offset < self.past_days else 0.3
+            for hour in range(FIRST_HOUR, FIRST_HOUR + HOURS_PER_DAY):
+                slot_id += 1
+                draw = self.random()
+                if draw < 0.02:
+                    yield f'{slot_id}\t{day}\t{hour:02d}:00:00\t60\tblocked\tТехническое обслуживание'
+                elif draw < 0.02 + booked_share:
+                    self.booked_slots.append(slot_id)
+                    yield f'{slot_id}\t{day}\t{hour:02d}:00:00\t60\tbooked\t{NULL}'
+                else:
+                    yield f'{slot_id}\t{day}\t{hour:02d}:00:00\t60\tavailable\t{NULL}'
+
+    def subscription_rows(self):
+        '''
+        Абонементы обеих схем, от одного до четырёх на владельца. Последний
+        в 80% случаев действует, на него ссылаются записи владельца
+        '''
+        subscription_id = 0
+        for current, owners, last in ((True, self.users, self.user_subscription), (False, self.clients, self.client_subscription)):
+            for owner in range(1, owners + 1):
+                count = self.pick(1, 4)
+                for index in range(count):
+                    kind, total = SUBSCRIPTION_TYPES[int(self.random() * len(SUBSCRIPTION_TYPES))]
+                    active = index == count - 1 and self.random() < 0.8
+                    end = self.past_days + self.pick(1, SUBSCRIPTION_DAYS) if active else self.past_days - self.pick(1, 2 * 365)
+                    start = max(end - (30 if total <= 12 else SUBSCRIPTION_DAYS), 0)
+                    used = self.pick(0, total - 1) if active else total
+                    subscription_id += 1
+                    last[owner] = subscription_id
+                    start_text, end_text = self.day_text[start], self.day_text[max(end, 0)]
+                    if current:
+                        yield (f'{subscription_id}\t{NULL}\t{owner}\t{NULL}\t{kind}\t{total}\t{NULL}\t{used}\t{NULL}\t'
+                               f'{start_text}\t{end_text}\t{"active" if active else "expired"}\t{start_text} 10:00:00')
+                    else:
+                        yield (f'{subscription_id}\t{owner}\t{NULL}\t{kind}\t{NULL}\t{total}\t{total - used}\t0\t{end_text}\t'
+                               f'{NULL}\t{NULL}\tactive\t{start_text} 10:00:00')
+
+    def booking_rows(self):
+        '''
+        Записи по слотам: одна активная на каждый занятый слот плюс отменённые
+        до bookings_per_user на пользователя. Записи клиентов по дню и часу:
+        живые не пересекаются, остальное до bookings_per_client - отменённые
+        '''
+        first_client = min(2 + TRAINERS, self.users)
+        for slot_id in self.booked_slots:
+            user = self.pick(first_client, self.users)
+            yield self.booking(NULL, user, slot_id, self.user_subscription[user], NULL, NULL, 'active', NULL)
+        slots = self.days * HOURS_PER_DAY
+        for _ in range(max(self.users * self.bookings_per_user - len(self.booked_slots), 0)):
+            user = self.pick(1, self.users)
+            yield self.booking(NULL, user, self.pick(1, slots), self.user_subscription[user], NULL, NULL,
+                               'canceled', CANCEL_REASONS[int(self.random() * len(CANCEL_REASONS))])
+
+        if not self.clients:
+            return
+        live = 0
+        for offset in range(self.days):
+            past = offset < self.past_days
+            for hour in range(FIRST_HOUR, FIRST_HOUR + HOURS_PER_DAY):
+                if self.random() < (0.6 if past else 0.3):
+                    client = self.pick(1, self.clients)
+                    live += 1
+                    yield self.booking(client, NULL, NULL, self.client_subscription[client], self.day_text[offset],
+                                       f'{hour:02d}:00:00', 'completed' if past else 'upcoming', NULL)
+        for _ in range(max(self.clients * self.bookings_per_client - live, 0)):
+            client = self.pick(1, self.clients)
+            yield self.booking(client, NULL, NULL, self.client_subscription[client], self.day_text[int(self.random() * self.days)],
+                               f'{self.pick(FIRST_HOUR, FIRST_HOUR + HOURS_PER_DAY - 1):02d}:00:00',
+                               'cancelled', CANCEL_REASONS[int(self.random() * len(CANCEL_REASONS))])
+
+    def booking(self, client: Any, user: Any, slot_id: Any, subscription_id: int,
+                day: str, at: str, status: str, reason: str) -> str:
+        '''
+        Строка bookings. Причину отмены исходная схема хранит в
+        cancellation_reason, текущая - в cancel_reason вместе с cancel_date
+        '''
+        booking_id = self.next_booking_id
+        self.next_booking_id += 1
+        created_at = self.stamp()
+        prefix = f'{booking_id}\t{client}\t{user}\t{slot_id}\t{subscription_id or NULL}\t{day}\t{at}\t60\t{status}'
+        if status == 'canceled':
+            return f'{prefix}\t{NULL}\t{reason}\t{created_at}\t{created_at}\t{created_at}'
+        return f'{prefix}\t{reason}\t{NULL}\t{NULL}\t{created_at}\t{created_at}'
+
+COLUMNS = {
+    'users': ('id', 'email', 'phone', 'password_hash', 'full_name', 'role', 'created_at', 'updated_at'),
+    'sessions': ('id', 'user_id', 'token_hash', 'expires_at', 'created_at'),
+    'clients': ('id', 'full_name', 'phone', 'email', 'created_at'),
+    'training_slots': ('id', 'slot_date', 'slot_time', 'duration_minutes', 'status', 'block_reason'),
+    'subscriptions': ('id', 'client_id', 'user_id', 'type', 'subscription_type', 'total_sessions',
+                      'remaining_sessions', 'used_sessions', 'valid_until', 'start_date', 'end_date', 'status', 'created_at'),
+    'bookings': ('id', 'client_id', 'user_id', 'slot_id', 'subscription_id', 'booking_date', 'booking_time',
+                 'duration_minutes', 'status', 'cancellation_reason', 'cancel_reason', 'cancel_date', 'created_at', 'updated_at')
+}
+
+DETACHED_SQL = '''
+    SELECT format('ALTER TABLE %%s DROP CONSTRAINT %%I', conrelid::regclass, conname),
+           format('ALTER TABLE %%s ADD CONSTRAINT %%I %%s', conrelid::regclass, conname, pg_get_constraintdef(oid)),
+           contype = 'f'
+    FROM pg_constraint
+    WHERE (conrelid = ANY(%(tables)s::regclass[]) AND contype IN ('p', 'u', 'x', 'f'))
+       OR (confrelid = ANY(%(tables)s::regclass[]) AND contype = 'f')
+    UNION ALL
+    SELECT format('DROP INDEX %%s', i.indexrelid::regclass), pg_get_indexdef(i.indexrelid), false
+    FROM pg_index i
+    WHERE i.indrelid = ANY(%(tables)s::regclass[])
+    AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid AND c.conrelid = i.indrelid)
+'''
+
+def detach_indexes(cur: Any) -> List[str]:
+    '''
+    Снимает с таблиц набора индексы, ограничения с индексами и внешние ключи
+    и возвращает DDL для их восстановления: индекс, построенный один раз после
+    COPY, в разы дешевле вставки каждой строки в полдюжины B-деревьев
+    '''
+    cur.execute(DETACHED_SQL, {'tables': list(TABLES)})
+    detached = cur.fetchall()
+    for drop, _, _ in sorted(detached, key=lambda row: not row[2]):
+        cur.execute(drop)
+    return [create for _, create, _ in sorted(detached, key=lambda row: row[2])]
+
+REBUILD_SQL = '''
+    DELETE FROM day_availability;
+    INSERT INTO day_availability (day, booked_mask)
+    SELECT booking_date, bit_or(booking_hours_mask(booking_time, duration_minutes))
+    FROM bookings
+    WHERE booking_date IS NOT NULL AND status NOT IN ('cancelled', 'canceled')
+    GROUP BY booking_date;
+
+    UPDATE slot_calendar_version SET version = version + 1, log_floor = version + 1;
+
+    SELECT setval(pg_get_serial_sequence('users', 'id'), GREATEST(MAX(id), 1)) FROM users;
+    SELECT setval(pg_get_serial_sequence('sessions', 'id'), GREATEST(MAX(id), 1)) FROM sessions;
+    SELECT setval(pg_get_serial_sequence('clients', 'id'), GREATEST(MAX(id), 1)) FROM clients;
+    SELECT setval(pg_get_serial_sequence('training_slots', 'id'), GREATEST(MAX(id), 1)) FROM training_slots;
+    SELECT setval(pg_get_serial_sequence('subscriptions', 'id'), GREATEST(MAX(id), 1)) FROM subscriptions;
+    SELECT setval(pg_get_serial_sequence('bookings', 'id'), GREATEST(MAX(id), 1)) FROM bookings;
+'''
+
+def generate(dsn: str, today: Optional[date] = None, years: int = 5, horizon_days: int = 90, users: int = 50000,
+             sessions_per_user: int = 40, bookings_per_user: int = 20, clients: int = 20000,
+             bookings_per_client: int = 25, seed: int = 1, verbose: bool = False) -> Dict[str, int]:
+    '''
+    Наполняет пустую схему (после prepare_database) одной транзакцией и
+    возвращает число строк по таблицам. Даты отсчитываются от today
+    '''
+    dataset = Dataset(today or date.today(), years, horizon_days, users, sessions_per_user,
+                      bookings_per_user, clients, bookings_per_client, seed)
+    generators = {
+        'users': dataset.user_rows,
+        'sessions': dataset.session_rows,
+        'clients': dataset.client_rows,
+        'training_slots': dataset.slot_rows,
+        'subscriptions': dataset.subscription_rows,
+        'bookings': dataset.booking_rows
+    }
+    counts = {}
+    conn = plain_connection(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(' UNION ALL '.join(f'(SELECT 1 FROM {table} LIMIT 1)' for table in TABLES))
+            if cur.fetchone():
+                raise SystemExit('dataset expects empty tables, run prepare_database first')
+            cur.execute("SET LOCAL maintenance_work_mem = '256MB'")
+            restore = detach_indexes(cur)
+            cur.execute(f"TRUNCATE {', '.join(TABLES)}")
+            for table in TABLES:
+                cur.execute(f'ALTER TABLE {table} DISABLE TRIGGER USER')
+            for table in TABLES:
+                started = perf_counter()
+                counts[table] = copy_rows(cur, table, COLUMNS[table], generators[table]())
+                if verbose:
+                    print(f'  {table:<16}{counts[table]:>10} rows {perf_counter() - started:>7.1f}s', flush=True)
+            for table in TABLES:
+                cur.execute(f'ALTER TABLE {table} ENABLE TRIGGER USER')
+
+            started = perf_counter()
+            for statement in restore:
+                cur.execute(statement)
+            cur.execute(REBUILD_SQL)
+            if verbose:
+                print(f'  {"indexes":<26} {perf_counter() - started:>7.1f}s', flush=True)
+        conn.commit()
+
+        started = perf_counter()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"VACUUM (ANALYZE) {', '.join(TABLES)}, day_availability")
+        if verbose:
+            print(f'  {"vacuum analyze":<26} {perf_counter() - started:>7.1f}s', flush=True)
+    finally:
+        conn.close()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--today', type=date.fromisoformat, help='дата отсчёта, по умолчанию сегодня')
+    parser.add_argument('--years', type=int, default=5, help='лет истории слотов и записей')
+    parser.add_argument('--horizon-days', type=int, default=90, help='дней расписания вперёд')
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--sessions-per-user', type=int, default=40)
+    parser.add_argument('--bookings-per-user', type=int, default=20)
+    parser.add_argument('--clients', type=int, default=20000)
+    parser.add_argument('--bookings-per-client', type=int, default=25)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    started = perf_counter()
+    dsn = prepare_database(scratch_dsn())
+    counts = generate(
+        dsn, today=args.today, years=args.years, horizon_days=args.horizon_days, users=args.users,
+        sessions_per_user=args.sessions_per_user, bookings_per_user=args.bookings_per_user,
+        clients=args.clients, bookings_per_client=args.bookings_per_client, seed=args.seed, verbose=True
+    )
+    print(f'{sum(counts.values())} rows in {perf_counter() - started:.1f}s')
+
+if __name__ == '__main__':
+    main()
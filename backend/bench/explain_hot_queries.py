@@ -0,0 +1,114 @@
+'''
+Регрессия планов запросов: наполняет локальную БД синтетикой, прогоняет
+сценарий по всем эндпоинтам пяти функций, записывает каждый отправленный
+SQL и делает для него EXPLAIN. С --dataset схема наполняется полным набором
+dataset.py вместо быстрого seed. Падает (код 1), если какой-либо запрос
+читает последовательным сканированием таблицу больше --threshold строк,
+если шаг сценария ответил 5xx или если его запрос не удалось объяснить.
+Временные таблицы, созданные и проанализированные шагом, пересоздаются
+перед EXPLAIN его запросов. Шаги, которые заведомо не работают в этой БД (например, поиск
+без pg_trgm), перечисляются явно через --allow.
+
+    BENCH_DATABASE_URL=postgresql://localhost/boxing_bench \
+        python backend/bench/explain_hot_queries.py --threshold 1000
+'''
+import argparse
+import json
+import os
+import re
+import sys
+
+import recording
+from dataset import generate
+from localdb import prepare_database, scratch_dsn
+from scenario import plain_connection, run, seed
+
+EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+SETUP = re.compile(r'^\s*(CREATE\s+TEMP(ORARY)?\s+TABLE|ANALYZE)\b', re.IGNORECASE)
+
+def seq_scans(plan):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+def table_sizes(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname, c.reltuples::bigint
+            FROM pg_class c
+            WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace
+        """)
+        return dict(cur.fetchall())
+
+def explain(conn, statement, setup=()):
+    with conn.cursor() as cur:
+        try:
+            for prerequisite in setup:
+                cur.execute(prerequisite)
+            cur.execute('EXPLAIN (FORMAT JSON) ' + statement)
+            return cur.fetchone()[0][0]['Plan'], None
+        except Exception as e:
+            return None, str(e).splitlines()[0]
+        finally:
+            conn.rollback()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threshold', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--dataset', action='store_true', help='наполнить схему dataset.generate (5 лет, 50k пользователей)')
+    parser.add_argument('--allow', action='append', default=[], metavar='STEP',
+                        help='не считать ошибкой 5xx и необъяснимые запросы этого шага сценария (можно повторять)')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    allowed = set(args.allow)
+
+    dsn = prepare_database(scratch_dsn())
+    os.environ['DATABASE_URL'] = dsn
+    if args.dataset:
+        generate(dsn)
+    else:
+        seed(dsn, users=args.users, clients=args.clients, days=args.days)
+
+    recording.install()
+    checked = {}
+    errors = []
+    for step, response in run(dsn):
+        if response['statusCode'] >= 500:
+            errors.append((step, f'handler failed with {response["statusCode"]}: {response["body"][:200]}'))
+        setup = []
+        for statement in recording.take():
+            if SETUP.match(statement):
+                setup.append(statement)
+            elif EXPLAINABLE.match(statement):
+                checked.setdefault(' '.join(statement.split()), (step, tuple(setup)))
+
+    conn = plain_connection(dsn)
+    sizes = table_sizes(conn)
+    failures = []
+    skipped = 0
+    for statement, (step, setup) in checked.items():
+        plan, error = explain(conn, statement, setup)
+        if error:
+            skipped += 1
+            errors.append((step, f'cannot EXPLAIN: {error}'))
+            continue
+        large = sorted({name for name in seq_scans(plan) if sizes.get(name, 0) >= args.threshold})
+        if large:
+            failures.append((step, large, statement))
+        if args.verbose:
+            print(json.dumps({'step': step, 'seq_scans': sorted(set(seq_scans(plan))), 'sql': statement[:160]}, ensure_ascii=False))
+    conn.close()
+
+    print(f'explained {len(checked) - skipped} distinct statements, skipped {skipped}, threshold {args.threshold} rows')
+    for step, error in errors:
+        print(f'{"  allowed" if step in allowed else "ERROR"} [{step}]: {error}')
+    for step, tables, statement in failures:
+        print(f'SEQ SCAN [{step}] on {", ".join(f"{t} ({sizes[t]} rows)" for t in tables)}:\n    {statement[:400]}')
+    sys.exit(1 if failures or any(step not in allowed for step, _ in errors) else 0)
+
+if __name__ == '__main__':
+    main()
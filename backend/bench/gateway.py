@@ -0,0 +1,112 @@
+'''
+Локальный HTTP-шлюз: монтирует handler каждой функции backend/<name>/index.py
+на свой маршрут /<name>/ и переводит запрос в событие облачной функции
+(httpMethod, headers, queryStringParameters, body). Работает на схеме bench
+из BENCH_DATABASE_URL; --prepare пересоздаёт её и наполняет синтетикой
+(с --dataset - полным набором dataset.py).
+
+    BENCH_DATABASE_URL=postgresql://localhost/boxing_bench \
+        python backend/bench/gateway.py --port 8000 --prepare
+    curl 'http://127.0.0.1:8000/slots/?start_date=2030-01-01&end_date=2030-01-07'
+'''
+import argparse
+import base64
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from handlers import FUNCTIONS, load_handler_module
+from localdb import prepare_database, scratch_dsn, with_search_path
+
+def header_name(name: str) -> str:
+    return '-'.join(part.capitalize() for part in name.split('-'))
+
+def make_event(method: str, target: str, headers: Any, body: bytes) -> Tuple[Optional[str], Dict[str, Any]]:
+    '''
+    Событие в формате облачной функции. Первый сегмент пути выбирает функцию,
+    заголовки приводятся к виду X-Auth-Token, как их отдаёт платформа
+    '''
+    url = urlsplit(target)
+    segments = [segment for segment in url.path.split('/') if segment]
+    function = segments[0] if segments and segments[0] in FUNCTIONS else None
+    return function, {
+        'httpMethod': method,
+        'path': '/' + '/'.join(segments[1:]),
+        'headers': {header_name(name): value for name, value in headers.items()},
+        'queryStringParameters': dict(parse_qsl(url.query, keep_blank_values=True)) or None,
+        'body': body.decode('utf-8') if body else None,
+        'isBase64Encoded': False
+    }
+
+class GatewayRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    modules: Dict[str, Any] = {}
+
+    def handle_any(self) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        function, event = make_event(self.command, self.path, self.headers, self.rfile.read(length))
+        if function is None:
+            self.reply(404, {'Content-Type': 'text/plain; charset=utf-8'}, f'unknown function, expected one of /{", /".join(FUNCTIONS)}/')
+            return
+        response = self.modules[function].handler(event, None)
+        body = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            body = base64.b64decode(body)
+        self.reply(response['statusCode'], response.get('headers') or {}, body)
+
+    def reply(self, status: int, headers: Dict[str, str], body: Any) -> None:
+        payload = body if isinstance(body, bytes) else body.encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_OPTIONS = handle_any
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+def serve(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    GatewayRequestHandler.modules = {name: load_handler_module(name) for name in FUNCTIONS}
+    server = ThreadingHTTPServer((host, port), GatewayRequestHandler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--prepare', action='store_true', help='пересоздать схему bench и наполнить её')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--dataset', action='store_true', help='с --prepare наполнить схему dataset.generate')
+    args = parser.parse_args()
+
+    if args.prepare:
+        dsn = prepare_database(scratch_dsn())
+        if args.dataset:
+            from dataset import generate
+            generate(dsn)
+        else:
+            from scenario import seed
+            seed(dsn, users=args.users, clients=args.clients, days=args.days)
+    else:
+        dsn = with_search_path(scratch_dsn())
+    os.environ['DATABASE_URL'] = dsn
+
+    server = serve(args.port, args.host)
+    print(f'gateway on http://{args.host}:{args.port}/ ({", ".join("/" + name + "/" for name in FUNCTIONS)})', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
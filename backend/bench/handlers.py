@@ -0,0 +1,22 @@
+import importlib.util
+import os
+import sys
+from types import ModuleType
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = ['auth', 'slots', 'profile', 'bookings', 'clients']
+
+def load_handler_module(name: str) -> ModuleType:
+    '''
+    Загружает backend/<name>/index.py под уникальным именем модуля,
+    чтобы все функции можно было импортировать в одном процессе
+    '''
+    module_name = f'backend_{name}_index'
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    os.environ.setdefault('DATABASE_URL', '')
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(BACKEND_DIR, name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,266 @@
+'''
+Нагрузочный прогон через локальный шлюз (gateway.py): сначала воспроизводит
+все сценарии из backend/*/tests.json и сверяет статусы, затем --threads
+потоков --duration секунд выполняют смесь действий клиентов (вход, просмотр
+слотов, запись, отмена, профиль, GET-сценарии из tests.json). В конце печатает
+пропускную способность и перцентили задержки по каждому действию.
+
+Без --url сам поднимает шлюз отдельным процессом на пересозданной схеме bench.
+
+    BENCH_DATABASE_URL=postgresql://localhost/boxing_bench \
+        python backend/bench/loadgen.py --threads 8 --duration 30
+'''
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from time import perf_counter, sleep
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+import psycopg2
+
+from handlers import BACKEND_DIR, FUNCTIONS
+from localdb import scratch_dsn, with_search_path
+
+MIX = {
+    'login': 5,
+    'browse slots': 40,
+    'book': 15,
+    'cancel': 10,
+    'profile': 20,
+    'tests.json GET': 10
+}
+PASSWORD = 'loadgen1'
+
+class Client:
+    '''
+    Keep-alive соединение с шлюзом на поток
+    '''
+    def __init__(self, base_url: str):
+        url = urlsplit(base_url)
+        self.conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+
+    def request(self, method: str, path: str, body: Any = None, token: Optional[str] = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], Any]:
+        headers = dict(headers or {})
+        if token:
+            headers['X-Auth-Token'] = token
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        self.conn.request(method, path, body=payload, headers=headers)
+        response = self.conn.getresponse()
+        raw = response.read()
+        try:
+            parsed = json.loads(raw) if raw else None
+        except ValueError:
+            parsed = raw.decode()
+        return response.status, dict(response.getheaders()), parsed
+
+def load_test_cases() -> List[Tuple[str, Dict[str, Any]]]:
+    cases = []
+    for function in FUNCTIONS:
+        with open(os.path.join(BACKEND_DIR, function, 'tests.json'), encoding='utf-8') as f:
+            cases += [(function, case) for case in json.load(f)['tests']]
+    return cases
+
+def matches(expected: Any, actual: Any) -> bool:
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and all(key in actual and matches(value, actual[key]) for key, value in expected.items())
+    kinds = {'array': list, 'string': str, 'number': (int, float), 'object': dict, 'boolean': bool}
+    if expected in kinds:
+        return isinstance(actual, kinds[expected])
+    return expected == actual
+
+def case_path(function: str, case: Dict[str, Any]) -> str:
+    return '/' + function + case.get('path', '/')
+
+def replay_test_cases(client: Client, cases: List[Tuple[str, Dict[str, Any]]]) -> int:
+    failed = 0
+    for function, case in cases:
+        status, _, body = client.request(case['method'], case_path(function, case), case.get('body'), headers=case.get('headers'))
+        ok = status == case['expectedStatus'] and matches(case.get('expectedBody', {}), body)
+        failed += not ok
+        print(f"  {'ok  ' if ok else 'FAIL'} {function:<8} {case['name']}: {status}" + ('' if ok else f' {body}'))
+    return failed
+
+def prepare_users(client: Client, dsn: str, count: int) -> List[str]:
+    '''
+    Регистрирует пользователей через шлюз и выдаёт им абонементы напрямую в БД
+    '''
+    emails = [f'load{n}@example.com' for n in range(count)]
+    for email in emails:
+        status, _, body = client.request('POST', '/auth/', {'action': 'register', 'email': email, 'password': PASSWORD, 'full_name': 'Нагрузка'})
+        assert status in (201, 400), (status, body)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO subscriptions (user_id, subscription_type, total_sessions, used_sessions, start_date, end_date, status)
+                SELECT id, 'Нагрузка', 100000, 0, CURRENT_DATE, CURRENT_DATE + 365, 'active'
+                FROM users WHERE email = ANY(%s)
+            """, (emails,))
+        conn.commit()
+    finally:
+        conn.close()
+    return emails
+
+class Worker(threading.Thread):
+    def __init__(self, base_url: str, emails: List[str], get_cases: List[Tuple[str, Dict[str, Any]]], deadline: float, seed: int):
+        super().__init__(daemon=True)
+        self.client = Client(base_url)
+        self.emails = emails
+        self.get_cases = get_cases
+        self.deadline = deadline
+        self.random = random.Random(seed)
+        self.token: Optional[str] = None
+        self.slot_ids: List[int] = []
+        self.bookings: List[Tuple[str, int]] = []
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[Tuple[str, int], int] = defaultdict(int)
+
+    def login(self) -> int:
+        status, _, body = self.client.request('POST', '/auth/', {'action': 'login', 'email': self.random.choice(self.emails), 'password': PASSWORD})
+        if status == 200:
+            self.token = body['token']
+        return status
+
+    def browse(self) -> int:
+        start = date.today() + timedelta(days=self.random.randint(0, 30))
+        query = urlencode({'start_date': start.isoformat(), 'end_date': (start + timedelta(days=6)).isoformat()})
+        status, _, body = self.client.request('GET', '/slots/?' + query)
+        if status == 200:
+            self.slot_ids = [slot['id'] for slot in body['slots'] if slot['status'] == 'available']
+        return status
+
+    def book(self) -> int:
+        if not self.slot_ids:
+            self.browse()
+        if not self.slot_ids:
+            return 0
+        slot_id = self.slot_ids.pop(self.random.randrange(len(self.slot_ids)))
+        status, _, body = self.client.request('POST', '/slots/', {'action': 'book', 'slot_id': slot_id}, self.token)
+        if status == 201:
+            self.bookings.append((self.token, body['booking_id']))
+        return status
+
+    def cancel(self) -> int:
+        if not self.bookings:
+            return 0
+        token, booking_id = self.bookings.pop()
+        return self.client.request('PUT', '/slots/', {'action': 'cancel', 'booking_id': booking_id}, token)[0]
+
+    def profile(self) -> int:
+        return self.client.request('GET', '/profile/', token=self.token)[0]
+
+    def test_case(self) -> int:
+        function, case = self.random.choice(self.get_cases)
+        return self.client.request('GET', case_path(function, case), headers=case.get('headers'))[0]
+
+    def run(self) -> None:
+        actions = {
+            'login': self.login,
+            'browse slots': self.browse,
+            'book': self.book,
+            'cancel': self.cancel,
+            'profile': self.profile,
+            'tests.json GET': self.test_case
+        }
+        names = list(MIX)
+        weights = [MIX[name] for name in names]
+        self.login()
+        while perf_counter() < self.deadline:
+            name = self.random.choices(names, weights)[0]
+            started = perf_counter()
+            status = actions[name]()
+            if status == 0:
+                continue
+            self.samples[name].append(perf_counter() - started)
+            self.statuses[(name, status)] += 1
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def report(workers: List[Worker], elapsed: float) -> None:
+    samples: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Dict[int, int]] = defaultdict(dict)
+    for worker in workers:
+        for name, values in worker.samples.items():
+            samples[name] += values
+        for (name, status), count in worker.statuses.items():
+            statuses[name][status] = statuses[name].get(status, 0) + count
+    samples['all'] = [value for name in MIX for value in samples.get(name, [])]
+
+    print(f"{'action':<16}{'count':>8}{'rps':>9}{'p50_ms':>9}{'p95_ms':>9}{'p99_ms':>9}{'max_ms':>9}  statuses")
+    for name in list(MIX) + ['all']:
+        ordered = sorted(samples.get(name, []))
+        if not ordered:
+            continue
+        codes = ' '.join(f'{status}:{count}' for status, count in sorted(statuses[name].items())) if name != 'all' else ''
+        print(f"{name:<16}{len(ordered):>8}{len(ordered) / elapsed:>9.1f}"
+              f"{percentile(ordered, 0.50) * 1e3:>9.1f}{percentile(ordered, 0.95) * 1e3:>9.1f}"
+              f"{percentile(ordered, 0.99) * 1e3:>9.1f}{ordered[-1] * 1e3:>9.1f}  {codes}")
+
+def start_gateway(port: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gateway.py'), '--port', str(port), '--prepare'],
+        stdout=subprocess.DEVNULL
+    )
+    for _ in range(600):
+        try:
+            http.client.HTTPConnection('127.0.0.1', port, timeout=1).request('OPTIONS', '/slots/')
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise SystemExit('gateway exited during startup')
+            sleep(0.1)
+    process.kill()
+    raise SystemExit('gateway did not start')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='уже запущенный шлюз, например http://127.0.0.1:8000')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    gateway = None if args.url else start_gateway(args.port)
+    base_url = args.url or f'http://127.0.0.1:{args.port}'
+    try:
+        client = Client(base_url)
+        cases = load_test_cases()
+        print(f'replaying {len(cases)} tests.json scenarios')
+        failed = replay_test_cases(client, cases)
+
+        emails = prepare_users(client, with_search_path(scratch_dsn()), args.users)
+        get_cases = [(function, case) for function, case in cases if case['method'] == 'GET']
+        deadline = perf_counter() + args.duration
+        workers = [Worker(base_url, emails, get_cases, deadline, args.seed + n) for n in range(args.threads)]
+        started = perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = perf_counter() - started
+
+        print(f'\n{args.threads} threads, {elapsed:.1f}s, {len(emails)} users')
+        report(workers, elapsed)
+    finally:
+        if gateway:
+            gateway.terminate()
+            gateway.wait()
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import os
+import re
+from urllib.parse import quote
+
+import psycopg2
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(BENCH_DIR)), 'db_migrations')
+FIRST_APPLIED_MIGRATION = 5
+BENCH_SCHEMA = 'bench'
+
+def scratch_dsn() -> str:
+    '''
+    DSN отдельной локальной БД для нагрузочных прогонов (BENCH_DATABASE_URL).
+    Данные в схеме bench пересоздаются при каждом вызове prepare_database.
+    '''
+    dsn = os.environ.get('BENCH_DATABASE_URL')
+    if not dsn:
+        raise SystemExit('BENCH_DATABASE_URL is not set (point it at a scratch local Postgres)')
+    return dsn
+
+def with_search_path(dsn: str, schema: str = BENCH_SCHEMA) -> str:
+    separator = '&' if '?' in dsn else '?'
+    return f"{dsn}{separator}options={quote(f'-csearch_path={schema},public')}"
+
+def migration_files():
+    for name in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.match(r'V(\d+)__.*\.sql$', name)
+        if match and int(match.group(1)) >= FIRST_APPLIED_MIGRATION:
+            yield os.path.join(MIGRATIONS_DIR, name)
+
+def prepare_database(dsn: str) -> str:
+    '''
+    Пересоздаёт схему bench: schema.sql плюс миграции начиная с V0005.
+    Возвращает DSN с search_path на эту схему для DATABASE_URL функций.
+    '''
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE')
+            cur.execute(f'CREATE SCHEMA {BENCH_SCHEMA}')
+            cur.execute(f'SET search_path = {BENCH_SCHEMA}, public')
+            with open(os.path.join(BENCH_DIR, 'schema.sql'), encoding='utf-8') as f:
+                cur.execute(f.read())
+            for path in migration_files():
+                with open(path, encoding='utf-8') as f:
+                    cur.execute(f.read())
+        conn.commit()
+    finally:
+        conn.close()
+    return with_search_path(dsn)
@@ -0,0 +1,73 @@
+'''
+Проверка long-poll GET /slots?since=<version>&wait=<seconds> на локальной
+БД: ожидающий запрос должен вернуться сразу после записи на слот (NOTIFY),
+а без изменений - по истечении wait с пустым списком.
+
+    BENCH_DATABASE_URL=postgresql://localhost/boxing_bench \
+        python backend/bench/longpoll_slots.py --rounds 20
+'''
+import argparse
+import json
+import os
+import statistics
+import threading
+from time import perf_counter, sleep
+
+from handlers import load_handler_module
+from localdb import prepare_database, scratch_dsn
+from stress_book_slot import book, seed
+
+def get_changes(slots, since: int, wait: float):
+    response = slots.handler({
+        'httpMethod': 'GET',
+        'headers': {},
+        'queryStringParameters': {'since': str(since), 'wait': str(wait)}
+    }, None)
+    assert response['statusCode'] == 200, response
+    return json.loads(response['body'])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--wait', type=float, default=10.0)
+    args = parser.parse_args()
+    
+    dsn = prepare_database(scratch_dsn())
+    os.environ['DATABASE_URL'] = dsn
+    tokens, slot_ids = seed(dsn, 1, args.rounds)
+    slots = load_handler_module('slots')
+    
+    version = get_changes(slots, 0, 0)['version']
+    started = perf_counter()
+    idle = get_changes(slots, version, 1.0)
+    idle_elapsed = perf_counter() - started
+    assert idle['slots'] == [] and 0.9 <= idle_elapsed < 2.0, (idle, idle_elapsed)
+    print(f'idle poll returned empty after {idle_elapsed:.2f}s')
+    
+    latencies = []
+    for slot_id in slot_ids:
+        result = {}
+        
+        def poll():
+            result['changes'] = get_changes(slots, version, args.wait)
+            result['returned_at'] = perf_counter()
+        
+        poller = threading.Thread(target=poll)
+        poller.start()
+        sleep(0.2)
+        booked_at = perf_counter()
+        assert book(slots, tokens[0], slot_id) == 201
+        poller.join()
+        
+        changed_ids = [slot['id'] for slot in result['changes']['slots']]
+        assert slot_id in changed_ids, result['changes']
+        latencies.append((result['returned_at'] - booked_at) * 1000)
+        version = result['changes']['version']
+    
+    latencies.sort()
+    print(f'rounds={len(latencies)} notify_to_response_ms '
+          f'p50={latencies[len(latencies) // 2]:.1f} max={latencies[-1]:.1f} '
+          f'mean={statistics.mean(latencies):.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''
+Запись SQL, который функции отправляют в БД. install() подменяет
+psycopg2.connect так, что курсоры любых соединений (обычные, RealDictCursor,
+именованные) складывают выполненные запросы в statements. Собственный
+connection_factory вызывающего (например, TimedConnection пула) сохраняется
+'''
+import psycopg2
+import psycopg2.extensions
+
+statements = []
+_cursor_classes = {}
+_connection_classes = {}
+
+class RecordingCursorMixin:
+    def execute(self, query, vars=None):
+        statements.append(self.mogrify(query, vars).decode())
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        statements.append(sql)
+        return super().copy_expert(sql, file, size)
+
+def recording_cursor(factory):
+    if factory not in _cursor_classes:
+        _cursor_classes[factory] = type(f'Recording{factory.__name__}', (RecordingCursorMixin, factory), {})
+    return _cursor_classes[factory]
+
+class RecordingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = recording_cursor(factory)
+        return super().cursor(*args, **kwargs)
+
+def recording_connection(factory):
+    if factory is None:
+        return RecordingConnection
+    if factory not in _connection_classes:
+        _connection_classes[factory] = type(f'Recording{factory.__name__}', (RecordingConnection, factory), {})
+    return _connection_classes[factory]
+
+def install() -> None:
+    original = psycopg2.connect
+    if getattr(original, 'recording', False):
+        return
+
+    def connect(*args, **kwargs):
+        kwargs['connection_factory'] = recording_connection(kwargs.get('connection_factory'))
+        return original(*args, **kwargs)
+
+    connect.recording = True
+    connect.original = original
+    psycopg2.connect = connect
+
+def take() -> list:
+    taken = list(statements)
+    statements.clear()
+    return taken
@@ -0,0 +1,172 @@
+'''
+Общий сценарий для проверок уровня БД: наполняет схему bench синтетикой
+и по очереди вызывает каждый эндпоинт пяти функций, отдавая (шаг, ответ).
+Вызывающий код снимает записанные между шагами запросы (recording.take()).
+'''
+import json
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import psycopg2
+
+from handlers import FUNCTIONS, load_handler_module
+
+SEED_SQL = """
+    INSERT INTO users (email, password_hash, full_name)
+    SELECT 'user' || n || '@example.com', 'x', 'Пользователь ' || n
+    FROM generate_series(1, %(users)s) AS n;
+
+    INSERT INTO sessions (user_id, token_hash, expires_at)
+    SELECT id, md5(id::text), NOW() + INTERVAL '30 days' FROM users;
+
+    INSERT INTO subscriptions (user_id, subscription_type, total_sessions, used_sessions, start_date, end_date, status)
+    SELECT id, 'Месяц', 8, id %% 8, CURRENT_DATE - 30 + id %% 30, CURRENT_DATE + id %% 60,
+           CASE WHEN id %% 4 = 0 THEN 'expired' ELSE 'active' END
+    FROM users;
+
+    INSERT INTO training_slots (slot_date, slot_time, status)
+    SELECT d::date, TIME '09:00' + h * INTERVAL '1 hour',
+           CASE WHEN (d::date - CURRENT_DATE + h) %% 3 = 0 THEN 'booked' ELSE 'available' END
+    FROM generate_series(CURRENT_DATE - %(days)s, CURRENT_DATE + %(days)s, INTERVAL '1 day') AS d,
+         generate_series(0, 12) AS h;
+
+    INSERT INTO bookings (user_id, slot_id, status)
+    SELECT 1 + ts.id %% %(users)s, ts.id, 'active'
+    FROM training_slots ts
+    WHERE ts.status = 'booked';
+
+    INSERT INTO clients (full_name, phone, email, created_at)
+    SELECT 'Клиент ' || n, '+7900' || lpad(n::text, 7, '0'), 'client' || n || '@example.com',
+           NOW() - n * INTERVAL '1 minute'
+    FROM generate_series(1, %(clients)s) AS n;
+
+    INSERT INTO subscriptions (client_id, type, total_sessions, remaining_sessions, valid_until)
+    SELECT id, 'Месяц', 8, 4, CURRENT_DATE + id %% 60 FROM clients;
+
+    INSERT INTO bookings (client_id, subscription_id, booking_date, booking_time, status)
+    SELECT s.client_id, s.id, CURRENT_DATE - %(days)s + n / 13, TIME '09:00' + (n %% 13) * INTERVAL '1 hour', 'upcoming'
+    FROM generate_series(0, 2 * %(days)s * 13 - 1) AS n
+    JOIN subscriptions s ON s.client_id = 1 + n %% %(clients)s;
+"""
+
+def plain_connection(dsn: str) -> Any:
+    connect = getattr(psycopg2.connect, 'original', psycopg2.connect)
+    return connect(dsn)
+
+def seed(dsn: str, users: int = 20000, clients: int = 20000, days: int = 365) -> None:
+    conn = plain_connection(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SEED_SQL, {'users': users, 'clients': clients, 'days': days})
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute('ANALYZE')
+    finally:
+        conn.close()
+
+def call(module: Any, method: str, body: Optional[Dict[str, Any]] = None, token: Optional[str] = None,
+         query: Optional[Dict[str, str]] = None, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    headers = dict(headers or {})
+    if token:
+        headers['X-Auth-Token'] = token
+    return module.handler({
+        'httpMethod': method,
+        'headers': headers,
+        'queryStringParameters': query,
+        'body': json.dumps(body) if body is not None else None
+    }, None)
+
+def body_of(response: Dict[str, Any]) -> Any:
+    return json.loads(response['body']) if response['body'] else None
+
+def run(dsn: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    '''
+    Вызывает эндпоинты по очереди. Токены и id для следующих шагов берутся
+    из ответов предыдущих
+    '''
+    fn = {name: load_handler_module(name) for name in FUNCTIONS}
+    today = date.today()
+
+    register = call(fn['auth'], 'POST', {'action': 'register', 'email': 'scenario@example.com', 'password': 'secret1', 'full_name': 'Сценарий'})
+    yield 'auth register', register
+    token = body_of(register)['token']
+    admin = call(fn['auth'], 'POST', {'action': 'register', 'email': 'admin@example.com', 'password': 'secret1', 'full_name': 'Админ'})
+    admin_token = body_of(admin)['token']
+
+    conn = plain_connection(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE users SET role = 'admin' WHERE email = 'admin@example.com'")
+            cur.execute("""
+                INSERT INTO subscriptions (user_id, subscription_type, total_sessions, used_sessions, start_date, end_date, status)
+                SELECT id, 'Месяц', 20, 0, CURRENT_DATE, CURRENT_DATE + 60, 'active' FROM users WHERE email = 'scenario@example.com'
+            """)
+            cur.execute("""
+                SELECT id FROM training_slots
+                WHERE slot_date > CURRENT_DATE AND status = 'available'
+                ORDER BY slot_date, slot_time LIMIT 4
+            """)
+            free_slots = [row[0] for row in cur.fetchall()]
+            cur.execute("INSERT INTO schedule_templates (day_of_week, start_time, end_time) VALUES (1, '09:00', '21:00')")
+        conn.commit()
+    finally:
+        conn.close()
+
+    yield 'auth login', call(fn['auth'], 'POST', {'action': 'login', 'email': 'scenario@example.com', 'password': 'secret1'})
+    yield 'auth verify', call(fn['auth'], 'POST', {'action': 'verify'}, token)
+
+    week = {'start_date': str(today), 'end_date': str(today + timedelta(days=7))}
+    calendar = call(fn['slots'], 'GET', query=week)
+    yield 'slots calendar', calendar
+    yield 'slots calendar 304', call(fn['slots'], 'GET', query=week, headers={'If-None-Match': calendar['headers']['ETag']})
+    quarter = call(fn['slots'], 'GET', query={'start_date': str(today - timedelta(days=200)), 'end_date': str(today + timedelta(days=200))})
+    yield 'slots calendar page', quarter
+    version = body_of(quarter)['version']
+    yield 'slots since', call(fn['slots'], 'GET', query={'since': str(max(version - 5, 0))})
+    book = call(fn['slots'], 'POST', {'action': 'book', 'slot_id': free_slots[0]}, token)
+    yield 'slots book', book
+    yield 'slots book_batch', call(fn['slots'], 'POST', {'action': 'book_batch', 'slot_ids': free_slots[1:3], 'mode': 'best_effort'}, token)
+    yield 'slots book_batch recurrence', call(fn['slots'], 'POST', {'action': 'book_batch', 'mode': 'best_effort', 'recurrence': {
+        'start_date': str(today + timedelta(days=1)), 'end_date': str(today + timedelta(days=30)), 'weekdays': [1, 3], 'time': '10:00'
+    }}, token)
+    yield 'slots generate_slots', call(fn['slots'], 'POST', {'action': 'generate_slots', 'start_date': str(today + timedelta(days=400)), 'days': 14}, admin_token)
+    yield 'slots cancel', call(fn['slots'], 'PUT', {'action': 'cancel', 'booking_id': body_of(book).get('booking_id')}, token)
+    yield 'slots book idempotent', call(fn['slots'], 'POST', {'action': 'book', 'slot_id': free_slots[3]}, token, headers={'Idempotency-Key': 'scenario'})
+    yield 'slots book replay', call(fn['slots'], 'POST', {'action': 'book', 'slot_id': free_slots[3]}, token, headers={'Idempotency-Key': 'scenario'})
+
+    yield 'profile', call(fn['profile'], 'GET', token=token)
+    yield 'profile cached', call(fn['profile'], 'GET', token=token)
+
+    clients = call(fn['clients'], 'GET')
+    yield 'clients list', clients
+    yield 'clients next page', call(fn['clients'], 'GET', query={'cursor': body_of(clients)['next_cursor']})
+    yield 'clients by id', call(fn['clients'], 'GET', query={'id': '17'})
+    yield 'clients search prefix', call(fn['clients'], 'GET', query={'q': 'кл'})
+    yield 'clients search', call(fn['clients'], 'GET', query={'q': 'клиент 123'})
+    yield 'clients search phone', call(fn['clients'], 'GET', query={'q': '9000001'})
+    created = call(fn['clients'], 'POST', {'full_name': 'Новый клиент', 'phone': '+70000000001'})
+    yield 'clients create', created
+    yield 'clients import', call(fn['clients'], 'POST', {'action': 'import', 'format': 'csv', 'data': (
+        'full_name,phone,email,subscription_type,total_sessions,valid_until\n'
+        'Импорт 1,+70000000002,import1@example.com,Месяц,8,2030-01-01\n'
+        'Импорт 2,+79000000001,,,,\n'
+    )})
+
+    bookings = call(fn['bookings'], 'GET')
+    yield 'bookings upcoming', bookings
+    yield 'bookings next page', call(fn['bookings'], 'GET', query={'cursor': body_of(bookings)['next_cursor']})
+    yield 'bookings by client', call(fn['bookings'], 'GET', query={'client_id': '17'})
+    yield 'bookings day', call(fn['bookings'], 'GET', query={'date': str(today + timedelta(days=3))})
+    yield 'bookings month', call(fn['bookings'], 'GET', query={'month': today.strftime('%Y-%m'), 'months': '3'})
+    with_subscription = call(fn['clients'], 'POST', {'action': 'import', 'format': 'jsonl', 'data': json.dumps({
+        'full_name': 'С абонементом', 'phone': '+70000000003', 'subscription_type': 'Месяц', 'total_sessions': 8, 'valid_until': '2030-01-01'
+    })})
+    client_id = body_of(with_subscription)['rows'][0]['client_id']
+    booking = call(fn['bookings'], 'POST', {'client_id': client_id, 'booking_date': str(today + timedelta(days=800)), 'booking_time': '10:00'})
+    yield 'bookings create', booking
+    booking_id = body_of(booking)['id']
+    yield 'bookings reschedule', call(fn['bookings'], 'PUT', {'id': booking_id, 'action': 'reschedule', 'new_date': str(today + timedelta(days=801)), 'new_time': '11:00'})
+    yield 'bookings cancel', call(fn['bookings'], 'PUT', {'id': booking_id, 'action': 'cancel'})
+
+    yield 'auth logout', call(fn['auth'], 'POST', {'action': 'logout'}, token)
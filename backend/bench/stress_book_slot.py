@@ -0,0 +1,128 @@
+'''
+Конкурентная запись на один слот: N параллельных запросов action=book
+к одному training_slots.id на каждом раунде. Проверяет, что побеждает
+ровно один запрос, и печатает пропускную способность.
+
+    BENCH_DATABASE_URL=postgresql://localhost/boxing_bench \
+        python backend/bench/stress_book_slot.py --clients 32 --rounds 50
+'''
+import argparse
+import json
+import os
+import secrets
+import threading
+from datetime import date, timedelta
+from time import perf_counter
+
+import psycopg2
+
+from handlers import load_handler_module
+from localdb import prepare_database, scratch_dsn
+
+def seed(dsn: str, clients: int, rounds: int):
+    conn = psycopg2.connect(dsn)
+    tokens = []
+    try:
+        with conn.cursor() as cur:
+            for i in range(clients):
+                cur.execute("""
+                    INSERT INTO users (email, password_hash, full_name)
+                    VALUES (%s, 'x', %s) RETURNING id
+                """, (f'stress{i}@example.com', f'Stress {i}'))
+                user_id = cur.fetchone()[0]
+                token = secrets.token_urlsafe(32)
+                tokens.append(token)
+                cur.execute("""
+                    INSERT INTO sessions (user_id, token_hash, expires_at)
+                    VALUES (%s, encode(sha256(%s::bytea), 'hex'), NOW() + INTERVAL '1 day')
+                """, (user_id, token))
+                cur.execute("""
+                    INSERT INTO subscriptions (user_id, subscription_type, total_sessions, used_sessions, start_date, end_date, status)
+                    VALUES (%s, 'stress', %s, 0, CURRENT_DATE, CURRENT_DATE + 30, 'active')
+                """, (user_id, rounds))
+            cur.execute("""
+                INSERT INTO training_slots (slot_date, slot_time, status)
+                SELECT %s + (n / 12), TIME '09:00' + (n %% 12) * INTERVAL '1 hour', 'available'
+                FROM generate_series(0, %s - 1) AS n
+                RETURNING id
+            """, (date.today() + timedelta(days=1), rounds))
+            slot_ids = sorted(row[0] for row in cur.fetchall())
+        conn.commit()
+    finally:
+        conn.close()
+    return tokens, slot_ids
+
+def book(slots, token: str, slot_id: int) -> int:
+    response = slots.handler({
+        'httpMethod': 'POST',
+        'headers': {'X-Auth-Token': token},
+        'body': json.dumps({'action': 'book', 'slot_id': slot_id})
+    }, None)
+    return response['statusCode']
+
+def run_round(slots, tokens, slot_id):
+    barrier = threading.Barrier(len(tokens))
+    statuses = [None] * len(tokens)
+    
+    def worker(i):
+        barrier.wait()
+        statuses[i] = book(slots, tokens[i], slot_id)
+    
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(tokens))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+def check_slot(dsn: str, slot_id: int) -> None:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT status FROM training_slots WHERE id = %s", (slot_id,))
+            assert cur.fetchone()[0] == 'booked', f'slot {slot_id} is not booked'
+            cur.execute("SELECT COUNT(*) FROM bookings WHERE slot_id = %s AND status = 'active'", (slot_id,))
+            active = cur.fetchone()[0]
+            assert active == 1, f'slot {slot_id} has {active} active bookings'
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+    
+    dsn = prepare_database(scratch_dsn())
+    os.environ['DATABASE_URL'] = dsn
+    tokens, slot_ids = seed(dsn, args.clients, args.rounds)
+    
+    slots = load_handler_module('slots')
+    slots.db_pool.max_size = args.clients
+    
+    started = perf_counter()
+    for slot_id in slot_ids:
+        statuses = run_round(slots, tokens, slot_id)
+        winners = statuses.count(201)
+        assert winners == 1, f'slot {slot_id}: {winners} winners, statuses {statuses}'
+        assert statuses.count(400) == len(tokens) - 1, f'slot {slot_id}: unexpected statuses {statuses}'
+        check_slot(dsn, slot_id)
+    elapsed = perf_counter() - started
+    
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT SUM(used_sessions) FROM subscriptions WHERE subscription_type = 'stress'")
+            used = cur.fetchone()[0]
+    finally:
+        conn.close()
+    assert used == len(slot_ids), f'{used} sessions debited for {len(slot_ids)} bookings'
+    
+    attempts = len(slot_ids) * len(tokens)
+    print(f'rounds={len(slot_ids)} clients={len(tokens)} attempts={attempts} '
+          f'elapsed={elapsed:.2f}s throughput={attempts / elapsed:.1f} req/s '
+          f'round_latency={elapsed / len(slot_ids) * 1000:.1f}ms')
+    print(f'pool={slots.db_pool.stats()}')
+
+if __name__ == '__main__':
+    main()
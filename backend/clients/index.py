@@ -1,15 +1,856 @@
 import json
 import os
-from typing import Dict, Any
+import threading
+import hashlib
+import base64
+import re
+import zlib
+import csv
+import io
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Dict, Any, Optional, List, Tuple
+from time import monotonic
+from json.encoder import encode_basestring_ascii
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import date, time, datetime
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from datetime import date, datetime
 
+REQUEST_TIMING_ENABLED = os.environ.get('REQUEST_TIMING_ENABLED', '1') == '1'
+STATEMENT_NAMES_MAX = 512
+METRICS_MAX_SERIES = 256
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64)
+ACTION_FIELD = re.compile(r'"action"\s*:\s*"([A-Za-z_]{1,32})"')
+STATEMENT_TARGET = re.compile(r'(?<!EPOCH )(?<!DISTINCT )\b(?:FROM|INTO|UPDATE|JOIN|COPY|TABLE)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+statement_names: Dict[Any, str] = {}
+
+def statement_name(query: Any) -> str:
+    '''
+    Стабильное имя SQL для Server-Timing и логов: первое слово, первая
+    таблица и crc32 текста запроса, например select-training_slots-3fa2
+    '''
+    name = statement_names.get(query)
+    if name is None:
+        text = query if isinstance(query, str) else str(query)
+        words = text.split(None, 1)
+        target = STATEMENT_TARGET.search(text)
+        name = '%s-%s-%04x' % (
+            words[0].lower() if words else 'sql',
+            target.group(1).lower() if target else 'none',
+            zlib.crc32(text.encode()) & 0xffff
+        )
+        if len(statement_names) >= STATEMENT_NAMES_MAX:
+            statement_names.clear()
+        statement_names[query] = name
+    return name
+
+def request_endpoint(event: Dict[str, Any]) -> str:
+    '''
+    Метка эндпоинта для метрик без разбора тела: метод плюс action из JSON
+    или, для GET, имена параметров запроса (кроме cursor и limit)
+    '''
+    method = event.get('httpMethod', 'GET')
+    if method == 'GET':
+        names = sorted(name for name in (event.get('queryStringParameters') or {}) if name not in ('cursor', 'limit'))
+        return 'GET ' + ','.join(names) if names else 'GET'
+    match = ACTION_FIELD.search(event.get('body') or '')
+    return method + ' ' + match.group(1) if match else method
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'total')
+    
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+    
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+def prometheus_labels(labels: Dict[str, Any]) -> str:
+    return ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+
+class RequestMetrics:
+    '''
+    Метрики тёплого контейнера с фиксированными корзинами: гистограммы времени
+    ответа и обращений к БД на эндпоинт и счётчик ответов по статусам.
+    render() отдаёт их в текстовом формате Prometheus
+    '''
+    def __init__(self):
+        self.function = ''
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self) -> None:
+        with self._lock:
+            self.latency: Dict[str, Histogram] = {}
+            self.round_trips: Dict[str, Histogram] = {}
+            self.responses: Dict[Tuple[str, int], int] = {}
+    
+    def observe(self, endpoint: str, status: int, seconds: float, round_trips: Optional[int]) -> None:
+        with self._lock:
+            latency = self.latency.get(endpoint)
+            if latency is None:
+                if len(self.latency) >= METRICS_MAX_SERIES:
+                    endpoint = 'other'
+                latency = self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS))
+            latency.observe(seconds)
+            if round_trips is not None:
+                histogram = self.round_trips.get(endpoint)
+                if histogram is None:
+                    histogram = self.round_trips[endpoint] = Histogram(ROUND_TRIP_BUCKETS)
+                histogram.observe(round_trips)
+            key = (endpoint, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+    
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for metric, help_text, series in (
+                ('http_request_duration_seconds', 'Время обработки запроса функцией', self.latency),
+                ('db_round_trips_per_request', 'Обращения к БД за запрос', self.round_trips)
+            ):
+                lines += ['# HELP %s %s' % (metric, help_text), '# TYPE %s histogram' % metric]
+                for endpoint, histogram in series.items():
+                    labels = prometheus_labels({'function': self.function, 'endpoint': endpoint})
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (metric, labels, bound, cumulative))
+                    lines.append('%s_sum{%s} %r' % (metric, labels, histogram.total))
+                    lines.append('%s_count{%s} %d' % (metric, labels, cumulative))
+            lines += ['# HELP http_responses_total Ответы по статусам', '# TYPE http_responses_total counter']
+            for (endpoint, status), count in self.responses.items():
+                labels = prometheus_labels({'function': self.function, 'endpoint': endpoint, 'status': status})
+                lines.append('http_responses_total{%s} %d' % (labels, count))
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+class TimerSpan:
+    __slots__ = ('timer', 'name', 'started')
+    
+    def __init__(self, timer: Any, name: str):
+        self.timer = timer
+        self.name = name
+    
+    def __enter__(self) -> None:
+        self.started = monotonic()
+    
+    def __exit__(self, *exc: Any) -> None:
+        self.timer.add(self.name, monotonic() - self.started)
+
+class RequestTimer(threading.local):
+    '''
+    Замеры текущего вызова: ожидание соединения, каждый SQL по имени,
+    кодирование JSON и общее время. finish() всегда записывает вызов
+    в request_metrics, а при REQUEST_TIMING_ENABLED ещё дописывает в ответ
+    заголовок Server-Timing и печатает в лог одну строку JSON. Без замеров
+    SQL обращения к БД не считаются и их гистограмма не пишется
+    '''
+    def __init__(self):
+        self.active = False
+    
+    def start(self, function: str, endpoint: str) -> None:
+        self.function = function
+        self.endpoint = endpoint
+        self.spans: Dict[str, float] = {}
+        self.statements: Dict[str, List[float]] = {}
+        self.round_trips = 0
+        self.active = True
+        self.started = monotonic()
+    
+    def add(self, name: str, seconds: float) -> None:
+        if self.active:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+    
+    def statement(self, name: str, seconds: float, calls: int = 1) -> None:
+        if self.active:
+            self.round_trips += 1
+            totals = self.statements.setdefault(name, [0, 0.0])
+            totals[0] += calls
+            totals[1] += seconds
+    
+    def span(self, name: str) -> Any:
+        return TimerSpan(self, name) if self.active else nullcontext()
+    
+    def finish(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.active:
+            return response
+        self.active = False
+        total = monotonic() - self.started
+        query_count = sum(calls for calls, _ in self.statements.values())
+        db_seconds = sum(seconds for _, seconds in self.statements.values())
+    
+        request_metrics.observe(self.endpoint, response.get('statusCode', 0), total,
+                                self.round_trips if REQUEST_TIMING_ENABLED else None)
+        if not REQUEST_TIMING_ENABLED:
+            return response
+    
+        metrics = [
+            'total;dur=%.2f' % (total * 1000),
+            'db;dur=%.2f;desc="%d queries, %d round trips"' % (db_seconds * 1000, query_count, self.round_trips)
+        ]
+        metrics += ['%s;dur=%.2f' % (name, seconds * 1000) for name, seconds in self.spans.items()]
+        metrics += ['%s;dur=%.2f;desc="x%d"' % (name, seconds * 1000, calls) for name, (calls, seconds) in self.statements.items()]
+        response['headers'] = dict(response.get('headers') or {}, **{
+            'Server-Timing': ', '.join(metrics),
+            'Timing-Allow-Origin': '*'
+        })
+    
+        print(json.dumps({
+            'function': self.function,
+            'endpoint': self.endpoint,
+            'status': response.get('statusCode'),
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(db_seconds * 1000, 2),
+            'query_count': query_count,
+            'round_trips': self.round_trips,
+            'spans_ms': {name: round(seconds * 1000, 2) for name, seconds in self.spans.items()},
+            'statements': {name: [calls, round(seconds * 1000, 2)] for name, (calls, seconds) in self.statements.items()}
+        }, separators=(',', ':')), flush=True)
+        return response
+
+request_timer = RequestTimer()
+
+class TimedCursorMixin:
+    timed_statement = 'sql'
+    
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = monotonic()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.timed_statement = statement_name(query)
+            request_timer.statement(self.timed_statement, monotonic() - started)
+    
+    def executemany(self, query: Any, vars_list: Any) -> Any:
+        started = monotonic()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self.timed_statement = statement_name(query)
+            request_timer.statement(self.timed_statement, monotonic() - started)
+    
+    def fetchmany(self, *args: Any) -> Any:
+        if self.name is None:
+            return super().fetchmany(*args)
+        started = monotonic()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            request_timer.statement(self.timed_statement, monotonic() - started, calls=0)
+    
+    def copy_expert(self, sql: str, file: Any, *args: Any) -> Any:
+        started = monotonic()
+        try:
+            return super().copy_expert(sql, file, *args)
+        finally:
+            request_timer.statement(statement_name(sql), monotonic() - started)
+
+timed_cursor_classes: Dict[Any, Any] = {}
+
+class TimedConnection(psycopg2.extensions.connection):
+    '''
+    Соединение, курсоры которого (любого cursor_factory) отчитываются
+    в request_timer. Пул открывает такие соединения, только когда замеры
+    включены (REQUEST_TIMING_ENABLED)
+    '''
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        if factory not in timed_cursor_classes:
+            timed_cursor_classes[factory] = type('Timed' + factory.__name__, (TimedCursorMixin, factory), {})
+        kwargs['cursor_factory'] = timed_cursor_classes[factory]
+        return super().cursor(*args, **kwargs)
+    
+    def commit(self) -> None:
+        if request_timer.active and self.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            request_timer.round_trips += 1
+        super().commit()
+    
+    def rollback(self) -> None:
+        if request_timer.active and self.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            request_timer.round_trips += 1
+        super().rollback()
+
+def metrics_response(event: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    action=metrics только для администратора: GET отдаёт метрики в формате
+    Prometheus, POST с "reset": true отдаёт их и обнуляет перед новым прогоном
+    '''
+    headers = event.get('headers') or {}
+    token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
+    if not token:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Требуется авторизация'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = None
+    try:
+        conn = db_pool.getconn()
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT u.role = 'admin'
+                FROM sessions s
+                JOIN users u ON u.id = s.user_id
+                WHERE s.token_hash = %s AND s.expires_at > NOW()
+            """, (hashlib.sha256(token.encode()).hexdigest(),))
+            row = cur.fetchone()
+        conn.rollback()
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        if conn is not None:
+            db_pool.putconn(conn)
+    
+    if not row:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Недействительный токен'}),
+            'isBase64Encoded': False
+        }
+    if not row[0]:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Недостаточно прав'}),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        options = json.loads(event.get('body') or '{}') if event.get('httpMethod') == 'POST' else {}
+    except ValueError:
+        options = None
+    if not isinstance(options, dict):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Неверное тело запроса'}),
+            'isBase64Encoded': False
+        }
+    
+    body = request_metrics.render()
+    if options.get('reset'):
+        request_metrics.reset()
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8', 'Access-Control-Allow-Origin': '*'},
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+def timed_handler(function: str) -> Any:
+    def wrap(handler: Any) -> Any:
+        request_metrics.function = function
+    
+        def timed(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if event.get('httpMethod') == 'OPTIONS':
+                return handler(event, context)
+            endpoint = request_endpoint(event)
+            if endpoint == 'POST metrics' or (endpoint == 'GET action' and event['queryStringParameters']['action'] == 'metrics'):
+                return metrics_response(event)
+            request_timer.start(function, endpoint)
+            return request_timer.finish(handler(event, context))
+        return timed
+    return wrap
+
+class ConnectionPool:
+    '''
+    Пул соединений с БД, переживающий вызовы в тёплом контейнере.
+    Проверяет простаивавшие соединения, откатывает незавершённые транзакции
+    и закрывает соединения старше max_lifetime секунд.
+    '''
+    def __init__(self, max_size: int, max_lifetime: float, check_after_idle: float):
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.check_after_idle = check_after_idle
+        self._cond = threading.Condition()
+        self._idle: List[Tuple[Any, float, float]] = []
+        self._created_at: Dict[int, float] = {}
+        self._size = 0
+        self.counters: Dict[str, float] = {
+            'acquired': 0,
+            'created': 0,
+            'reused': 0,
+            'discarded': 0,
+            'acquire_wait_seconds': 0.0,
+            'acquire_wait_max_seconds': 0.0
+        }
+    
+    def getconn(self) -> Any:
+        started = monotonic()
+        while True:
+            conn = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    self._cond.wait()
+                if self._idle:
+                    conn, created_at, released_at = self._idle.pop()
+                else:
+                    self._size += 1
+            
+            if conn is None:
+                try:
+                    conn = psycopg2.connect(
+                        os.environ['DATABASE_URL'],
+                        connection_factory=TimedConnection if REQUEST_TIMING_ENABLED else None
+                    )
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                self._created_at[id(conn)] = monotonic()
+                self.counters['created'] += 1
+                break
+            
+            if self._is_healthy(conn, created_at, released_at):
+                self.counters['reused'] += 1
+                break
+            self._discard(conn)
+        
+        waited = monotonic() - started
+        request_timer.add('connect', waited)
+        self.counters['acquired'] += 1
+        self.counters['acquire_wait_seconds'] += waited
+        if waited > self.counters['acquire_wait_max_seconds']:
+            self.counters['acquire_wait_max_seconds'] = waited
+        return conn
+    
+    def putconn(self, conn: Any) -> None:
+        created_at = self._created_at.get(id(conn), 0.0)
+        reusable = not conn.closed and monotonic() - created_at <= self.max_lifetime
+        if reusable and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                reusable = False
+            reusable = reusable and conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+        
+        if not reusable:
+            self._discard(conn)
+            return
+        
+        with self._cond:
+            self._idle.append((conn, created_at, monotonic()))
+            self._cond.notify()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self.counters, size=self._size, idle=len(self._idle), max_size=self.max_size)
+    
+    def _is_healthy(self, conn: Any, created_at: float, released_at: float) -> bool:
+        now = monotonic()
+        if conn.closed or now - created_at > self.max_lifetime:
+            return False
+        if now - released_at > self.check_after_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+    
+    def _discard(self, conn: Any) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._created_at.pop(id(conn), None)
+        self.counters['discarded'] += 1
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+db_pool = ConnectionPool(
+    max_size=int(os.environ.get('DB_POOL_MAX_SIZE', '4')),
+    max_lifetime=float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800')),
+    check_after_idle=float(os.environ.get('DB_POOL_CHECK_AFTER_IDLE', '30'))
+)
+
+def json_temporal(value: Any) -> str:
+    return '"' + value.isoformat() + '"'
+
+def json_bool(value: Any) -> str:
+    return 'true' if value else 'false'
+
+JSON_ENCODERS_BY_OID = {
+    16: json_bool,
+    20: str,
+    21: str,
+    23: str,
+    25: encode_basestring_ascii,
+    1042: encode_basestring_ascii,
+    1043: encode_basestring_ascii,
+    1082: json_temporal,
+    1083: json_temporal,
+    1114: json_temporal,
+    1184: json_temporal
+}
+
+class RowEncoder:
+    '''
+    Кодирует строки кортежного курсора сразу в JSON-объекты без промежуточных
+    dict: шаблон с ключами и кодировщик каждой колонки выбираются один раз
+    по cursor.description
+    '''
+    def __init__(self, description: Any):
+        self.template = '{' + ','.join(
+            json.dumps(column.name).replace('%', '%%') + ':%s' for column in description
+        ) + '}'
+        self.encoders = [JSON_ENCODERS_BY_OID.get(column.type_code, json.dumps) for column in description]
+    
+    def encode(self, row: Tuple[Any, ...]) -> str:
+        return self.template % tuple(['null' if value is None else encode(value) for encode, value in zip(self.encoders, row)])
+    
+    def encode_rows(self, rows: Any) -> str:
+        with request_timer.span('encode'):
+            return '[' + ','.join([self.encode(row) for row in rows]) + ']'
+
+STREAM_FETCH_SIZE = int(os.environ.get('STREAM_FETCH_SIZE', '500'))
+
+def encode_page_cursor(position: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).rstrip(b'=').decode()
+
+def decode_page_cursor(value: str) -> List[Any]:
+    position = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+    if not isinstance(position, list):
+        raise ValueError('cursor')
+    return position
+
+def stream_rows(conn: Any, name: str, sql: str, params: Dict[str, Any], limit: int) -> Tuple[List[str], Optional[Dict[str, Any]]]:
+    '''
+    Читает результат серверным курсором порциями по STREAM_FETCH_SIZE строк
+    и сразу кодирует их в JSON. Отдаёт не больше limit строк; если результат
+    длиннее, вторым значением возвращает последнюю отданную строку как dict.
+    Неполная порция означает конец результата - лишний пустой FETCH не нужен
+    '''
+    encoded: List[str] = []
+    last_row = None
+    with conn.cursor(name=name) as cur:
+        cur.itersize = STREAM_FETCH_SIZE
+        cur.execute(sql, params)
+        encoder = None
+        while True:
+            batch = cur.fetchmany(STREAM_FETCH_SIZE)
+            if not batch:
+                return encoded, None
+            if encoder is None:
+                encoder = RowEncoder(cur.description)
+            with request_timer.span('encode'):
+                for row in batch:
+                    if len(encoded) == limit:
+                        return encoded, dict(zip([column.name for column in cur.description], last_row))
+                    encoded.append(encoder.encode(row))
+                    last_row = row
+            if len(batch) < STREAM_FETCH_SIZE:
+                return encoded, None
+
+CLIENTS_PAGE_SIZE = int(os.environ.get('CLIENTS_PAGE_SIZE', '50'))
+CLIENTS_PAGE_MAX_ROWS = int(os.environ.get('CLIENTS_PAGE_MAX_ROWS', '200'))
+CLIENT_SEARCH_LIMIT = int(os.environ.get('CLIENT_SEARCH_LIMIT', '10'))
+CLIENT_SEARCH_MAX_LIMIT = 50
+CLIENT_SEARCH_MIN_LENGTH = 2
+CLIENT_SEARCH_TRIGRAM_LENGTH = 5
+CLIENT_SEARCH_PHONE_MIN_DIGITS = 4
+
+def like_escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def client_search_query(query: str) -> Tuple[str, str, Dict[str, Any]]:
+    '''
+    Условие поиска клиента по имени, email и цифрам телефона и выражение
+    «совпал префикс» для сортировки. Короткий запрос ищется только по префиксу
+    (btree text_pattern_ops), от CLIENT_SEARCH_TRIGRAM_LENGTH символов - по
+    подстроке и похожести имени (pg_trgm): частые короткие куски фамилий
+    вроде «ова» совпадают с большой долей клиентов, и все они попадали бы
+    в сортировку по похожести до LIMIT. По телефону ищется от CLIENT_SEARCH_PHONE_MIN_DIGITS цифр:
+    префикс вроде «79» совпадает почти со всеми номерами и тянет в сортировку
+    всю таблицу
+    '''
+    digits = re.sub(r'\D', '', query)
+    prefix = like_escape(query) + '%'
+    substring = len(query) >= CLIENT_SEARCH_TRIGRAM_LENGTH
+    params = {
+        'query': query,
+        'prefix': prefix,
+        'pattern': '%' + prefix if substring else prefix,
+        'phone_prefix': digits + '%',
+        'phone_pattern': '%' + digits + '%'
+    }
+    conditions = ["lower(c.full_name) LIKE %(pattern)s", "lower(c.email) LIKE %(pattern)s"]
+    prefix_matches = ["lower(c.full_name) LIKE %(prefix)s", "COALESCE(lower(c.email) LIKE %(prefix)s, false)"]
+    if substring:
+        conditions.append("%(query)s <%% lower(c.full_name)")
+    if len(digits) >= CLIENT_SEARCH_PHONE_MIN_DIGITS:
+        conditions.append("regexp_replace(c.phone, '\\D', '', 'g') LIKE %(phone_pattern)s")
+        prefix_matches.append("regexp_replace(c.phone, '\\D', '', 'g') LIKE %(phone_prefix)s")
+    return ' OR '.join(conditions), ' OR '.join(prefix_matches), params
+
+
+CLIENT_IMPORT_MAX_ROWS = int(os.environ.get('CLIENT_IMPORT_MAX_ROWS', '10000'))
+CLIENT_IMPORT_COLUMNS = ('full_name', 'phone', 'email', 'subscription_type', 'total_sessions', 'valid_until')
+CLIENT_IMPORT_MAX_LENGTHS = {'full_name': 255, 'phone': 50, 'email': 255, 'subscription_type': 100}
+
+def read_import_records(fmt: str, data: str, delimiter: str) -> List[Tuple[int, Any]]:
+    '''
+    Разбирает CSV с заголовком или JSON lines в пары (номер строки, запись).
+    Строка JSON, которую не удалось разобрать, возвращается как None
+    '''
+    if not isinstance(data, str):
+        raise ValueError('data')
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(data.lstrip('\ufeff')), delimiter=delimiter)
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        return [(reader.line_num, record) for record in reader]
+    if fmt == 'jsonl':
+        records = []
+        for line, text in enumerate(data.splitlines(), start=1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                record = None
+            records.append((line, record if isinstance(record, dict) else None))
+        return records
+    raise ValueError('format')
+
+def validate_import_record(record: Any) -> Tuple[Optional[Tuple[Any, ...]], Optional[str]]:
+    '''
+    Приводит запись импорта к строке временной таблицы или возвращает причину отказа
+    '''
+    if record is None:
+        return None, 'Строка не разобрана'
+    values = {}
+    for column in CLIENT_IMPORT_COLUMNS:
+        value = record.get(column)
+        value = str(value).strip() if value is not None else ''
+        if len(value) > CLIENT_IMPORT_MAX_LENGTHS.get(column, len(value)):
+            return None, f'Слишком длинное поле {column}'
+        values[column] = value or None
+    if not values['full_name'] or not values['phone']:
+        return None, 'Нужны full_name и phone'
+    if values['subscription_type']:
+        try:
+            values['total_sessions'] = int(values['total_sessions'])
+            values['valid_until'] = date.fromisoformat(values['valid_until'])
+        except (TypeError, ValueError):
+            return None, 'Абонементу нужны total_sessions и valid_until (ГГГГ-ММ-ДД)'
+        if values['total_sessions'] <= 0:
+            return None, 'total_sessions должно быть больше нуля'
+    else:
+        values['total_sessions'] = values['valid_until'] = None
+    return tuple(values[column] for column in CLIENT_IMPORT_COLUMNS), None
+
+def import_clients(conn: Any, records: List[Tuple[int, Any]]) -> List[Dict[str, Any]]:
+    '''
+    Загружает проверенные строки COPY во временную таблицу и одним запросом
+    добавляет клиентов (и абонементы), отбрасывая дубли телефона и email как
+    внутри файла, так и с уже существующими клиентами. Возвращает отчёт по строкам
+    '''
+    report = []
+    staged = io.StringIO()
+    writer = csv.writer(staged)
+    for line, record in records:
+        row, error = validate_import_record(record)
+        if error:
+            report.append({'line': line, 'status': 'rejected', 'error': error})
+        else:
+            writer.writerow((line,) + row)
+    staged.seek(0)
+    
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TEMP TABLE client_import (
+                line INTEGER PRIMARY KEY,
+                full_name TEXT NOT NULL,
+                phone TEXT NOT NULL,
+                email TEXT,
+                subscription_type TEXT,
+                total_sessions INTEGER,
+                valid_until DATE
+            ) ON COMMIT DROP
+        ''')
+        cur.copy_expert('''
+            COPY client_import (line, full_name, phone, email, subscription_type, total_sessions, valid_until)
+            FROM STDIN WITH (FORMAT csv)
+        ''', staged)
+        cur.execute('ANALYZE client_import')
+        cur.execute('''
+            WITH checked AS (
+                SELECT i.*,
+                       CASE
+                           WHEN row_number() OVER (PARTITION BY i.phone ORDER BY i.line) > 1
+                               THEN 'Телефон повторяется в файле'
+                           WHEN i.email IS NOT NULL AND row_number() OVER (PARTITION BY i.email ORDER BY i.line) > 1
+                               THEN 'Email повторяется в файле'
+                           WHEN EXISTS (SELECT 1 FROM clients c WHERE c.phone = i.phone)
+                               THEN 'Клиент с таким телефоном уже есть'
+                           WHEN i.email IS NOT NULL AND EXISTS (SELECT 1 FROM clients c WHERE c.email = i.email)
+                               THEN 'Клиент с таким email уже есть'
+                       END as error
+                FROM client_import i
+            ),
+            inserted AS (
+                INSERT INTO clients (full_name, phone, email)
+                SELECT full_name, phone, email
+                FROM checked
+                WHERE error IS NULL
+                ORDER BY line
+                ON CONFLICT DO NOTHING
+                RETURNING id, phone
+            ),
+            subscribed AS (
+                INSERT INTO subscriptions (client_id, type, total_sessions, remaining_sessions, valid_until)
+                SELECT ins.id, ch.subscription_type, ch.total_sessions, ch.total_sessions, ch.valid_until
+                FROM inserted ins
+                JOIN checked ch ON ch.phone = ins.phone AND ch.error IS NULL
+                WHERE ch.subscription_type IS NOT NULL
+                RETURNING id, client_id
+            )
+            SELECT ch.line, ins.id, sub.id,
+                   COALESCE(ch.error, CASE WHEN ins.id IS NULL THEN 'Клиент с таким телефоном или email уже есть' END)
+            FROM checked ch
+            LEFT JOIN inserted ins ON ins.phone = ch.phone AND ch.error IS NULL
+            LEFT JOIN subscribed sub ON sub.client_id = ins.id
+            ORDER BY ch.line
+        ''')
+        for line, client_id, subscription_id, error in cur.fetchall():
+            if error:
+                report.append({'line': line, 'status': 'rejected', 'error': error})
+            else:
+                report.append({'line': line, 'status': 'accepted', 'client_id': client_id, 'subscription_id': subscription_id})
+    
+    report.sort(key=lambda item: item['line'])
+    return report
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_CLEANUP_EVERY = 100
+IDEMPOTENCY_CLEANUP_BATCH = 500
+idempotency_stats: Dict[str, int] = {'stored': 0, 'replayed': 0}
+
+def idempotency_replay(stored: Tuple[Any, ...], request_hash: str) -> Dict[str, Any]:
+    stored_hash, status_code, body = stored
+    if stored_hash != request_hash:
+        status_code, body = 422, json.dumps({'error': 'Idempotency-Key уже использован с другим запросом'})
+    elif status_code is None:
+        status_code, body = 409, json.dumps({'error': 'Запрос с этим Idempotency-Key ещё выполняется'})
+    else:
+        idempotency_stats['replayed'] += 1
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Idempotent-Replayed': 'true'
+        },
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+def run_idempotent(conn: Any, event: Dict[str, Any], scope: str, process: Any) -> Dict[str, Any]:
+    '''
+    Выполняет POST/PUT с заголовком Idempotency-Key не больше одного раза.
+    Ключ занимается строкой idempotency_keys в транзакции самой записи, ответ
+    сохраняется сразу после неё; повтор получает сохранённый ответ одним
+    поиском по первичному ключу, параллельный дубль - 409
+    '''
+    headers = event.get('headers', {}) or {}
+    key = headers.get('Idempotency-Key') or headers.get('idempotency-key')
+    if not key or event.get('httpMethod') not in ('POST', 'PUT'):
+        return process(conn, event)
+    if len(key) > 255:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Слишком длинный Idempotency-Key'}),
+            'isBase64Encoded': False
+        }
+    
+    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+    if token:
+        scope = f'{scope}:{hashlib.sha256(token.encode()).hexdigest()}'
+    request_hash = hashlib.sha256(f"{event.get('httpMethod')} {event.get('body') or ''}".encode()).hexdigest()
+    
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT request_hash, status_code, body
+            FROM idempotency_keys
+            WHERE scope = %s AND idempotency_key = %s AND expires_at > NOW()
+        """, (scope, key))
+        stored = cur.fetchone()
+        if stored is None:
+            cur.execute("""
+                INSERT INTO idempotency_keys (scope, idempotency_key, request_hash, expires_at)
+                VALUES (%s, %s, %s, NOW() + %s * INTERVAL '1 second')
+                ON CONFLICT (scope, idempotency_key) DO UPDATE
+                SET request_hash = EXCLUDED.request_hash, status_code = NULL, body = NULL,
+                    created_at = NOW(), expires_at = EXCLUDED.expires_at
+                WHERE idempotency_keys.expires_at <= NOW()
+                RETURNING 1
+            """, (scope, key, request_hash, IDEMPOTENCY_TTL_SECONDS))
+            if cur.fetchone() is None:
+                conn.rollback()
+                cur.execute("""
+                    SELECT request_hash, status_code, body
+                    FROM idempotency_keys
+                    WHERE scope = %s AND idempotency_key = %s
+                """, (scope, key))
+                stored = cur.fetchone()
+    if stored is not None:
+        conn.rollback()
+        return idempotency_replay(stored, request_hash)
+    
+    response = process(conn, event)
+    if response['statusCode'] >= 500:
+        conn.rollback()
+        return response
+    
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO idempotency_keys (scope, idempotency_key, request_hash, status_code, body, expires_at)
+            VALUES (%s, %s, %s, %s, %s, NOW() + %s * INTERVAL '1 second')
+            ON CONFLICT (scope, idempotency_key) DO UPDATE
+            SET request_hash = EXCLUDED.request_hash, status_code = EXCLUDED.status_code, body = EXCLUDED.body
+        """, (scope, key, request_hash, response['statusCode'], response['body'], IDEMPOTENCY_TTL_SECONDS))
+        idempotency_stats['stored'] += 1
+        if idempotency_stats['stored'] % IDEMPOTENCY_CLEANUP_EVERY == 0:
+            cur.execute("""
+                DELETE FROM idempotency_keys
+                WHERE ctid IN (
+                    SELECT ctid FROM idempotency_keys
+                    WHERE expires_at <= NOW()
+                    LIMIT %s
+                )
+            """, (IDEMPOTENCY_CLEANUP_BATCH,))
+    conn.commit()
+    return response
+
+@timed_handler('clients')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Управление клиентами и абонементами
     GET /clients/{id} - получить данные клиента с абонементом
+    GET /clients?limit=50&cursor=... - список клиентов постранично (next_cursor)
+    GET /clients?q=иван&limit=10 - поиск по имени, телефону и email
     POST /clients - создать нового клиента
+    POST /clients {action: import, format: csv|jsonl, data} - массовый импорт с отчётом по строкам
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -19,15 +860,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    conn = db_pool.getconn()
+    try:
+        return run_idempotent(conn, event, 'clients:' + method, route_request)
+    finally:
+        db_pool.putconn(conn)
+
+def route_request(conn: Any, event: Dict[str, Any]) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    cur = conn.cursor()
     
     try:
         if method == 'GET':
@@ -66,10 +914,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                result_dict = dict(result)
-                for key, value in result_dict.items():
-                    if isinstance(value, (date, time, datetime)):
-                        result_dict[key] = value.isoformat()
+                client = RowEncoder(cur.description).encode(result)
                 
                 return {
                     'statusCode': 200,
@@ -77,21 +922,86 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps(result_dict),
+                    'body': client,
+                    'isBase64Encoded': False
+                }
+            elif params.get('q') is not None:
+                query = ' '.join(params['q'].lower().split())
+                try:
+                    limit = min(max(int(params.get('limit', CLIENT_SEARCH_LIMIT)), 1), CLIENT_SEARCH_MAX_LIMIT)
+                    if len(query) < CLIENT_SEARCH_MIN_LENGTH:
+                        raise ValueError('q')
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Запрос слишком короткий или неверный limit'}),
+                        'isBase64Encoded': False
+                    }
+                
+                condition, prefix_match, search_params = client_search_query(query)
+                search_params['limit'] = limit
+                cur.execute(f'''
+                    SELECT c.id, c.full_name, c.phone, c.email
+                    FROM clients c
+                    WHERE {condition}
+                    ORDER BY ({prefix_match}) DESC,
+                             word_similarity(%(query)s, lower(c.full_name)) DESC,
+                             c.full_name, c.id
+                    LIMIT %(limit)s
+                ''', search_params)
+                
+                result = RowEncoder(cur.description).encode_rows(cur)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': '{"clients":%s}' % result,
                     'isBase64Encoded': False
                 }
             else:
-                cur.execute('''
-                    SELECT c.id, c.full_name, c.phone, c.email,
-                           COUNT(s.id) as subscriptions_count
+                page_cursor = params.get('cursor')
+                try:
+                    limit = min(max(int(params.get('limit', CLIENTS_PAGE_SIZE)), 1), CLIENTS_PAGE_MAX_ROWS)
+                    if page_cursor:
+                        position = decode_page_cursor(page_cursor)
+                        after = (datetime.fromisoformat(position[0]), int(position[1]))
+                    else:
+                        after = None
+                except (ValueError, TypeError, IndexError):
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный limit или cursor'}),
+                        'isBase64Encoded': False
+                    }
+                
+                keyset = "WHERE (c.created_at, c.id) < (%(after_created_at)s, %(after_id)s)" if after else ""
+                clients, last_row = stream_rows(conn, 'client_page', f'''
+                    SELECT c.id, c.full_name, c.phone, c.email, c.created_at,
+                           (SELECT COUNT(*) FROM subscriptions s WHERE s.client_id = c.id) as subscriptions_count
                     FROM clients c
-                    LEFT JOIN subscriptions s ON c.id = s.client_id
-                    GROUP BY c.id, c.full_name, c.phone, c.email
-                    ORDER BY c.created_at DESC
-                ''')
+                    {keyset}
+                    ORDER BY c.created_at DESC, c.id DESC
+                    LIMIT %(limit)s + 1
+                ''', {
+                    'after_created_at': after and after[0],
+                    'after_id': after and after[1],
+                    'limit': limit
+                }, limit)
                 
-                rows = cur.fetchall()
-                result = [dict(row) for row in rows]
+                next_cursor = None
+                if last_row:
+                    next_cursor = encode_page_cursor([last_row['created_at'].isoformat(), last_row['id']])
                 
                 return {
                     'statusCode': 200,
@@ -99,12 +1009,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({'clients': result}),
+                    'body': '{"clients":[%s],"next_cursor":%s}' % (','.join(clients), json.dumps(next_cursor)),
                     'isBase64Encoded': False
                 }
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
+            
+            if body.get('action') == 'import':
+                try:
+                    records = read_import_records(body.get('format', 'csv'), body.get('data') or '', body.get('delimiter', ','))
+                except (ValueError, TypeError, csv.Error):
+                    records = None
+                if records is None or len(records) > CLIENT_IMPORT_MAX_ROWS:
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': f'Нужны format csv или jsonl, data строкой и не больше {CLIENT_IMPORT_MAX_ROWS} строк'}),
+                        'isBase64Encoded': False
+                    }
+                
+                report = import_clients(conn, records)
+                conn.commit()
+                accepted = sum(1 for item in report if item['status'] == 'accepted')
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'accepted': accepted, 'rejected': len(report) - accepted, 'rows': report}),
+                    'isBase64Encoded': False
+                }
+            
             full_name = body.get('full_name')
             phone = body.get('phone')
             email = body.get('email')
@@ -115,7 +1056,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 RETURNING id
             ''', (full_name, phone, email))
             
-            client_id = cur.fetchone()['id']
+            client_id = cur.fetchone()[0]
             conn.commit()
             
             return {
@@ -152,4 +1093,3 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cur.close()
-        conn.close()
@@ -1,35 +1,685 @@
 import json
 import os
+import threading
 import hashlib
-from typing import Dict, Any, Optional
+import hmac
+import base64
+import re
+import zlib
+from collections import OrderedDict
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Dict, Any, Optional, List, Tuple
+from time import monotonic
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+REQUEST_TIMING_ENABLED = os.environ.get('REQUEST_TIMING_ENABLED', '1') == '1'
+STATEMENT_NAMES_MAX = 512
+METRICS_MAX_SERIES = 256
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64)
+ACTION_FIELD = re.compile(r'"action"\s*:\s*"([A-Za-z_]{1,32})"')
+STATEMENT_TARGET = re.compile(r'(?<!EPOCH )(?<!DISTINCT )\b(?:FROM|INTO|UPDATE|JOIN|COPY|TABLE)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+statement_names: Dict[Any, str] = {}
 
-def hash_token(token: str) -> str:
-    return hashlib.sha256(token.encode()).hexdigest()
+def statement_name(query: Any) -> str:
+    '''
+    Стабильное имя SQL для Server-Timing и логов: первое слово, первая
+    таблица и crc32 текста запроса, например select-training_slots-3fa2
+    '''
+    name = statement_names.get(query)
+    if name is None:
+        text = query if isinstance(query, str) else str(query)
+        words = text.split(None, 1)
+        target = STATEMENT_TARGET.search(text)
+        name = '%s-%s-%04x' % (
+            words[0].lower() if words else 'sql',
+            target.group(1).lower() if target else 'none',
+            zlib.crc32(text.encode()) & 0xffff
+        )
+        if len(statement_names) >= STATEMENT_NAMES_MAX:
+            statement_names.clear()
+        statement_names[query] = name
+    return name
+
+def request_endpoint(event: Dict[str, Any]) -> str:
+    '''
+    Метка эндпоинта для метрик без разбора тела: метод плюс action из JSON
+    или, для GET, имена параметров запроса (кроме cursor и limit)
+    '''
+    method = event.get('httpMethod', 'GET')
+    if method == 'GET':
+        names = sorted(name for name in (event.get('queryStringParameters') or {}) if name not in ('cursor', 'limit'))
+        return 'GET ' + ','.join(names) if names else 'GET'
+    match = ACTION_FIELD.search(event.get('body') or '')
+    return method + ' ' + match.group(1) if match else method
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'total')
+    
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+    
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+def prometheus_labels(labels: Dict[str, Any]) -> str:
+    return ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+
+class RequestMetrics:
+    '''
+    Метрики тёплого контейнера с фиксированными корзинами: гистограммы времени
+    ответа и обращений к БД на эндпоинт и счётчик ответов по статусам.
+    render() отдаёт их в текстовом формате Prometheus
+    '''
+    def __init__(self):
+        self.function = ''
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self) -> None:
+        with self._lock:
+            self.latency: Dict[str, Histogram] = {}
+            self.round_trips: Dict[str, Histogram] = {}
+            self.responses: Dict[Tuple[str, int], int] = {}
+    
+    def observe(self, endpoint: str, status: int, seconds: float, round_trips: Optional[int]) -> None:
+        with self._lock:
+            latency = self.latency.get(endpoint)
+            if latency is None:
+                if len(self.latency) >= METRICS_MAX_SERIES:
+                    endpoint = 'other'
+                latency = self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS))
+            latency.observe(seconds)
+            if round_trips is not None:
+                histogram = self.round_trips.get(endpoint)
+                if histogram is None:
+                    histogram = self.round_trips[endpoint] = Histogram(ROUND_TRIP_BUCKETS)
+                histogram.observe(round_trips)
+            key = (endpoint, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+    
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for metric, help_text, series in (
+                ('http_request_duration_seconds', 'Время обработки запроса функцией', self.latency),
+                ('db_round_trips_per_request', 'Обращения к БД за запрос', self.round_trips)
+            ):
+                lines += ['# HELP %s %s' % (metric, help_text), '# TYPE %s histogram' % metric]
+                for endpoint, histogram in series.items():
+                    labels = prometheus_labels({'function': self.function, 'endpoint': endpoint})
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (metric, labels, bound, cumulative))
+                    lines.append('%s_sum{%s} %r' % (metric, labels, histogram.total))
+                    lines.append('%s_count{%s} %d' % (metric, labels, cumulative))
+            lines += ['# HELP http_responses_total Ответы по статусам', '# TYPE http_responses_total counter']
+            for (endpoint, status), count in self.responses.items():
+                labels = prometheus_labels({'function': self.function, 'endpoint': endpoint, 'status': status})
+                lines.append('http_responses_total{%s} %d' % (labels, count))
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+class TimerSpan:
+    __slots__ = ('timer', 'name', 'started')
+    
+    def __init__(self, timer: Any, name: str):
+        self.timer = timer
+        self.name = name
+    
+    def __enter__(self) -> None:
+        self.started = monotonic()
+    
+    def __exit__(self, *exc: Any) -> None:
+        self.timer.add(self.name, monotonic() - self.started)
+
+class RequestTimer(threading.local):
+    '''
+    Замеры текущего вызова: ожидание соединения, каждый SQL по имени,
+    кодирование JSON и общее время. finish() всегда записывает вызов
+    в request_metrics, а при REQUEST_TIMING_ENABLED ещё дописывает в ответ
+    заголовок Server-Timing и печатает в лог одну строку JSON. Без замеров
+    SQL обращения к БД не считаются и их гистограмма не пишется
+    '''
+    def __init__(self):
+        self.active = False
+    
+    def start(self, function: str, endpoint: str) -> None:
+        self.function = function
+        self.endpoint = endpoint
+        self.spans: Dict[str, float] = {}
+        self.statements: Dict[str, List[float]] = {}
+        self.round_trips = 0
+        self.active = True
+        self.started = monotonic()
+    
+    def add(self, name: str, seconds: float) -> None:
+        if self.active:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+    
+    def statement(self, name: str, seconds: float, calls: int = 1) -> None:
+        if self.active:
+            self.round_trips += 1
+            totals = self.statements.setdefault(name, [0, 0.0])
+            totals[0] += calls
+            totals[1] += seconds
+    
+    def span(self, name: str) -> Any:
+        return TimerSpan(self, name) if self.active else nullcontext()
+    
+    def finish(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.active:
+            return response
+        self.active = False
+        total = monotonic() - self.started
+        query_count = sum(calls for calls, _ in self.statements.values())
+        db_seconds = sum(seconds for _, seconds in self.statements.values())
+    
+        request_metrics.observe(self.endpoint, response.get('statusCode', 0), total,
+                                self.round_trips if REQUEST_TIMING_ENABLED else None)
+        if not REQUEST_TIMING_ENABLED:
+            return response
+    
+        metrics = [
+            'total;dur=%.2f' % (total * 1000),
+            'db;dur=%.2f;desc="%d queries, %d round trips"' % (db_seconds * 1000, query_count, self.round_trips)
+        ]
+        metrics += ['%s;dur=%.2f' % (name, seconds * 1000) for name, seconds in self.spans.items()]
+        metrics += ['%s;dur=%.2f;desc="x%d"' % (name, seconds * 1000, calls) for name, (calls, seconds) in self.statements.items()]
+        response['headers'] = dict(response.get('headers') or {}, **{
+            'Server-Timing': ', '.join(metrics),
+            'Timing-Allow-Origin': '*'
+        })
+    
+        print(json.dumps({
+            'function': self.function,
+            'endpoint': self.endpoint,
+            'status': response.get('statusCode'),
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(db_seconds * 1000, 2),
+            'query_count': query_count,
+            'round_trips': self.round_trips,
+            'spans_ms': {name: round(seconds * 1000, 2) for name, seconds in self.spans.items()},
+            'statements': {name: [calls, round(seconds * 1000, 2)] for name, (calls, seconds) in self.statements.items()}
+        }, separators=(',', ':')), flush=True)
+        return response
+
+request_timer = RequestTimer()
+
+class TimedCursorMixin:
+    timed_statement = 'sql'
+    
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = monotonic()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.timed_statement = statement_name(query)
+            request_timer.statement(self.timed_statement, monotonic() - started)
+    
+    def executemany(self, query: Any, vars_list: Any) -> Any:
+        started = monotonic()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self.timed_statement = statement_name(query)
+            request_timer.statement(self.timed_statement, monotonic() - started)
+    
+    def fetchmany(self, *args: Any) -> Any:
+        if self.name is None:
+            return super().fetchmany(*args)
+        started = monotonic()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            request_timer.statement(self.timed_statement, monotonic() - started, calls=0)
+    
+    def copy_expert(self, sql: str, file: Any, *args: Any) -> Any:
+        started = monotonic()
+        try:
+            return super().copy_expert(sql, file, *args)
+        finally:
+            request_timer.statement(statement_name(sql), monotonic() - started)
+
+timed_cursor_classes: Dict[Any, Any] = {}
 
-def verify_token(token: str) -> Optional[Dict[str, Any]]:
-    conn = get_db_connection()
+class TimedConnection(psycopg2.extensions.connection):
+    '''
+    Соединение, курсоры которого (любого cursor_factory) отчитываются
+    в request_timer. Пул открывает такие соединения, только когда замеры
+    включены (REQUEST_TIMING_ENABLED)
+    '''
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        if factory not in timed_cursor_classes:
+            timed_cursor_classes[factory] = type('Timed' + factory.__name__, (TimedCursorMixin, factory), {})
+        kwargs['cursor_factory'] = timed_cursor_classes[factory]
+        return super().cursor(*args, **kwargs)
+    
+    def commit(self) -> None:
+        if request_timer.active and self.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            request_timer.round_trips += 1
+        super().commit()
+    
+    def rollback(self) -> None:
+        if request_timer.active and self.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            request_timer.round_trips += 1
+        super().rollback()
+
+def metrics_response(event: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    action=metrics только для администратора: GET отдаёт метрики в формате
+    Prometheus, POST с "reset": true отдаёт их и обнуляет перед новым прогоном
+    '''
+    headers = event.get('headers') or {}
+    token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
+    if not token:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Требуется авторизация'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = None
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            token_hash = hash_token(token)
+        conn = db_pool.getconn()
+        with conn.cursor() as cur:
             cur.execute("""
-                SELECT s.user_id, u.email, u.full_name, u.role
+                SELECT u.role = 'admin'
                 FROM sessions s
-                JOIN users u ON s.user_id = u.id
+                JOIN users u ON u.id = s.user_id
                 WHERE s.token_hash = %s AND s.expires_at > NOW()
-            """, (token_hash,))
-            session = cur.fetchone()
-            if session:
-                return dict(session)
-            return None
+            """, (hashlib.sha256(token.encode()).hexdigest(),))
+            row = cur.fetchone()
+        conn.rollback()
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
     finally:
-        conn.close()
+        if conn is not None:
+            db_pool.putconn(conn)
+    
+    if not row:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Недействительный токен'}),
+            'isBase64Encoded': False
+        }
+    if not row[0]:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Недостаточно прав'}),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        options = json.loads(event.get('body') or '{}') if event.get('httpMethod') == 'POST' else {}
+    except ValueError:
+        options = None
+    if not isinstance(options, dict):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Неверное тело запроса'}),
+            'isBase64Encoded': False
+        }
+    
+    body = request_metrics.render()
+    if options.get('reset'):
+        request_metrics.reset()
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8', 'Access-Control-Allow-Origin': '*'},
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+def timed_handler(function: str) -> Any:
+    def wrap(handler: Any) -> Any:
+        request_metrics.function = function
+    
+        def timed(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if event.get('httpMethod') == 'OPTIONS':
+                return handler(event, context)
+            endpoint = request_endpoint(event)
+            if endpoint == 'POST metrics' or (endpoint == 'GET action' and event['queryStringParameters']['action'] == 'metrics'):
+                return metrics_response(event)
+            request_timer.start(function, endpoint)
+            return request_timer.finish(handler(event, context))
+        return timed
+    return wrap
+
+class ConnectionPool:
+    '''
+    Пул соединений с БД, переживающий вызовы в тёплом контейнере.
+    Проверяет простаивавшие соединения, откатывает незавершённые транзакции
+    и закрывает соединения старше max_lifetime секунд.
+    '''
+    def __init__(self, max_size: int, max_lifetime: float, check_after_idle: float):
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.check_after_idle = check_after_idle
+        self._cond = threading.Condition()
+        self._idle: List[Tuple[Any, float, float]] = []
+        self._created_at: Dict[int, float] = {}
+        self._size = 0
+        self.counters: Dict[str, float] = {
+            'acquired': 0,
+            'created': 0,
+            'reused': 0,
+            'discarded': 0,
+            'acquire_wait_seconds': 0.0,
+            'acquire_wait_max_seconds': 0.0
+        }
+    
+    def getconn(self) -> Any:
+        started = monotonic()
+        while True:
+            conn = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    self._cond.wait()
+                if self._idle:
+                    conn, created_at, released_at = self._idle.pop()
+                else:
+                    self._size += 1
+            
+            if conn is None:
+                try:
+                    conn = psycopg2.connect(
+                        os.environ['DATABASE_URL'],
+                        connection_factory=TimedConnection if REQUEST_TIMING_ENABLED else None
+                    )
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                self._created_at[id(conn)] = monotonic()
+                self.counters['created'] += 1
+                break
+            
+            if self._is_healthy(conn, created_at, released_at):
+                self.counters['reused'] += 1
+                break
+            self._discard(conn)
+        
+        waited = monotonic() - started
+        request_timer.add('connect', waited)
+        self.counters['acquired'] += 1
+        self.counters['acquire_wait_seconds'] += waited
+        if waited > self.counters['acquire_wait_max_seconds']:
+            self.counters['acquire_wait_max_seconds'] = waited
+        return conn
+    
+    def putconn(self, conn: Any) -> None:
+        created_at = self._created_at.get(id(conn), 0.0)
+        reusable = not conn.closed and monotonic() - created_at <= self.max_lifetime
+        if reusable and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                reusable = False
+            reusable = reusable and conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+        
+        if not reusable:
+            self._discard(conn)
+            return
+        
+        with self._cond:
+            self._idle.append((conn, created_at, monotonic()))
+            self._cond.notify()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self.counters, size=self._size, idle=len(self._idle), max_size=self.max_size)
+    
+    def _is_healthy(self, conn: Any, created_at: float, released_at: float) -> bool:
+        now = monotonic()
+        if conn.closed or now - created_at > self.max_lifetime:
+            return False
+        if now - released_at > self.check_after_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+    
+    def _discard(self, conn: Any) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._created_at.pop(id(conn), None)
+        self.counters['discarded'] += 1
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+db_pool = ConnectionPool(
+    max_size=int(os.environ.get('DB_POOL_MAX_SIZE', '4')),
+    max_lifetime=float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800')),
+    check_after_idle=float(os.environ.get('DB_POOL_CHECK_AFTER_IDLE', '30'))
+)
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class SessionCache:
+    '''
+    LRU-кэш проверенных сессий по hash_token(token) с коротким TTL.
+    Запись живёт не дольше TTL и не дольше самой сессии.
+    '''
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self.counters: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+    
+    def get(self, token_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry and entry[0] > monotonic():
+                self._entries.move_to_end(token_hash)
+                self.counters['hits'] += 1
+                return entry[1]
+            if entry:
+                del self._entries[token_hash]
+            self.counters['misses'] += 1
+            return None
+    
+    def put(self, token_hash: str, session: Dict[str, Any], expires_in: float) -> None:
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[token_hash] = (monotonic() + min(self.ttl, expires_in), session)
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+    
+    def invalidate(self, token_hash: str) -> None:
+        with self._lock:
+            if self._entries.pop(token_hash, None):
+                self.counters['invalidations'] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, size=len(self._entries), max_size=self.max_size)
+
+session_cache = SessionCache(
+    max_size=int(os.environ.get('SESSION_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('SESSION_CACHE_TTL', '60'))
+)
+
+SESSION_SIGNING_KEY = os.environ.get('SESSION_SIGNING_KEY', '')
+SIGNED_TOKEN_PREFIX = 'v1.'
+
+def b64url_encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+def b64url_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
 
+def read_signed_token(token: str) -> Optional[Dict[str, Any]]:
+    '''
+    Данные подписанного токена (uid, role, exp, jti), если подпись верна.
+    Срок действия и отзыв не проверяются.
+    '''
+    if not SESSION_SIGNING_KEY or not token.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        payload, signature = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+        expected = hmac.new(SESSION_SIGNING_KEY.encode(), payload.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, b64url_decode(signature)):
+            return None
+        return json.loads(b64url_decode(payload))
+    except ValueError:
+        return None
+
+class RevocationList:
+    '''
+    Отозванные токены (подписанные и завершённые выходом), перечитываемые
+    из revoked_tokens целиком не чаще раза в refresh_interval секунд. Читаются
+    только неистёкшие строки, поэтому набор мал; курсор по id не годится:
+    BIGSERIAL выдаётся до коммита, и отзыв, закоммиченный позже строки
+    с большим id, был бы пропущен навсегда
+    '''
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._expires: Dict[str, int] = {}
+        self._refreshed_at: Optional[float] = None
+    
+    def is_revoked(self, conn: Any, token_hash: str) -> bool:
+        self.refresh(conn)
+        return token_hash in self._expires
+    
+    def refresh(self, conn: Any) -> None:
+        if self._refreshed_at is not None and monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT token_hash, expires_epoch
+                FROM revoked_tokens
+                WHERE expires_epoch > EXTRACT(EPOCH FROM NOW())
+            """)
+            expires = dict(cur.fetchall())
+        
+        with self._lock:
+            self._expires = expires
+            self._refreshed_at = monotonic()
+
+revoked_tokens = RevocationList(
+    refresh_interval=float(os.environ.get('REVOCATION_REFRESH_SECONDS', '5'))
+)
+
+def verify_signed_token(conn: Any, token: str, token_hash: str) -> Optional[Dict[str, Any]]:
+    claims = read_signed_token(token)
+    if not claims or claims['exp'] <= datetime.now().timestamp():
+        return None
+    if revoked_tokens.is_revoked(conn, token_hash):
+        return None
+    return {'user_id': claims['uid'], 'role': claims['role']}
+
+def cached_session(conn: Any, token_hash: str) -> Optional[Dict[str, Any]]:
+    '''
+    Сессия из кэша, если токен не отозван. Выход в любом контейнере пишет
+    токен в revoked_tokens (непрозрачный - на время TTL кэша), так что кэш
+    остальных перестаёт его принимать не позже чем через
+    REVOCATION_REFRESH_SECONDS, а не через SESSION_CACHE_TTL
+    '''
+    session = session_cache.get(token_hash)
+    if session and revoked_tokens.is_revoked(conn, token_hash):
+        session_cache.invalidate(token_hash)
+        return None
+    return session
+
+class ProfileCache:
+    '''
+    LRU-кэш готовых JSON-ответов профиля по user_id. Запись действительна,
+    пока совпадает users.profile_version, который растёт при любом изменении
+    пользователя, его записей или абонементов.
+    '''
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[int, Tuple[int, str]]' = OrderedDict()
+        self.counters: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    def get(self, user_id: int) -> Optional[Tuple[int, str]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry:
+                self._entries.move_to_end(user_id)
+            return entry
+    
+    def put(self, user_id: int, version: int, profile: str) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (version, profile)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+    
+    def record(self, hit: bool) -> None:
+        self.counters['hits' if hit else 'misses'] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, size=len(self._entries), max_size=self.max_size)
+
+profile_cache = ProfileCache(max_size=int(os.environ.get('PROFILE_CACHE_SIZE', '512')))
+
+def session_source(conn: Any, token: str, token_hash: str) -> Tuple[str, Dict[str, Any]]:
+    '''
+    Подзапрос сессии (user_id, expires_in): из подписанного токена или кэша
+    без чтения sessions, либо из таблицы sessions для непрозрачных токенов
+    '''
+    session = verify_signed_token(conn, token, token_hash) or cached_session(conn, token_hash)
+    if session:
+        return (
+            "SELECT %(user_id)s::integer as user_id, NULL::float8 as expires_in",
+            {'user_id': session['user_id']}
+        )
+    return (
+        """
+        SELECT user_id, EXTRACT(EPOCH FROM expires_at - NOW())::float8 as expires_in
+        FROM sessions
+        WHERE token_hash = %(token_hash)s AND expires_at > NOW()
+        """,
+        {'token_hash': token_hash}
+    )
+
+def remember_session(token_hash: str, row: Dict[str, Any]) -> None:
+    if row['expires_in'] is not None:
+        session_cache.put(token_hash, {'user_id': row['user_id']}, row['expires_in'])
+
+@timed_handler('profile')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -57,88 +707,92 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    user_session = verify_token(token)
-    if not user_session:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Недействительный или истекший токен'}),
-            'isBase64Encoded': False
-        }
-    
-    user_id = user_session['user_id']
-    conn = get_db_connection()
+    conn = db_pool.getconn()
     
     try:
+        token_hash = hash_token(token)
+        session_sql, params = session_source(conn, token, token_hash)
+        cached = profile_cache.get(params['user_id']) if 'user_id' in params else None
+        params['cached_version'] = cached[0] if cached else None
+        params['build_profile'] = method == 'GET'
+        
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"""
+                SELECT s.user_id, s.expires_in, u.profile_version,
+                       CASE WHEN %(build_profile)s AND u.profile_version IS DISTINCT FROM %(cached_version)s
+                       THEN json_build_object(
+                           'user', json_build_object(
+                               'id', u.id,
+                               'email', u.email,
+                               'full_name', u.full_name,
+                               'phone', u.phone,
+                               'role', u.role,
+                               'created_at', u.created_at
+                           ),
+                           'subscriptions', COALESCE((
+                               SELECT json_agg(json_build_object(
+                                   'id', sub.id,
+                                   'subscription_type', sub.subscription_type,
+                                   'total_sessions', sub.total_sessions,
+                                   'used_sessions', sub.used_sessions,
+                                   'remaining_sessions', sub.total_sessions - sub.used_sessions,
+                                   'start_date', sub.start_date,
+                                   'end_date', sub.end_date,
+                                   'status', sub.status
+                               ) ORDER BY sub.created_at DESC)
+                               FROM subscriptions sub
+                               WHERE sub.user_id = u.id
+                           ), '[]'::json),
+                           'bookings', COALESCE((
+                               SELECT json_agg(json_build_object(
+                                   'id', b.id,
+                                   'status', b.status,
+                                   'booking_date', b.booking_date,
+                                   'slot_date', b.slot_date,
+                                   'slot_time', b.slot_time,
+                                   'duration_minutes', b.duration_minutes
+                               ) ORDER BY b.slot_date DESC, b.slot_time DESC)
+                               FROM (
+                                   SELECT b.id, b.status, b.booking_date,
+                                          ts.slot_date, ts.slot_time, ts.duration_minutes
+                                   FROM bookings b
+                                   JOIN training_slots ts ON b.slot_id = ts.id
+                                   WHERE b.user_id = u.id
+                                   AND b.status IN ('active', 'completed')
+                                   ORDER BY ts.slot_date DESC, ts.slot_time DESC
+                                   LIMIT 20
+                               ) b
+                           ), '[]'::json)
+                       )::text END as profile
+                FROM ({session_sql}) s
+                JOIN users u ON s.user_id = u.id
+            """, params)
+            row = cur.fetchone()
+        
+        if not row:
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Недействительный или истекший токен'}),
+                'isBase64Encoded': False
+            }
+        
+        remember_session(token_hash, row)
+        
         if method == 'GET':
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, email, full_name, phone, role, created_at
-                    FROM users
-                    WHERE id = %s
-                """, (user_id,))
-                user = dict(cur.fetchone())
-                
-                cur.execute("""
-                    SELECT 
-                        s.id,
-                        s.subscription_type,
-                        s.total_sessions,
-                        s.used_sessions,
-                        (s.total_sessions - s.used_sessions) as remaining_sessions,
-                        s.start_date,
-                        s.end_date,
-                        s.status
-                    FROM subscriptions s
-                    WHERE s.user_id = %s
-                    ORDER BY s.created_at DESC
-                """, (user_id,))
-                subscriptions = [dict(row) for row in cur.fetchall()]
-                
-                for sub in subscriptions:
-                    if sub['start_date']:
-                        sub['start_date'] = sub['start_date'].isoformat()
-                    if sub['end_date']:
-                        sub['end_date'] = sub['end_date'].isoformat()
-                
-                cur.execute("""
-                    SELECT 
-                        b.id,
-                        b.status,
-                        b.booking_date,
-                        ts.slot_date,
-                        ts.slot_time,
-                        ts.duration_minutes
-                    FROM bookings b
-                    JOIN training_slots ts ON b.slot_id = ts.id
-                    WHERE b.user_id = %s
-                    AND b.status IN ('active', 'completed')
-                    ORDER BY ts.slot_date DESC, ts.slot_time DESC
-                    LIMIT 20
-                """, (user_id,))
-                bookings = [dict(row) for row in cur.fetchall()]
-                
-                for booking in bookings:
-                    if booking['booking_date']:
-                        booking['booking_date'] = booking['booking_date'].isoformat()
-                    if booking['slot_date']:
-                        booking['slot_date'] = booking['slot_date'].isoformat()
-                    if booking['slot_time']:
-                        booking['slot_time'] = str(booking['slot_time'])
-                
-                if user.get('created_at'):
-                    user['created_at'] = user['created_at'].isoformat()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user': user,
-                        'subscriptions': subscriptions,
-                        'bookings': bookings
-                    }),
-                    'isBase64Encoded': False
-                }
+            profile_cache.record(row['profile'] is None)
+            if row['profile'] is None:
+                profile = cached[1]
+            else:
+                profile = row['profile']
+                profile_cache.put(row['user_id'], row['profile_version'], profile)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': profile,
+                'isBase64Encoded': False
+            }
         
         return {
             'statusCode': 405,
@@ -155,4 +809,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     finally:
-        conn.close()
+        db_pool.putconn(conn)
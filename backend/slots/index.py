@@ -1,35 +1,917 @@
 import json
 import os
+import threading
 import hashlib
+import hmac
+import base64
+import re
+import zlib
+import select
+from collections import OrderedDict
 from datetime import datetime, date, time, timedelta
-from typing import Dict, Any, Optional
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Dict, Any, Optional, List, Tuple
+from time import monotonic
+from json.encoder import encode_basestring_ascii
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import RealDictCursor
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+REQUEST_TIMING_ENABLED = os.environ.get('REQUEST_TIMING_ENABLED', '1') == '1'
+STATEMENT_NAMES_MAX = 512
+METRICS_MAX_SERIES = 256
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64)
+ACTION_FIELD = re.compile(r'"action"\s*:\s*"([A-Za-z_]{1,32})"')
+STATEMENT_TARGET = re.compile(r'(?<!EPOCH )(?<!DISTINCT )\b(?:FROM|INTO|UPDATE|JOIN|COPY|TABLE)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+statement_names: Dict[Any, str] = {}
 
-def hash_token(token: str) -> str:
-    return hashlib.sha256(token.encode()).hexdigest()
+def statement_name(query: Any) -> str:
+    '''
+    Стабильное имя SQL для Server-Timing и логов: первое слово, первая
+    таблица и crc32 текста запроса, например select-training_slots-3fa2
+    '''
+    name = statement_names.get(query)
+    if name is None:
+        text = query if isinstance(query, str) else str(query)
+        words = text.split(None, 1)
+        target = STATEMENT_TARGET.search(text)
+        name = '%s-%s-%04x' % (
+            words[0].lower() if words else 'sql',
+            target.group(1).lower() if target else 'none',
+            zlib.crc32(text.encode()) & 0xffff
+        )
+        if len(statement_names) >= STATEMENT_NAMES_MAX:
+            statement_names.clear()
+        statement_names[query] = name
+    return name
+
+def request_endpoint(event: Dict[str, Any]) -> str:
+    '''
+    Метка эндпоинта для метрик без разбора тела: метод плюс action из JSON
+    или, для GET, имена параметров запроса (кроме cursor и limit)
+    '''
+    method = event.get('httpMethod', 'GET')
+    if method == 'GET':
+        names = sorted(name for name in (event.get('queryStringParameters') or {}) if name not in ('cursor', 'limit'))
+        return 'GET ' + ','.join(names) if names else 'GET'
+    match = ACTION_FIELD.search(event.get('body') or '')
+    return method + ' ' + match.group(1) if match else method
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'total')
+    
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+    
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+def prometheus_labels(labels: Dict[str, Any]) -> str:
+    return ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+
+class RequestMetrics:
+    '''
+    Метрики тёплого контейнера с фиксированными корзинами: гистограммы времени
+    ответа и обращений к БД на эндпоинт и счётчик ответов по статусам.
+    render() отдаёт их в текстовом формате Prometheus
+    '''
+    def __init__(self):
+        self.function = ''
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self) -> None:
+        with self._lock:
+            self.latency: Dict[str, Histogram] = {}
+            self.round_trips: Dict[str, Histogram] = {}
+            self.responses: Dict[Tuple[str, int], int] = {}
+    
+    def observe(self, endpoint: str, status: int, seconds: float, round_trips: Optional[int]) -> None:
+        with self._lock:
+            latency = self.latency.get(endpoint)
+            if latency is None:
+                if len(self.latency) >= METRICS_MAX_SERIES:
+                    endpoint = 'other'
+                latency = self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS))
+            latency.observe(seconds)
+            if round_trips is not None:
+                histogram = self.round_trips.get(endpoint)
+                if histogram is None:
+                    histogram = self.round_trips[endpoint] = Histogram(ROUND_TRIP_BUCKETS)
+                histogram.observe(round_trips)
+            key = (endpoint, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+    
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for metric, help_text, series in (
+                ('http_request_duration_seconds', 'Время обработки запроса функцией', self.latency),
+                ('db_round_trips_per_request', 'Обращения к БД за запрос', self.round_trips)
+            ):
+                lines += ['# HELP %s %s' % (metric, help_text), '# TYPE %s histogram' % metric]
+                for endpoint, histogram in series.items():
+                    labels = prometheus_labels({'function': self.function, 'endpoint': endpoint})
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (metric, labels, bound, cumulative))
+                    lines.append('%s_sum{%s} %r' % (metric, labels, histogram.total))
+                    lines.append('%s_count{%s} %d' % (metric, labels, cumulative))
+            lines += ['# HELP http_responses_total Ответы по статусам', '# TYPE http_responses_total counter']
+            for (endpoint, status), count in self.responses.items():
+                labels = prometheus_labels({'function': self.function, 'endpoint': endpoint, 'status': status})
+                lines.append('http_responses_total{%s} %d' % (labels, count))
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+class TimerSpan:
+    __slots__ = ('timer', 'name', 'started')
+    
+    def __init__(self, timer: Any, name: str):
+        self.timer = timer
+        self.name = name
+    
+    def __enter__(self) -> None:
+        self.started = monotonic()
+    
+    def __exit__(self, *exc: Any) -> None:
+        self.timer.add(self.name, monotonic() - self.started)
+
+class RequestTimer(threading.local):
+    '''
+    Замеры текущего вызова: ожидание соединения, каждый SQL по имени,
+    кодирование JSON и общее время. finish() всегда записывает вызов
+    в request_metrics, а при REQUEST_TIMING_ENABLED ещё дописывает в ответ
+    заголовок Server-Timing и печатает в лог одну строку JSON. Без замеров
+    SQL обращения к БД не считаются и их гистограмма не пишется
+    '''
+    def __init__(self):
+        self.active = False
+    
+    def start(self, function: str, endpoint: str) -> None:
+        self.function = function
+        self.endpoint = endpoint
+        self.spans: Dict[str, float] = {}
+        self.statements: Dict[str, List[float]] = {}
+        self.round_trips = 0
+        self.active = True
+        self.started = monotonic()
+    
+    def add(self, name: str, seconds: float) -> None:
+        if self.active:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+    
+    def statement(self, name: str, seconds: float, calls: int = 1) -> None:
+        if self.active:
+            self.round_trips += 1
+            totals = self.statements.setdefault(name, [0, 0.0])
+            totals[0] += calls
+            totals[1] += seconds
+    
+    def span(self, name: str) -> Any:
+        return TimerSpan(self, name) if self.active else nullcontext()
+    
+    def finish(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.active:
+            return response
+        self.active = False
+        total = monotonic() - self.started
+        query_count = sum(calls for calls, _ in self.statements.values())
+        db_seconds = sum(seconds for _, seconds in self.statements.values())
+    
+        request_metrics.observe(self.endpoint, response.get('statusCode', 0), total,
+                                self.round_trips if REQUEST_TIMING_ENABLED else None)
+        if not REQUEST_TIMING_ENABLED:
+            return response
+    
+        metrics = [
+            'total;dur=%.2f' % (total * 1000),
+            'db;dur=%.2f;desc="%d queries, %d round trips"' % (db_seconds * 1000, query_count, self.round_trips)
+        ]
+        metrics += ['%s;dur=%.2f' % (name, seconds * 1000) for name, seconds in self.spans.items()]
+        metrics += ['%s;dur=%.2f;desc="x%d"' % (name, seconds * 1000, calls) for name, (calls, seconds) in self.statements.items()]
+        response['headers'] = dict(response.get('headers') or {}, **{
+            'Server-Timing': ', '.join(metrics),
+            'Timing-Allow-Origin': '*'
+        })
+    
+        print(json.dumps({
+            'function': self.function,
+            'endpoint': self.endpoint,
+            'status': response.get('statusCode'),
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(db_seconds * 1000, 2),
+            'query_count': query_count,
+            'round_trips': self.round_trips,
+            'spans_ms': {name: round(seconds * 1000, 2) for name, seconds in self.spans.items()},
+            'statements': {name: [calls, round(seconds * 1000, 2)] for name, (calls, seconds) in self.statements.items()}
+        }, separators=(',', ':')), flush=True)
+        return response
+
+request_timer = RequestTimer()
+
+class TimedCursorMixin:
+    timed_statement = 'sql'
+    
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = monotonic()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.timed_statement = statement_name(query)
+            request_timer.statement(self.timed_statement, monotonic() - started)
+    
+    def executemany(self, query: Any, vars_list: Any) -> Any:
+        started = monotonic()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self.timed_statement = statement_name(query)
+            request_timer.statement(self.timed_statement, monotonic() - started)
+    
+    def fetchmany(self, *args: Any) -> Any:
+        if self.name is None:
+            return super().fetchmany(*args)
+        started = monotonic()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            request_timer.statement(self.timed_statement, monotonic() - started, calls=0)
+    
+    def copy_expert(self, sql: str, file: Any, *args: Any) -> Any:
+        started = monotonic()
+        try:
+            return super().copy_expert(sql, file, *args)
+        finally:
+            request_timer.statement(statement_name(sql), monotonic() - started)
+
+timed_cursor_classes: Dict[Any, Any] = {}
+
+class TimedConnection(psycopg2.extensions.connection):
+    '''
+    Соединение, курсоры которого (любого cursor_factory) отчитываются
+    в request_timer. Пул открывает такие соединения, только когда замеры
+    включены (REQUEST_TIMING_ENABLED)
+    '''
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        if factory not in timed_cursor_classes:
+            timed_cursor_classes[factory] = type('Timed' + factory.__name__, (TimedCursorMixin, factory), {})
+        kwargs['cursor_factory'] = timed_cursor_classes[factory]
+        return super().cursor(*args, **kwargs)
+    
+    def commit(self) -> None:
+        if request_timer.active and self.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            request_timer.round_trips += 1
+        super().commit()
+    
+    def rollback(self) -> None:
+        if request_timer.active and self.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            request_timer.round_trips += 1
+        super().rollback()
 
-def verify_token(token: str) -> Optional[Dict[str, Any]]:
-    conn = get_db_connection()
+def metrics_response(event: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    action=metrics только для администратора: GET отдаёт метрики в формате
+    Prometheus, POST с "reset": true отдаёт их и обнуляет перед новым прогоном
+    '''
+    headers = event.get('headers') or {}
+    token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
+    if not token:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Требуется авторизация'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = None
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            token_hash = hash_token(token)
+        conn = db_pool.getconn()
+        with conn.cursor() as cur:
             cur.execute("""
-                SELECT s.user_id, u.email, u.full_name, u.role
+                SELECT u.role = 'admin'
                 FROM sessions s
-                JOIN users u ON s.user_id = u.id
+                JOIN users u ON u.id = s.user_id
                 WHERE s.token_hash = %s AND s.expires_at > NOW()
-            """, (token_hash,))
-            session = cur.fetchone()
-            if session:
-                return dict(session)
+            """, (hashlib.sha256(token.encode()).hexdigest(),))
+            row = cur.fetchone()
+        conn.rollback()
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        if conn is not None:
+            db_pool.putconn(conn)
+    
+    if not row:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Недействительный токен'}),
+            'isBase64Encoded': False
+        }
+    if not row[0]:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Недостаточно прав'}),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        options = json.loads(event.get('body') or '{}') if event.get('httpMethod') == 'POST' else {}
+    except ValueError:
+        options = None
+    if not isinstance(options, dict):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Неверное тело запроса'}),
+            'isBase64Encoded': False
+        }
+    
+    body = request_metrics.render()
+    if options.get('reset'):
+        request_metrics.reset()
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8', 'Access-Control-Allow-Origin': '*'},
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+def timed_handler(function: str) -> Any:
+    def wrap(handler: Any) -> Any:
+        request_metrics.function = function
+    
+        def timed(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if event.get('httpMethod') == 'OPTIONS':
+                return handler(event, context)
+            endpoint = request_endpoint(event)
+            if endpoint == 'POST metrics' or (endpoint == 'GET action' and event['queryStringParameters']['action'] == 'metrics'):
+                return metrics_response(event)
+            request_timer.start(function, endpoint)
+            return request_timer.finish(handler(event, context))
+        return timed
+    return wrap
+
+class ConnectionPool:
+    '''
+    Пул соединений с БД, переживающий вызовы в тёплом контейнере.
+    Проверяет простаивавшие соединения, откатывает незавершённые транзакции
+    и закрывает соединения старше max_lifetime секунд.
+    '''
+    def __init__(self, max_size: int, max_lifetime: float, check_after_idle: float):
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.check_after_idle = check_after_idle
+        self._cond = threading.Condition()
+        self._idle: List[Tuple[Any, float, float]] = []
+        self._created_at: Dict[int, float] = {}
+        self._size = 0
+        self.counters: Dict[str, float] = {
+            'acquired': 0,
+            'created': 0,
+            'reused': 0,
+            'discarded': 0,
+            'acquire_wait_seconds': 0.0,
+            'acquire_wait_max_seconds': 0.0
+        }
+    
+    def getconn(self) -> Any:
+        started = monotonic()
+        while True:
+            conn = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    self._cond.wait()
+                if self._idle:
+                    conn, created_at, released_at = self._idle.pop()
+                else:
+                    self._size += 1
+            
+            if conn is None:
+                try:
+                    conn = psycopg2.connect(
+                        os.environ['DATABASE_URL'],
+                        connection_factory=TimedConnection if REQUEST_TIMING_ENABLED else None
+                    )
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                self._created_at[id(conn)] = monotonic()
+                self.counters['created'] += 1
+                break
+            
+            if self._is_healthy(conn, created_at, released_at):
+                self.counters['reused'] += 1
+                break
+            self._discard(conn)
+        
+        waited = monotonic() - started
+        request_timer.add('connect', waited)
+        self.counters['acquired'] += 1
+        self.counters['acquire_wait_seconds'] += waited
+        if waited > self.counters['acquire_wait_max_seconds']:
+            self.counters['acquire_wait_max_seconds'] = waited
+        return conn
+    
+    def putconn(self, conn: Any) -> None:
+        created_at = self._created_at.get(id(conn), 0.0)
+        reusable = not conn.closed and monotonic() - created_at <= self.max_lifetime
+        if reusable and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                reusable = False
+            reusable = reusable and conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+        
+        if not reusable:
+            self._discard(conn)
+            return
+        
+        with self._cond:
+            self._idle.append((conn, created_at, monotonic()))
+            self._cond.notify()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self.counters, size=self._size, idle=len(self._idle), max_size=self.max_size)
+    
+    def _is_healthy(self, conn: Any, created_at: float, released_at: float) -> bool:
+        now = monotonic()
+        if conn.closed or now - created_at > self.max_lifetime:
+            return False
+        if now - released_at > self.check_after_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+    
+    def _discard(self, conn: Any) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._created_at.pop(id(conn), None)
+        self.counters['discarded'] += 1
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+db_pool = ConnectionPool(
+    max_size=int(os.environ.get('DB_POOL_MAX_SIZE', '4')),
+    max_lifetime=float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800')),
+    check_after_idle=float(os.environ.get('DB_POOL_CHECK_AFTER_IDLE', '30'))
+)
+
+BATCH_BOOKING_MAX_SLOTS = int(os.environ.get('BATCH_BOOKING_MAX_SLOTS', '62'))
+BATCH_BOOKING_MAX_DAYS = int(os.environ.get('BATCH_BOOKING_MAX_DAYS', '92'))
+SLOT_GENERATION_HORIZON_DAYS = int(os.environ.get('SLOT_GENERATION_HORIZON_DAYS', '90'))
+SLOT_GENERATION_MAX_DAYS = 366
+SLOTS_LONG_POLL_MAX_SECONDS = float(os.environ.get('SLOTS_LONG_POLL_MAX_SECONDS', '25'))
+SLOTS_MAX_RANGE_DAYS = int(os.environ.get('SLOTS_MAX_RANGE_DAYS', '92'))
+SLOTS_PAGE_MAX_ROWS = int(os.environ.get('SLOTS_PAGE_MAX_ROWS', '2000'))
+
+def json_temporal(value: Any) -> str:
+    return '"' + value.isoformat() + '"'
+
+def json_bool(value: Any) -> str:
+    return 'true' if value else 'false'
+
+JSON_ENCODERS_BY_OID = {
+    16: json_bool,
+    20: str,
+    21: str,
+    23: str,
+    25: encode_basestring_ascii,
+    1042: encode_basestring_ascii,
+    1043: encode_basestring_ascii,
+    1082: json_temporal,
+    1083: json_temporal,
+    1114: json_temporal,
+    1184: json_temporal
+}
+
+class RowEncoder:
+    '''
+    Кодирует строки кортежного курсора сразу в JSON-объекты без промежуточных
+    dict: шаблон с ключами и кодировщик каждой колонки выбираются один раз
+    по cursor.description
+    '''
+    def __init__(self, description: Any):
+        self.template = '{' + ','.join(
+            json.dumps(column.name).replace('%', '%%') + ':%s' for column in description
+        ) + '}'
+        self.encoders = [JSON_ENCODERS_BY_OID.get(column.type_code, json.dumps) for column in description]
+    
+    def encode(self, row: Tuple[Any, ...]) -> str:
+        return self.template % tuple(['null' if value is None else encode(value) for encode, value in zip(self.encoders, row)])
+    
+    def encode_rows(self, rows: Any) -> str:
+        with request_timer.span('encode'):
+            return '[' + ','.join([self.encode(row) for row in rows]) + ']'
+
+STREAM_FETCH_SIZE = int(os.environ.get('STREAM_FETCH_SIZE', '500'))
+
+def encode_page_cursor(position: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).rstrip(b'=').decode()
+
+def decode_page_cursor(value: str) -> List[Any]:
+    position = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+    if not isinstance(position, list):
+        raise ValueError('cursor')
+    return position
+
+def stream_rows(conn: Any, name: str, sql: str, params: Dict[str, Any], limit: int) -> Tuple[List[str], Optional[Dict[str, Any]]]:
+    '''
+    Читает результат серверным курсором порциями по STREAM_FETCH_SIZE строк
+    и сразу кодирует их в JSON. Отдаёт не больше limit строк; если результат
+    длиннее, вторым значением возвращает последнюю отданную строку как dict.
+    Неполная порция означает конец результата - лишний пустой FETCH не нужен
+    '''
+    encoded: List[str] = []
+    last_row = None
+    with conn.cursor(name=name) as cur:
+        cur.itersize = STREAM_FETCH_SIZE
+        cur.execute(sql, params)
+        encoder = None
+        while True:
+            batch = cur.fetchmany(STREAM_FETCH_SIZE)
+            if not batch:
+                return encoded, None
+            if encoder is None:
+                encoder = RowEncoder(cur.description)
+            with request_timer.span('encode'):
+                for row in batch:
+                    if len(encoded) == limit:
+                        return encoded, dict(zip([column.name for column in cur.description], last_row))
+                    encoded.append(encoder.encode(row))
+                    last_row = row
+            if len(batch) < STREAM_FETCH_SIZE:
+                return encoded, None
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class SessionCache:
+    '''
+    LRU-кэш проверенных сессий по hash_token(token) с коротким TTL.
+    Запись живёт не дольше TTL и не дольше самой сессии.
+    '''
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self.counters: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+    
+    def get(self, token_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry and entry[0] > monotonic():
+                self._entries.move_to_end(token_hash)
+                self.counters['hits'] += 1
+                return entry[1]
+            if entry:
+                del self._entries[token_hash]
+            self.counters['misses'] += 1
             return None
+    
+    def put(self, token_hash: str, session: Dict[str, Any], expires_in: float) -> None:
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[token_hash] = (monotonic() + min(self.ttl, expires_in), session)
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+    
+    def invalidate(self, token_hash: str) -> None:
+        with self._lock:
+            if self._entries.pop(token_hash, None):
+                self.counters['invalidations'] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, size=len(self._entries), max_size=self.max_size)
+
+session_cache = SessionCache(
+    max_size=int(os.environ.get('SESSION_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('SESSION_CACHE_TTL', '60'))
+)
+
+SESSION_SIGNING_KEY = os.environ.get('SESSION_SIGNING_KEY', '')
+SIGNED_TOKEN_PREFIX = 'v1.'
+
+def b64url_encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+def b64url_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def read_signed_token(token: str) -> Optional[Dict[str, Any]]:
+    '''
+    Данные подписанного токена (uid, role, exp, jti), если подпись верна.
+    Срок действия и отзыв не проверяются.
+    '''
+    if not SESSION_SIGNING_KEY or not token.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        payload, signature = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+        expected = hmac.new(SESSION_SIGNING_KEY.encode(), payload.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, b64url_decode(signature)):
+            return None
+        return json.loads(b64url_decode(payload))
+    except ValueError:
+        return None
+
+class RevocationList:
+    '''
+    Отозванные токены (подписанные и завершённые выходом), перечитываемые
+    из revoked_tokens целиком не чаще раза в refresh_interval секунд. Читаются
+    только неистёкшие строки, поэтому набор мал; курсор по id не годится:
+    BIGSERIAL выдаётся до коммита, и отзыв, закоммиченный позже строки
+    с большим id, был бы пропущен навсегда
+    '''
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._expires: Dict[str, int] = {}
+        self._refreshed_at: Optional[float] = None
+    
+    def is_revoked(self, conn: Any, token_hash: str) -> bool:
+        self.refresh(conn)
+        return token_hash in self._expires
+    
+    def refresh(self, conn: Any) -> None:
+        if self._refreshed_at is not None and monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT token_hash, expires_epoch
+                FROM revoked_tokens
+                WHERE expires_epoch > EXTRACT(EPOCH FROM NOW())
+            """)
+            expires = dict(cur.fetchall())
+        
+        with self._lock:
+            self._expires = expires
+            self._refreshed_at = monotonic()
+
+revoked_tokens = RevocationList(
+    refresh_interval=float(os.environ.get('REVOCATION_REFRESH_SECONDS', '5'))
+)
+
+def verify_signed_token(conn: Any, token: str, token_hash: str) -> Optional[Dict[str, Any]]:
+    claims = read_signed_token(token)
+    if not claims or claims['exp'] <= datetime.now().timestamp():
+        return None
+    if revoked_tokens.is_revoked(conn, token_hash):
+        return None
+    return {'user_id': claims['uid'], 'role': claims['role']}
+
+def cached_session(conn: Any, token_hash: str) -> Optional[Dict[str, Any]]:
+    '''
+    Сессия из кэша, если токен не отозван. Выход в любом контейнере пишет
+    токен в revoked_tokens (непрозрачный - на время TTL кэша), так что кэш
+    остальных перестаёт его принимать не позже чем через
+    REVOCATION_REFRESH_SECONDS, а не через SESSION_CACHE_TTL
+    '''
+    session = session_cache.get(token_hash)
+    if session and revoked_tokens.is_revoked(conn, token_hash):
+        session_cache.invalidate(token_hash)
+        return None
+    return session
+
+def session_source(conn: Any, token: str, token_hash: str) -> Tuple[str, Dict[str, Any]]:
+    '''
+    Подзапрос сессии (user_id, expires_in): из подписанного токена или кэша
+    без чтения sessions, либо из таблицы sessions для непрозрачных токенов
+    '''
+    session = verify_signed_token(conn, token, token_hash) or cached_session(conn, token_hash)
+    if session:
+        return (
+            "SELECT %(user_id)s::integer as user_id, NULL::float8 as expires_in",
+            {'user_id': session['user_id']}
+        )
+    return (
+        """
+        SELECT user_id, EXTRACT(EPOCH FROM expires_at - NOW())::float8 as expires_in
+        FROM sessions
+        WHERE token_hash = %(token_hash)s AND expires_at > NOW()
+        """,
+        {'token_hash': token_hash}
+    )
+
+def remember_session(token_hash: str, row: Dict[str, Any]) -> None:
+    if row['expires_in'] is not None:
+        session_cache.put(token_hash, {'user_id': row['user_id']}, row['expires_in'])
+
+def load_slot_changes(conn: Any, since: int) -> Tuple[int, Optional[str]]:
+    '''
+    Версия календаря и JSON-ответ со слотами, изменёнными после версии since,
+    по журналу slot_changes (None, если изменений нет). Если журнал уже не
+    покрывает since, ответ содержит resync: true.
+    '''
+    with conn.cursor() as cur:
+        cur.execute("SELECT version, log_floor FROM slot_calendar_version")
+        version, log_floor = cur.fetchone()
+        
+        if since < log_floor or since > version:
+            return version, json.dumps({'version': version, 'resync': True})
+        if since == version:
+            return version, None
+        
+        cur.execute("""
+            SELECT 
+                c.slot_id,
+                ts.id,
+                ts.slot_date,
+                ts.slot_time,
+                ts.duration_minutes,
+                ts.status,
+                ts.block_reason,
+                b.id as booking_id,
+                u.full_name as booked_by
+            FROM (
+                SELECT DISTINCT slot_id
+                FROM slot_changes
+                WHERE version > %s AND version <= %s
+            ) c
+            LEFT JOIN training_slots ts ON ts.id = c.slot_id
+            LEFT JOIN bookings b ON ts.id = b.slot_id AND b.status = 'active'
+            LEFT JOIN users u ON b.user_id = u.id
+            ORDER BY ts.slot_date, ts.slot_time
+        """, (since, version))
+        
+        encoder = RowEncoder(cur.description[1:])
+        slots = []
+        deleted = []
+        for row in cur:
+            if row[1] is None:
+                deleted.append(row[0])
+            else:
+                slots.append(encoder.encode(row[1:]))
+        
+        if not slots and not deleted:
+            return version, None
+        return version, '{"version":%d,"slots":[%s],"deleted":%s}' % (version, ','.join(slots), json.dumps(deleted))
+
+def wait_for_slot_changes(conn: Any, version: int, timeout: float) -> bool:
+    '''
+    Ждёт NOTIFY slot_changes не дольше timeout секунд.
+    True, если версия календаря ушла дальше version. Уведомление может
+    прийти вместе с ответом на запрос и уже лежать в conn.notifies при пустом
+    сокете, поэтому они проверяются перед каждым select
+    '''
+    conn.rollback()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("LISTEN slot_changes")
+            cur.execute("SELECT version FROM slot_calendar_version")
+            if cur.fetchone()[0] != version:
+                return True
+        
+        deadline = monotonic() + timeout
+        while True:
+            conn.poll()
+            if conn.notifies:
+                return True
+            remaining = deadline - monotonic()
+            if remaining <= 0 or select.select([conn], [], [], remaining) == ([], [], []):
+                return False
     finally:
-        conn.close()
+        with conn.cursor() as cur:
+            cur.execute("UNLISTEN *")
+        conn.notifies.clear()
+        conn.autocommit = False
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_CLEANUP_EVERY = 100
+IDEMPOTENCY_CLEANUP_BATCH = 500
+idempotency_stats: Dict[str, int] = {'stored': 0, 'replayed': 0}
+
+def idempotency_replay(stored: Tuple[Any, ...], request_hash: str) -> Dict[str, Any]:
+    stored_hash, status_code, body = stored
+    if stored_hash != request_hash:
+        status_code, body = 422, json.dumps({'error': 'Idempotency-Key уже использован с другим запросом'})
+    elif status_code is None:
+        status_code, body = 409, json.dumps({'error': 'Запрос с этим Idempotency-Key ещё выполняется'})
+    else:
+        idempotency_stats['replayed'] += 1
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Idempotent-Replayed': 'true'
+        },
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+def run_idempotent(conn: Any, event: Dict[str, Any], scope: str, process: Any) -> Dict[str, Any]:
+    '''
+    Выполняет POST/PUT с заголовком Idempotency-Key не больше одного раза.
+    Ключ занимается строкой idempotency_keys в транзакции самой записи, ответ
+    сохраняется сразу после неё; повтор получает сохранённый ответ одним
+    поиском по первичному ключу, параллельный дубль - 409
+    '''
+    headers = event.get('headers', {}) or {}
+    key = headers.get('Idempotency-Key') or headers.get('idempotency-key')
+    if not key or event.get('httpMethod') not in ('POST', 'PUT'):
+        return process(conn, event)
+    if len(key) > 255:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Слишком длинный Idempotency-Key'}),
+            'isBase64Encoded': False
+        }
+    
+    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+    if token:
+        scope = f'{scope}:{hashlib.sha256(token.encode()).hexdigest()}'
+    request_hash = hashlib.sha256(f"{event.get('httpMethod')} {event.get('body') or ''}".encode()).hexdigest()
+    
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT request_hash, status_code, body
+            FROM idempotency_keys
+            WHERE scope = %s AND idempotency_key = %s AND expires_at > NOW()
+        """, (scope, key))
+        stored = cur.fetchone()
+        if stored is None:
+            cur.execute("""
+                INSERT INTO idempotency_keys (scope, idempotency_key, request_hash, expires_at)
+                VALUES (%s, %s, %s, NOW() + %s * INTERVAL '1 second')
+                ON CONFLICT (scope, idempotency_key) DO UPDATE
+                SET request_hash = EXCLUDED.request_hash, status_code = NULL, body = NULL,
+                    created_at = NOW(), expires_at = EXCLUDED.expires_at
+                WHERE idempotency_keys.expires_at <= NOW()
+                RETURNING 1
+            """, (scope, key, request_hash, IDEMPOTENCY_TTL_SECONDS))
+            if cur.fetchone() is None:
+                conn.rollback()
+                cur.execute("""
+                    SELECT request_hash, status_code, body
+                    FROM idempotency_keys
+                    WHERE scope = %s AND idempotency_key = %s
+                """, (scope, key))
+                stored = cur.fetchone()
+    if stored is not None:
+        conn.rollback()
+        return idempotency_replay(stored, request_hash)
+    
+    response = process(conn, event)
+    if response['statusCode'] >= 500:
+        conn.rollback()
+        return response
+    
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO idempotency_keys (scope, idempotency_key, request_hash, status_code, body, expires_at)
+            VALUES (%s, %s, %s, %s, %s, NOW() + %s * INTERVAL '1 second')
+            ON CONFLICT (scope, idempotency_key) DO UPDATE
+            SET request_hash = EXCLUDED.request_hash, status_code = EXCLUDED.status_code, body = EXCLUDED.body
+        """, (scope, key, request_hash, response['statusCode'], response['body'], IDEMPOTENCY_TTL_SECONDS))
+        idempotency_stats['stored'] += 1
+        if idempotency_stats['stored'] % IDEMPOTENCY_CLEANUP_EVERY == 0:
+            cur.execute("""
+                DELETE FROM idempotency_keys
+                WHERE ctid IN (
+                    SELECT ctid FROM idempotency_keys
+                    WHERE expires_at <= NOW()
+                    LIMIT %s
+                )
+            """, (IDEMPOTENCY_CLEANUP_BATCH,))
+    conn.commit()
+    return response
 
+@timed_handler('slots')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -39,14 +921,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, If-None-Match, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
+    conn = db_pool.getconn()
+    try:
+        return run_idempotent(conn, event, 'slots:' + method, route_request)
+    finally:
+        db_pool.putconn(conn)
+
+def route_request(conn: Any, event: Dict[str, Any]) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
     
     try:
         body = json.loads(event.get('body', '{}')) if event.get('body') else {}
@@ -56,46 +945,122 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             params = event.get('queryStringParameters', {}) or {}
             start_date = params.get('start_date', str(date.today()))
             end_date = params.get('end_date', str(date.today() + timedelta(days=7)))
+            headers = event.get('headers', {}) or {}
+            if_none_match = headers.get('If-None-Match') or headers.get('if-none-match')
             
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT 
-                        ts.id,
-                        ts.slot_date,
-                        ts.slot_time,
-                        ts.duration_minutes,
-                        ts.status,
-                        ts.block_reason,
-                        CASE 
-                            WHEN b.id IS NOT NULL THEN b.id
-                            ELSE NULL
-                        END as booking_id,
-                        CASE 
-                            WHEN b.id IS NOT NULL THEN u.full_name
-                            ELSE NULL
-                        END as booked_by
-                    FROM training_slots ts
-                    LEFT JOIN bookings b ON ts.id = b.slot_id AND b.status = 'active'
-                    LEFT JOIN users u ON b.user_id = u.id
-                    WHERE ts.slot_date >= %s AND ts.slot_date <= %s
-                    ORDER BY ts.slot_date, ts.slot_time
-                """, (start_date, end_date))
+            if params.get('since') is not None:
+                try:
+                    since = int(params['since'])
+                    wait = min(float(params.get('wait', 0)), SLOTS_LONG_POLL_MAX_SECONDS)
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Неверный параметр since'}),
+                        'isBase64Encoded': False
+                    }
                 
-                slots = []
-                for row in cur.fetchall():
-                    slot = dict(row)
-                    if slot['slot_date']:
-                        slot['slot_date'] = slot['slot_date'].isoformat()
-                    if slot['slot_time']:
-                        slot['slot_time'] = str(slot['slot_time'])
-                    slots.append(slot)
+                version, changes = load_slot_changes(conn, since)
+                if changes is None and wait > 0 and wait_for_slot_changes(conn, version, wait):
+                    version, changes = load_slot_changes(conn, since)
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'slots': slots}),
+                    'body': changes or '{"version":%d,"slots":[],"deleted":[]}' % version,
+                    'isBase64Encoded': False
+                }
+            
+            page_cursor = params.get('cursor')
+            try:
+                range_start = date.fromisoformat(start_date)
+                range_end = date.fromisoformat(end_date)
+                if page_cursor:
+                    position = decode_page_cursor(page_cursor)
+                    after = (date.fromisoformat(position[0]), time.fromisoformat(position[1]), int(position[2]))
+                else:
+                    after = None
+                window_start = after[0] if after else range_start
+            except (ValueError, TypeError, IndexError):
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Неверный диапазон дат или cursor'}),
                     'isBase64Encoded': False
                 }
+            window_end = min(range_end, window_start + timedelta(days=SLOTS_MAX_RANGE_DAYS - 1))
+            
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM slot_calendar_version")
+                version = cur.fetchone()[0]
+                page_key = f'{start_date}-{end_date}-{page_cursor}' if page_cursor else f'{start_date}-{end_date}'
+                etag = f'"{version}-{page_key}"'
+                
+                if if_none_match == etag:
+                    return {
+                        'statusCode': 304,
+                        'headers': {
+                            'ETag': etag,
+                            'Cache-Control': 'no-cache',
+                            'Access-Control-Allow-Origin': '*',
+                            'Access-Control-Expose-Headers': 'ETag'
+                        },
+                        'body': '',
+                        'isBase64Encoded': False
+                    }
+            
+            keyset = "AND (ts.slot_date, ts.slot_time, ts.id) > (%(after_date)s::date, %(after_time)s::time, %(after_id)s::integer)" if after else ""
+            slots, last_row = stream_rows(conn, 'slot_calendar', f"""
+                SELECT 
+                    ts.id,
+                    ts.slot_date,
+                    ts.slot_time,
+                    ts.duration_minutes,
+                    ts.status,
+                    ts.block_reason,
+                    CASE 
+                        WHEN b.id IS NOT NULL THEN b.id
+                        ELSE NULL
+                    END as booking_id,
+                    CASE 
+                        WHEN b.id IS NOT NULL THEN u.full_name
+                        ELSE NULL
+                    END as booked_by
+                FROM training_slots ts
+                LEFT JOIN bookings b ON ts.id = b.slot_id AND b.status = 'active'
+                LEFT JOIN users u ON b.user_id = u.id
+                WHERE ts.slot_date >= %(window_start)s AND ts.slot_date <= %(window_end)s
+                {keyset}
+                ORDER BY ts.slot_date, ts.slot_time, ts.id
+                LIMIT %(limit)s + 1
+            """, {
+                'window_start': window_start,
+                'window_end': window_end,
+                'after_date': after and after[0],
+                'after_time': after and after[1],
+                'after_id': after and after[2],
+                'limit': SLOTS_PAGE_MAX_ROWS
+            }, SLOTS_PAGE_MAX_ROWS)
+            
+            if last_row:
+                next_cursor = encode_page_cursor([last_row['slot_date'].isoformat(), last_row['slot_time'].isoformat(), last_row['id']])
+            elif window_end < range_end:
+                next_cursor = encode_page_cursor([(window_end + timedelta(days=1)).isoformat(), '00:00:00', 0])
+            else:
+                next_cursor = None
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'ETag': etag,
+                    'Cache-Control': 'no-cache',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'ETag'
+                },
+                'body': '{"slots":[%s],"version":%d,"next_cursor":%s}' % (','.join(slots), version, json.dumps(next_cursor)),
+                'isBase64Encoded': False
+            }
         
         elif method == 'POST' and action == 'book':
             headers = event.get('headers', {})
@@ -109,73 +1074,78 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            user_session = verify_token(token)
-            if not user_session:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Недействительный токен'}),
-                    'isBase64Encoded': False
-                }
-            
-            user_id = user_session['user_id']
             slot_id = body.get('slot_id')
             
+            token_hash = hash_token(token)
+            session_sql, params = session_source(conn, token, token_hash)
+            params['slot_id'] = slot_id
+            
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, status FROM training_slots
-                    WHERE id = %s AND status = 'available'
-                """, (slot_id,))
+                cur.execute(f"""
+                    WITH s AS ({session_sql}),
+                    sub AS (
+                        SELECT id
+                        FROM subscriptions
+                        WHERE user_id = (SELECT user_id FROM s)
+                        AND status = 'active'
+                        AND end_date >= CURRENT_DATE
+                        AND used_sessions < total_sessions
+                        ORDER BY end_date ASC
+                        LIMIT 1
+                        FOR UPDATE
+                    ),
+                    claimed AS (
+                        UPDATE training_slots
+                        SET status = 'booked'
+                        WHERE id = %(slot_id)s
+                        AND status = 'available'
+                        AND EXISTS (SELECT 1 FROM sub)
+                        RETURNING id
+                    ),
+                    debited AS (
+                        UPDATE subscriptions
+                        SET used_sessions = used_sessions + 1
+                        WHERE id = (SELECT id FROM sub)
+                        AND EXISTS (SELECT 1 FROM claimed)
+                        RETURNING id
+                    ),
+                    booked AS (
+                        INSERT INTO bookings (user_id, slot_id, subscription_id, status)
+                        SELECT s.user_id, claimed.id, debited.id, 'active'
+                        FROM s, claimed, debited
+                        RETURNING id
+                    )
+                    SELECT s.user_id, s.expires_in,
+                           (SELECT status FROM training_slots WHERE id = %(slot_id)s) as slot_status,
+                           (SELECT id FROM sub) as subscription_id,
+                           (SELECT id FROM booked) as booking_id
+                    FROM s
+                """, params)
                 
-                slot = cur.fetchone()
-                if not slot:
+                result = cur.fetchone()
+                if not result:
                     return {
-                        'statusCode': 400,
+                        'statusCode': 401,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Слот недоступен для записи'}),
+                        'body': json.dumps({'error': 'Недействительный токен'}),
                         'isBase64Encoded': False
                     }
+                remember_session(token_hash, result)
                 
-                cur.execute("""
-                    SELECT id, total_sessions, used_sessions
-                    FROM subscriptions
-                    WHERE user_id = %s 
-                    AND status = 'active'
-                    AND end_date >= CURRENT_DATE
-                    AND used_sessions < total_sessions
-                    ORDER BY end_date ASC
-                    LIMIT 1
-                """, (user_id,))
-                
-                subscription = cur.fetchone()
-                if not subscription:
+                if not result['booking_id']:
+                    conn.rollback()
+                    if result['slot_status'] == 'available' and not result['subscription_id']:
+                        error = 'У вас нет активного абонемента с доступными занятиями'
+                    else:
+                        error = 'Слот недоступен для записи'
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'У вас нет активного абонемента с доступными занятиями'}),
+                        'body': json.dumps({'error': error}),
                         'isBase64Encoded': False
                     }
                 
-                cur.execute("""
-                    INSERT INTO bookings (user_id, slot_id, subscription_id, status)
-                    VALUES (%s, %s, %s, 'active')
-                    RETURNING id
-                """, (user_id, slot_id, subscription['id']))
-                
-                booking_id = cur.fetchone()['id']
-                
-                cur.execute("""
-                    UPDATE training_slots
-                    SET status = 'booked'
-                    WHERE id = %s
-                """, (slot_id,))
-                
-                cur.execute("""
-                    UPDATE subscriptions
-                    SET used_sessions = used_sessions + 1
-                    WHERE id = %s
-                """, (subscription['id'],))
-                
+                booking_id = result['booking_id']
                 conn.commit()
                 
                 return {
@@ -188,7 +1158,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
         
-        elif method == 'PUT' and action == 'cancel':
+        elif method == 'POST' and action == 'book_batch':
             headers = event.get('headers', {})
             token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
             
@@ -200,28 +1170,327 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            user_session = verify_token(token)
-            if not user_session:
+            mode = body.get('mode', 'all_or_nothing')
+            recurrence = body.get('recurrence') or {}
+            
+            try:
+                slot_ids = sorted({int(slot_id) for slot_id in body.get('slot_ids') or []})
+                if recurrence:
+                    rule_start = date.fromisoformat(recurrence['start_date'])
+                    rule_end = date.fromisoformat(recurrence['end_date'])
+                    rule_weekdays = [int(day) for day in recurrence['weekdays']]
+                    rule_time = time.fromisoformat(recurrence['time'])
+                else:
+                    rule_start = rule_end = rule_weekdays = rule_time = None
+            except (TypeError, ValueError, KeyError):
+                rule_start = None
+                mode = None
+            
+            if (
+                mode not in ('all_or_nothing', 'best_effort')
+                or not (slot_ids or rule_start)
+                or len(slot_ids) > BATCH_BOOKING_MAX_SLOTS
+                or (rule_start and not 0 <= (rule_end - rule_start).days <= BATCH_BOOKING_MAX_DAYS)
+            ):
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Неверные параметры пакетной записи'}),
+                    'isBase64Encoded': False
+                }
+            
+            token_hash = hash_token(token)
+            session_sql, params = session_source(conn, token, token_hash)
+            params.update({
+                'slot_ids': slot_ids,
+                'rule_start': rule_start,
+                'rule_end': rule_end,
+                'rule_weekdays': rule_weekdays,
+                'rule_time': rule_time,
+                'max_slots': BATCH_BOOKING_MAX_SLOTS
+            })
+            
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(f"""
+                    WITH s AS ({session_sql}),
+                    sub AS (
+                        SELECT id, total_sessions - used_sessions as remaining
+                        FROM subscriptions
+                        WHERE user_id = (SELECT user_id FROM s)
+                        AND status = 'active'
+                        AND end_date >= CURRENT_DATE
+                        AND used_sessions < total_sessions
+                        ORDER BY end_date ASC
+                        LIMIT 1
+                        FOR UPDATE
+                    ),
+                    requested AS (
+                        SELECT unnest(%(slot_ids)s::integer[]) as id
+                        UNION
+                        (
+                            SELECT id
+                            FROM training_slots
+                            WHERE slot_date BETWEEN %(rule_start)s AND %(rule_end)s
+                            AND EXTRACT(DOW FROM slot_date)::integer = ANY(%(rule_weekdays)s::integer[])
+                            AND slot_time = %(rule_time)s
+                            ORDER BY slot_date
+                            LIMIT %(max_slots)s
+                        )
+                    ),
+                    claimed AS (
+                        UPDATE training_slots
+                        SET status = 'booked'
+                        WHERE status = 'available'
+                        AND id IN (
+                            SELECT ts.id
+                            FROM training_slots ts
+                            JOIN requested r ON r.id = ts.id
+                            WHERE ts.status = 'available'
+                            ORDER BY ts.slot_date, ts.slot_time
+                            LIMIT COALESCE((SELECT remaining FROM sub), 0)
+                            FOR UPDATE
+                        )
+                        RETURNING id
+                    ),
+                    debited AS (
+                        UPDATE subscriptions
+                        SET used_sessions = used_sessions + (SELECT COUNT(*) FROM claimed)
+                        WHERE id = (SELECT id FROM sub)
+                        AND EXISTS (SELECT 1 FROM claimed)
+                        RETURNING id
+                    ),
+                    booked AS (
+                        INSERT INTO bookings (user_id, slot_id, subscription_id, status)
+                        SELECT s.user_id, claimed.id, debited.id, 'active'
+                        FROM s, claimed, debited
+                        RETURNING id, slot_id
+                    )
+                    SELECT s.user_id, s.expires_in,
+                           (SELECT id FROM sub) as subscription_id,
+                           (SELECT remaining FROM sub) as remaining,
+                           r.id as slot_id,
+                           ts.slot_date,
+                           ts.status as slot_status,
+                           b.id as booking_id
+                    FROM s
+                    LEFT JOIN requested r ON true
+                    LEFT JOIN training_slots ts ON ts.id = r.id
+                    LEFT JOIN booked b ON b.slot_id = r.id
+                    ORDER BY ts.slot_date, ts.slot_time, r.id
+                """, params)
+                
+                rows = cur.fetchall()
+                if not rows:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Недействительный токен'}),
+                        'isBase64Encoded': False
+                    }
+                remember_session(token_hash, rows[0])
+                
+                booked_count = sum(1 for row in rows if row['booking_id'])
+                requested_count = sum(1 for row in rows if row['slot_id'])
+                complete = requested_count > 0 and booked_count == requested_count
+                keep = booked_count > 0 and (complete or mode == 'best_effort')
+                
+                results = []
+                for row in rows:
+                    if not row['slot_id']:
+                        continue
+                    if row['booking_id']:
+                        result = {'slot_id': row['slot_id'], 'status': 'booked' if keep else 'rolled_back'}
+                        if keep:
+                            result['booking_id'] = row['booking_id']
+                    elif not row['slot_status']:
+                        result = {'slot_id': row['slot_id'], 'status': 'not_found'}
+                    elif row['slot_status'] != 'available':
+                        result = {'slot_id': row['slot_id'], 'status': 'unavailable'}
+                    elif not row['subscription_id']:
+                        result = {'slot_id': row['slot_id'], 'status': 'no_subscription'}
+                    elif booked_count >= row['remaining']:
+                        result = {'slot_id': row['slot_id'], 'status': 'no_sessions'}
+                    else:
+                        result = {'slot_id': row['slot_id'], 'status': 'unavailable'}
+                    results.append(result)
+                
+                if keep:
+                    conn.commit()
+                else:
+                    conn.rollback()
+                
+                response = {'mode': mode, 'booked': booked_count if keep else 0, 'results': results}
+                if not keep:
+                    response['error'] = 'Не удалось записаться на выбранные слоты'
+                
+                return {
+                    'statusCode': 201 if keep else 409,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps(response),
+                    'isBase64Encoded': False
+                }
+        
+        elif method == 'POST' and action == 'generate_slots':
+            headers = event.get('headers', {})
+            token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
+            
+            if not token:
                 return {
                     'statusCode': 401,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Недействительный токен'}),
+                    'body': json.dumps({'error': 'Требуется авторизация'}),
+                    'isBase64Encoded': False
+                }
+            
+            try:
+                start_date = date.fromisoformat(body['start_date']) if body.get('start_date') else date.today()
+                days = int(body.get('days', SLOT_GENERATION_HORIZON_DAYS))
+            except (TypeError, ValueError):
+                days = 0
+            
+            if not 0 < days <= SLOT_GENERATION_MAX_DAYS:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Неверный горизонт генерации'}),
+                    'isBase64Encoded': False
+                }
+            
+            token_hash = hash_token(token)
+            session_sql, params = session_source(conn, token, token_hash)
+            params.update({'start_date': start_date, 'end_date': start_date + timedelta(days=days - 1)})
+            
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(f"""
+                    WITH s AS ({session_sql}),
+                    admin AS (
+                        SELECT 1
+                        FROM s
+                        JOIN users u ON u.id = s.user_id
+                        WHERE u.role = 'admin'
+                    ),
+                    created AS (
+                        INSERT INTO training_slots (slot_date, slot_time, duration_minutes, status)
+                        SELECT slot_start::date, slot_start::time, t.slot_duration_minutes, 'available'
+                        FROM (
+                            SELECT generate_series(%(start_date)s::date, %(end_date)s::date, INTERVAL '1 day')::date AS day
+                        ) AS d
+                        JOIN schedule_templates t
+                            ON t.is_active
+                            AND t.slot_duration_minutes > 0
+                            AND t.day_of_week = EXTRACT(DOW FROM d.day)::integer
+                        CROSS JOIN LATERAL generate_series(
+                            d.day + t.start_time,
+                            d.day + t.end_time - make_interval(mins => t.slot_duration_minutes),
+                            make_interval(mins => t.slot_duration_minutes)
+                        ) AS slot_start
+                        WHERE EXISTS (SELECT 1 FROM admin)
+                        AND NOT EXISTS (
+                            SELECT 1 FROM blocked_slots bs
+                            WHERE bs.block_date = slot_start::date
+                            AND bs.block_time = slot_start::time
+                        )
+                        ON CONFLICT (slot_date, slot_time) DO NOTHING
+                        RETURNING 1
+                    )
+                    SELECT s.user_id, s.expires_in,
+                           EXISTS (SELECT 1 FROM admin) as is_admin,
+                           (SELECT COUNT(*) FROM created) as created
+                    FROM s
+                """, params)
+                
+                result = cur.fetchone()
+                if not result:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Недействительный токен'}),
+                        'isBase64Encoded': False
+                    }
+                remember_session(token_hash, result)
+                
+                if not result['is_admin']:
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Недостаточно прав'}),
+                        'isBase64Encoded': False
+                    }
+                
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'created': result['created'],
+                        'start_date': params['start_date'].isoformat(),
+                        'end_date': params['end_date'].isoformat()
+                    }),
+                    'isBase64Encoded': False
+                }
+        
+        elif method == 'PUT' and action == 'cancel':
+            headers = event.get('headers', {})
+            token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
+            
+            if not token:
+                return {
+                    'statusCode': 401,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Требуется авторизация'}),
                     'isBase64Encoded': False
                 }
             
-            user_id = user_session['user_id']
             booking_id = body.get('booking_id')
             cancel_reason = body.get('reason', 'Отменено клиентом')
             
+            token_hash = hash_token(token)
+            session_sql, params = session_source(conn, token, token_hash)
+            params['booking_id'] = booking_id
+            params['reason'] = cancel_reason
+            
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT b.id, b.slot_id, b.subscription_id
-                    FROM bookings b
-                    WHERE b.id = %s AND b.user_id = %s AND b.status = 'active'
-                """, (booking_id, user_id))
+                cur.execute(f"""
+                    WITH s AS ({session_sql}),
+                    canceled AS (
+                        UPDATE bookings b
+                        SET status = 'canceled',
+                            cancel_date = CURRENT_TIMESTAMP,
+                            cancel_reason = %(reason)s
+                        FROM s
+                        WHERE b.id = %(booking_id)s
+                        AND b.user_id = s.user_id
+                        AND b.status = 'active'
+                        RETURNING b.id, b.slot_id, b.subscription_id
+                    ),
+                    freed AS (
+                        UPDATE training_slots
+                        SET status = 'available'
+                        WHERE id IN (SELECT slot_id FROM canceled)
+                        RETURNING id
+                    ),
+                    credited AS (
+                        UPDATE subscriptions
+                        SET used_sessions = used_sessions - 1
+                        WHERE id IN (SELECT subscription_id FROM canceled)
+                        RETURNING id
+                    )
+                    SELECT s.user_id, s.expires_in, (SELECT id FROM canceled) as id
+                    FROM s
+                """, params)
                 
                 booking = cur.fetchone()
                 if not booking:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Недействительный токен'}),
+                        'isBase64Encoded': False
+                    }
+                remember_session(token_hash, booking)
+                
+                if not booking['id']:
                     return {
                         'statusCode': 404,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -229,26 +1498,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                cur.execute("""
-                    UPDATE bookings
-                    SET status = 'canceled',
-                        cancel_date = CURRENT_TIMESTAMP,
-                        cancel_reason = %s
-                    WHERE id = %s
-                """, (cancel_reason, booking_id))
-                
-                cur.execute("""
-                    UPDATE training_slots
-                    SET status = 'available'
-                    WHERE id = %s
-                """, (booking['slot_id'],))
-                
-                cur.execute("""
-                    UPDATE subscriptions
-                    SET used_sessions = used_sessions - 1
-                    WHERE id = %s
-                """, (booking['subscription_id'],))
-                
                 conn.commit()
                 
                 return {
@@ -272,5 +1521,3 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': f'Ошибка сервера: {str(e)}'}),
             'isBase64Encoded': False
         }
-    finally:
-        conn.close()
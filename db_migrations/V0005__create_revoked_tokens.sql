@@ -0,0 +1,10 @@
+-- Отозванные подписанные токены (выход из системы в режиме SESSION_SIGNING_KEY)
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    id BIGSERIAL PRIMARY KEY,
+    token_hash VARCHAR(255) NOT NULL,
+    expires_epoch BIGINT NOT NULL,
+    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(token_hash)
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_epoch ON revoked_tokens(expires_epoch);
@@ -0,0 +1,53 @@
+-- Версия календаря слотов для ETag в GET /slots: растёт при любом изменении
+-- training_slots (запись, отмена, блокировка, генерация) и bookings, включая удаление строк
+CREATE TABLE IF NOT EXISTS slot_calendar_version (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    version BIGINT NOT NULL DEFAULT 1
+);
+
+INSERT INTO slot_calendar_version (id, version) VALUES (true, 1) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_slot_calendar_version() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM changed_rows) THEN
+        UPDATE slot_calendar_version SET version = version + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS training_slots_version_insert ON training_slots;
+CREATE TRIGGER training_slots_version_insert
+    AFTER INSERT ON training_slots
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_slot_calendar_version();
+
+DROP TRIGGER IF EXISTS training_slots_version_update ON training_slots;
+CREATE TRIGGER training_slots_version_update
+    AFTER UPDATE ON training_slots
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_slot_calendar_version();
+
+DROP TRIGGER IF EXISTS training_slots_version_delete ON training_slots;
+CREATE TRIGGER training_slots_version_delete
+    AFTER DELETE ON training_slots
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_slot_calendar_version();
+
+DROP TRIGGER IF EXISTS bookings_version_insert ON bookings;
+CREATE TRIGGER bookings_version_insert
+    AFTER INSERT ON bookings
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_slot_calendar_version();
+
+DROP TRIGGER IF EXISTS bookings_version_update ON bookings;
+CREATE TRIGGER bookings_version_update
+    AFTER UPDATE ON bookings
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_slot_calendar_version();
+
+DROP TRIGGER IF EXISTS bookings_version_delete ON bookings;
+CREATE TRIGGER bookings_version_delete
+    AFTER DELETE ON bookings
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_slot_calendar_version();
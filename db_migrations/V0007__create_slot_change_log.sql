@@ -0,0 +1,41 @@
+-- Журнал изменений слотов для GET /slots?since=<version>: каждая версия
+-- slot_calendar_version записывает затронутые slot_id. Хранятся последние
+-- 10000 версий, log_floor - версия, начиная с которой журнал полон.
+ALTER TABLE slot_calendar_version ADD COLUMN IF NOT EXISTS log_floor BIGINT NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS slot_changes (
+    version BIGINT NOT NULL,
+    slot_id INTEGER NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_slot_changes_version ON slot_changes(version);
+
+UPDATE slot_calendar_version SET log_floor = version;
+
+CREATE OR REPLACE FUNCTION bump_slot_calendar_version() RETURNS trigger AS $$
+DECLARE
+    retained CONSTANT BIGINT := 10000;
+    new_version BIGINT;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+        RETURN NULL;
+    END IF;
+    
+    UPDATE slot_calendar_version
+    SET version = version + 1,
+        log_floor = GREATEST(log_floor, version + 1 - retained)
+    RETURNING version INTO new_version;
+    
+    IF TG_TABLE_NAME = 'training_slots' THEN
+        INSERT INTO slot_changes (version, slot_id)
+        SELECT new_version, id FROM changed_rows;
+    ELSE
+        INSERT INTO slot_changes (version, slot_id)
+        SELECT DISTINCT new_version, slot_id FROM changed_rows WHERE slot_id IS NOT NULL;
+    END IF;
+    
+    DELETE FROM slot_changes WHERE version <= new_version - retained;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
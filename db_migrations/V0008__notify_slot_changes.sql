@@ -0,0 +1,29 @@
+-- Уведомление NOTIFY slot_changes с новой версией календаря при каждом
+-- изменении слотов; доставляется слушателям после фиксации транзакции
+CREATE OR REPLACE FUNCTION bump_slot_calendar_version() RETURNS trigger AS $$
+DECLARE
+    retained CONSTANT BIGINT := 10000;
+    new_version BIGINT;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+        RETURN NULL;
+    END IF;
+    
+    UPDATE slot_calendar_version
+    SET version = version + 1,
+        log_floor = GREATEST(log_floor, version + 1 - retained)
+    RETURNING version INTO new_version;
+    
+    IF TG_TABLE_NAME = 'training_slots' THEN
+        INSERT INTO slot_changes (version, slot_id)
+        SELECT new_version, id FROM changed_rows;
+    ELSE
+        INSERT INTO slot_changes (version, slot_id)
+        SELECT DISTINCT new_version, slot_id FROM changed_rows WHERE slot_id IS NOT NULL;
+    END IF;
+    
+    DELETE FROM slot_changes WHERE version <= new_version - retained;
+    PERFORM pg_notify('slot_changes', new_version::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,56 @@
+-- Версия профиля пользователя для кэша GET /profile: растёт при изменении
+-- самого пользователя, его записей или абонементов
+ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_version BIGINT NOT NULL DEFAULT 1;
+
+CREATE OR REPLACE FUNCTION bump_user_profile_version() RETURNS trigger AS $$
+BEGIN
+    IF NEW.profile_version = OLD.profile_version THEN
+        NEW.profile_version := OLD.profile_version + 1;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_profile_version ON users;
+CREATE TRIGGER users_profile_version
+    BEFORE UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION bump_user_profile_version();
+
+CREATE OR REPLACE FUNCTION bump_related_profile_versions() RETURNS trigger AS $$
+BEGIN
+    UPDATE users
+    SET profile_version = profile_version + 1
+    WHERE id IN (SELECT DISTINCT user_id FROM changed_rows WHERE user_id IS NOT NULL);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bookings_profile_version_insert ON bookings;
+CREATE TRIGGER bookings_profile_version_insert
+    AFTER INSERT ON bookings
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_related_profile_versions();
+
+DROP TRIGGER IF EXISTS bookings_profile_version_update ON bookings;
+CREATE TRIGGER bookings_profile_version_update
+    AFTER UPDATE ON bookings
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_related_profile_versions();
+
+DROP TRIGGER IF EXISTS subscriptions_profile_version_insert ON subscriptions;
+CREATE TRIGGER subscriptions_profile_version_insert
+    AFTER INSERT ON subscriptions
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_related_profile_versions();
+
+DROP TRIGGER IF EXISTS subscriptions_profile_version_update ON subscriptions;
+CREATE TRIGGER subscriptions_profile_version_update
+    AFTER UPDATE ON subscriptions
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_related_profile_versions();
+
+DROP TRIGGER IF EXISTS subscriptions_profile_version_delete ON subscriptions;
+CREATE TRIGGER subscriptions_profile_version_delete
+    AFTER DELETE ON subscriptions
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_related_profile_versions();
@@ -0,0 +1,9 @@
+-- Индексы под keyset-пагинацию списков в админке:
+-- клиенты по (created_at, id) от новых к старым, записи по (booking_date, booking_time, id).
+-- Курсор клиентов сравнивает (created_at, id) кортежем, поэтому created_at обязателен:
+-- строки без даты получают время миграции (при сортировке DESC они и раньше шли первыми)
+UPDATE clients SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+ALTER TABLE clients ALTER COLUMN created_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_clients_created_at_id ON clients (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_bookings_date_time_id ON bookings (booking_date, booking_time, id);
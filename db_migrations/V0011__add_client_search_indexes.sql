@@ -0,0 +1,12 @@
+-- Поиск клиентов в админке (GET /clients?q=): префиксные индексы для коротких
+-- запросов и триграммные (pg_trgm) для подстрок и похожести имени.
+-- Телефон индексируется только цифрами, чтобы «+7 (999)» и «7999» совпадали
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_clients_full_name_prefix ON clients (lower(full_name) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_clients_email_prefix ON clients (lower(email) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_clients_phone_digits_prefix ON clients ((regexp_replace(phone, '\D', '', 'g')) text_pattern_ops);
+
+CREATE INDEX IF NOT EXISTS idx_clients_full_name_trgm ON clients USING gin (lower(full_name) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_clients_email_trgm ON clients USING gin (lower(email) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_clients_phone_digits_trgm ON clients USING gin ((regexp_replace(phone, '\D', '', 'g')) gin_trgm_ops);
@@ -0,0 +1,55 @@
+-- Занятость дня битовой маской: бит i - часовой слот 09:00 + i часов (до 21:00).
+-- Маска поддерживается триггером на bookings в той же транзакции, что и
+-- запись, отмена или перенос, поэтому календарь месяца читается одним
+-- диапазоном по первичному ключу вместо generate_series на каждый день
+CREATE TABLE IF NOT EXISTS day_availability (
+    day DATE PRIMARY KEY,
+    booked_mask INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION booking_hour_bit(slot_time TIME) RETURNS integer AS $$
+    SELECT CASE
+        WHEN slot_time IS NULL
+             OR slot_time < TIME '09:00' OR slot_time > TIME '21:00'
+             OR EXTRACT(MINUTE FROM slot_time) <> 0 OR EXTRACT(SECOND FROM slot_time) <> 0 THEN 0
+        ELSE 1 << (EXTRACT(HOUR FROM slot_time)::integer - 9)
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION update_day_availability() RETURNS trigger AS $$
+DECLARE
+    old_bit integer := 0;
+    new_bit integer := 0;
+BEGIN
+    IF TG_OP <> 'INSERT' AND OLD.booking_date IS NOT NULL AND OLD.status NOT IN ('cancelled', 'canceled') THEN
+        old_bit := booking_hour_bit(OLD.booking_time);
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.booking_date IS NOT NULL AND NEW.status NOT IN ('cancelled', 'canceled') THEN
+        new_bit := booking_hour_bit(NEW.booking_time);
+    END IF;
+    IF TG_OP = 'UPDATE' AND old_bit = new_bit AND OLD.booking_date IS NOT DISTINCT FROM NEW.booking_date THEN
+        RETURN NULL;
+    END IF;
+    
+    IF old_bit <> 0 THEN
+        UPDATE day_availability SET booked_mask = booked_mask & ~old_bit WHERE day = OLD.booking_date;
+    END IF;
+    IF new_bit <> 0 THEN
+        INSERT INTO day_availability (day, booked_mask) VALUES (NEW.booking_date, new_bit)
+        ON CONFLICT (day) DO UPDATE SET booked_mask = day_availability.booked_mask | EXCLUDED.booked_mask;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bookings_day_availability ON bookings;
+CREATE TRIGGER bookings_day_availability
+    AFTER INSERT OR UPDATE OR DELETE ON bookings
+    FOR EACH ROW EXECUTE FUNCTION update_day_availability();
+
+INSERT INTO day_availability (day, booked_mask)
+SELECT booking_date, bit_or(booking_hour_bit(booking_time))
+FROM bookings
+WHERE booking_date IS NOT NULL AND status NOT IN ('cancelled', 'canceled')
+GROUP BY booking_date
+ON CONFLICT (day) DO UPDATE SET booked_mask = EXCLUDED.booked_mask;
@@ -0,0 +1,99 @@
+-- Пересечения записей проверяет сама БД: исключающее ограничение GiST по
+-- интервалу [начало, начало + duration_minutes). Отменённые записи и записи
+-- по слотам (без booking_date) не участвуют. UNIQUE(booking_date, booking_time)
+-- больше не нужен: он не учитывал длительность и не давал занять время
+-- отменённой записи
+ALTER TABLE bookings DROP CONSTRAINT IF EXISTS bookings_booking_date_booking_time_key;
+
+-- Старый UNIQUE пропускал записи, задевающие соседний час (например, 90 минут
+-- с 10:00 и запись на 11:00). Ограничение на таких строках не создастся,
+-- поэтому миграция сначала перечисляет пересекающиеся пары: одну запись
+-- из каждой нужно отменить или перенести и повторить миграцию
+DO $$
+DECLARE
+    conflicts integer;
+    sample text;
+BEGIN
+    SELECT COUNT(*), string_agg(pair, ', ' ORDER BY n) FILTER (WHERE n <= 20)
+    INTO conflicts, sample
+    FROM (
+        SELECT format('%s/%s (%s %s)', a.id, b.id, a.booking_date, a.booking_time) AS pair,
+               row_number() OVER (ORDER BY a.booking_date, a.booking_time, a.id, b.id) AS n
+        FROM bookings a
+        JOIN bookings b
+            ON b.id <> a.id
+            AND b.booking_date BETWEEN a.booking_date - 1 AND a.booking_date + 1
+            AND (b.booking_date + b.booking_time, b.id) > (a.booking_date + a.booking_time, a.id)
+            AND b.booking_date + b.booking_time < a.booking_date + a.booking_time + COALESCE(a.duration_minutes, 60) * INTERVAL '1 minute'
+        WHERE a.booking_date IS NOT NULL AND a.booking_time IS NOT NULL
+        AND b.booking_time IS NOT NULL
+        AND a.status NOT IN ('cancelled', 'canceled')
+        AND b.status NOT IN ('cancelled', 'canceled')
+    ) pairs;
+
+    IF conflicts > 0 THEN
+        RAISE EXCEPTION 'bookings_no_overlap: % пересекающихся пар записей (id/id), первые: %', conflicts, sample
+            USING HINT = 'Отмените или перенесите одну запись из каждой пары и повторите миграцию';
+    END IF;
+END $$;
+
+ALTER TABLE bookings DROP CONSTRAINT IF EXISTS bookings_no_overlap;
+ALTER TABLE bookings ADD CONSTRAINT bookings_no_overlap EXCLUDE USING gist (
+    tsrange(
+        booking_date + booking_time,
+        booking_date + booking_time + COALESCE(duration_minutes, 60) * INTERVAL '1 minute'
+    ) WITH &&
+) WHERE (booking_date IS NOT NULL AND booking_time IS NOT NULL AND status NOT IN ('cancelled', 'canceled'));
+
+-- Маска дня теперь отмечает все часовые слоты, которые задевает запись.
+-- Соседние записи могут делить один час, поэтому при снятии записи маска дня
+-- пересчитывается под блокировкой строки, а не гасится битом
+CREATE OR REPLACE FUNCTION booking_hours_mask(start_time TIME, duration_minutes INTEGER) RETURNS integer AS $$
+    SELECT COALESCE(bit_or(1 << (hour - 9)), 0)
+    FROM generate_series(9, 21) AS hour
+    WHERE hour * 60 < EXTRACT(EPOCH FROM start_time) / 60 + COALESCE(duration_minutes, 60)
+      AND (hour + 1) * 60 > EXTRACT(EPOCH FROM start_time) / 60
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION update_day_availability() RETURNS trigger AS $$
+DECLARE
+    old_mask integer := 0;
+    new_mask integer := 0;
+BEGIN
+    IF TG_OP <> 'INSERT' AND OLD.booking_date IS NOT NULL AND OLD.status NOT IN ('cancelled', 'canceled') THEN
+        old_mask := booking_hours_mask(OLD.booking_time, OLD.duration_minutes);
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.booking_date IS NOT NULL AND NEW.status NOT IN ('cancelled', 'canceled') THEN
+        new_mask := booking_hours_mask(NEW.booking_time, NEW.duration_minutes);
+    END IF;
+    IF TG_OP = 'UPDATE' AND old_mask = new_mask AND OLD.booking_date IS NOT DISTINCT FROM NEW.booking_date THEN
+        RETURN NULL;
+    END IF;
+    
+    IF old_mask <> 0 THEN
+        PERFORM 1 FROM day_availability WHERE day = OLD.booking_date FOR UPDATE;
+        UPDATE day_availability
+        SET booked_mask = (
+            SELECT COALESCE(bit_or(booking_hours_mask(b.booking_time, b.duration_minutes)), 0)
+            FROM bookings b
+            WHERE b.booking_date = OLD.booking_date
+            AND b.status NOT IN ('cancelled', 'canceled')
+        )
+        WHERE day = OLD.booking_date;
+    END IF;
+    IF new_mask <> 0 THEN
+        INSERT INTO day_availability (day, booked_mask) VALUES (NEW.booking_date, new_mask)
+        ON CONFLICT (day) DO UPDATE SET booked_mask = day_availability.booked_mask | EXCLUDED.booked_mask;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP FUNCTION IF EXISTS booking_hour_bit(TIME);
+
+DELETE FROM day_availability;
+INSERT INTO day_availability (day, booked_mask)
+SELECT booking_date, bit_or(booking_hours_mask(booking_time, duration_minutes))
+FROM bookings
+WHERE booking_date IS NOT NULL AND status NOT IN ('cancelled', 'canceled')
+GROUP BY booking_date;
@@ -0,0 +1,15 @@
+-- Сохранённые ответы на POST/PUT с заголовком Idempotency-Key.
+-- status_code IS NULL - запрос ещё выполняется. Просроченные строки
+-- удаляются пачками самими функциями (индекс по expires_at)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope VARCHAR(128) NOT NULL,
+    idempotency_key VARCHAR(255) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    status_code INTEGER,
+    body TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (scope, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at);
@@ -0,0 +1,7 @@
+-- Индексы под горячие запросы, найденные backend/bench/explain_hot_queries.py:
+-- выбор активного абонемента при бронировании и в профиле, бронь слота в календаре,
+-- записи пользователя в профиле
+CREATE INDEX IF NOT EXISTS idx_subscriptions_user_active ON subscriptions (user_id, end_date) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS idx_subscriptions_user_id ON subscriptions (user_id);
+CREATE INDEX IF NOT EXISTS idx_bookings_slot_active ON bookings (slot_id) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS idx_bookings_user_status ON bookings (user_id, status);
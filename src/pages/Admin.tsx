@@ -34,6 +34,9 @@ const Admin = () => {
   const [selectedDate, setSelectedDate] = useState<Date | undefined>(new Date());
   const [clients, setClients] = useState<Client[]>([]);
   const [bookings, setBookings] = useState<Booking[]>([]);
+  const [clientsCursor, setClientsCursor] = useState<string | null>(null);
+  const [bookingsCursor, setBookingsCursor] = useState<string | null>(null);
+  const [clientQuery, setClientQuery] = useState('');
   const [loading, setLoading] = useState(false);
   const [showBlockDialog, setShowBlockDialog] = useState(false);
   const [blockTime, setBlockTime] = useState('');
@@ -43,16 +46,28 @@ const Admin = () => {
   const BOOKINGS_URL = 'https://functions.poehali.dev/8dc5cb8b-3bb0-4eff-9493-2bd47e21a69e';
 
   useEffect(() => {
-    loadClients();
     loadBookings();
   }, []);
 
-  const loadClients = async () => {
-    setLoading(true);
+  useEffect(() => {
+    const query = clientQuery.trim();
+    const timer = setTimeout(() => {
+      if (query.length >= 2) {
+        searchClients(query);
+      } else if (query.length === 0) {
+        loadClients();
+      }
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [clientQuery]);
+
+  const loadClients = async (cursor?: string) => {
+    setLoading(!cursor);
     try {
-      const response = await fetch(CLIENTS_URL);
+      const response = await fetch(cursor ? `${CLIENTS_URL}?cursor=${encodeURIComponent(cursor)}` : CLIENTS_URL);
       const data = await response.json();
-      setClients(data.clients || []);
+      setClients(prev => cursor ? [...prev, ...(data.clients || [])] : (data.clients || []));
+      setClientsCursor(data.next_cursor || null);
     } catch (error) {
       toast({
         title: "Ошибка загрузки",
@@ -64,11 +79,27 @@ const Admin = () => {
     }
   };
 
-  const loadBookings = async () => {
+  const searchClients = async (query: string) => {
+    try {
+      const response = await fetch(`${CLIENTS_URL}?q=${encodeURIComponent(query)}`);
+      const data = await response.json();
+      setClients(data.clients || []);
+      setClientsCursor(null);
+    } catch (error) {
+      toast({
+        title: "Ошибка поиска",
+        description: "Не удалось найти клиентов",
+        variant: "destructive"
+      });
+    }
+  };
+
+  const loadBookings = async (cursor?: string) => {
     try {
-      const response = await fetch(BOOKINGS_URL);
+      const response = await fetch(cursor ? `${BOOKINGS_URL}?cursor=${encodeURIComponent(cursor)}` : BOOKINGS_URL);
       const data = await response.json();
-      setBookings(data.bookings || []);
+      setBookings(prev => cursor ? [...prev, ...(data.bookings || [])] : (data.bookings || []));
+      setBookingsCursor(data.next_cursor || null);
     } catch (error) {
       toast({
         title: "Ошибка загрузки",
@@ -162,7 +193,7 @@ const Admin = () => {
               <h3 className="text-sm font-medium text-muted-foreground">Всего клиентов</h3>
               <Icon name="Users" className="text-primary" size={20} />
             </div>
-            <p className="text-3xl font-bold">{clients.length}</p>
+            <p className="text-3xl font-bold">{clients.length}{clientsCursor ? '+' : ''}</p>
           </Card>
 
           <Card className="p-6">
@@ -178,7 +209,7 @@ const Admin = () => {
               <h3 className="text-sm font-medium text-muted-foreground">Предстоящих</h3>
               <Icon name="Clock" className="text-primary" size={20} />
             </div>
-            <p className="text-3xl font-bold">{upcomingBookings.length}</p>
+            <p className="text-3xl font-bold">{upcomingBookings.length}{bookingsCursor ? '+' : ''}</p>
           </Card>
         </div>
 
@@ -250,6 +281,13 @@ const Admin = () => {
                 </Button>
               </div>
 
+              <Input
+                className="mb-4"
+                placeholder="Поиск по имени, телефону или email"
+                value={clientQuery}
+                onChange={(e) => setClientQuery(e.target.value)}
+              />
+
               <div className="rounded-md border">
                 <Table>
                   <TableHeader>
@@ -292,6 +330,11 @@ const Admin = () => {
                   </TableBody>
                 </Table>
               </div>
+              {clientsCursor && (
+                <Button variant="outline" className="w-full mt-4" onClick={() => loadClients(clientsCursor)}>
+                  Показать ещё
+                </Button>
+              )}
             </Card>
           </TabsContent>
 
@@ -350,6 +393,11 @@ const Admin = () => {
                   </TableBody>
                 </Table>
               </div>
+              {bookingsCursor && (
+                <Button variant="outline" className="w-full mt-4" onClick={() => loadBookings(bookingsCursor)}>
+                  Показать ещё
+                </Button>
+              )}
             </Card>
           </TabsContent>
         </Tabs>